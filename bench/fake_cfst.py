@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# d:\桌面\cloudflare-ip-optimizer-main\bench\fake_cfst.py
+"""
+模拟 cfst 的可执行文件：按 cfst 的格式输出进度条和结果表格，并写出指定行数的 result.csv。
+通过环境变量控制规模和耗时:
+  FAKE_CFST_ROWS   结果行数（默认 1000）
+  FAKE_CFST_DELAY  延迟测速阶段的总耗时（秒，默认 0），进度条在此期间均匀刷新
+  FAKE_CFST_SEED   随机种子（默认 1）
+"""
+import csv
+import os
+import random
+import sys
+import time
+
+HEADERS = ['IP 地址', '已发送', '已接收', '丢包率', '平均延迟', '下载速度 (MB/s)', '地区码']
+COLOS = ['HKG', 'NRT', 'SIN', 'LAX', 'SJC', 'FRA', 'AMS', 'ICN']
+# 进度条最多刷新的次数，避免大规模结果时输出过多
+PROGRESS_STEPS = 200
+
+
+def generate_rows(count: int, seed: int = 1) -> list[list[str]]:
+    """生成 count 行按 (丢包率, 平均延迟) 排序的测速结果，IP 从 104.16.0.0 开始顺序分配"""
+    rng = random.Random(seed)
+    base = (104 << 24) | (16 << 16)
+    rows = []
+    for index in range(count):
+        value = base + index
+        ip = f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+        received = 4 if rng.random() > 0.1 else rng.randint(1, 3)
+        rows.append([
+            ip, '4', str(received), f"{(4 - received) / 4:.2f}", f"{rng.uniform(40, 400):.2f}",
+            f"{rng.uniform(0, 30):.2f}", rng.choice(COLOS),
+        ])
+    rows.sort(key=lambda r: (float(r[3]), float(r[4])))
+    return rows
+
+
+def write_csv(path: str, rows: list[list[str]]) -> None:
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(HEADERS)
+        writer.writerows(rows)
+
+
+def _arg(args, name, default=None):
+    if name in args:
+        index = args.index(name)
+        if index + 1 < len(args):
+            return args[index + 1]
+    return default
+
+
+def main():
+    args = sys.argv[1:]
+    output = _arg(args, '-o', 'result.csv')
+    rows_count = int(os.getenv('FAKE_CFST_ROWS', '1000'))
+    delay = float(os.getenv('FAKE_CFST_DELAY', '0'))
+    seed = int(os.getenv('FAKE_CFST_SEED', '1'))
+    total = max(rows_count, 1)
+
+    out = sys.stdout
+    out.write("# XIU2/CloudflareSpeedTest v2.2.5 (fake)\n\n")
+    out.write("开始延迟测速（模式：TCP, 端口：443, 范围：0 ~ 9999 ms, 丢包：1.00)\n")
+    steps = min(PROGRESS_STEPS, total)
+    for step in range(1, steps + 1):
+        done = total * step // steps
+        out.write(f"\r{done} / {total} [{'-' * (20 * step // steps)}>] 可用: {rows_count * step // steps}")
+        out.flush()
+        if delay:
+            time.sleep(delay / steps)
+    out.write("\n\n")
+
+    rows = generate_rows(rows_count, seed)
+    write_csv(output, rows)
+
+    out.write("IP 地址           已发送  已接收  丢包率  平均延迟  下载速度 (MB/s)  地区码\n")
+    for row in rows[:10]:
+        out.write(f"{row[0]:<17} {row[1]:<7} {row[2]:<7} {row[3]:<7} {row[4]:<9} {row[5]:<16} {row[6]}\n")
+    out.write(f"\n完整测速结果已写入 {output} 文件，可使用记事本/表格软件查看。\n")
+    out.flush()
+
+
+if __name__ == '__main__':
+    main()
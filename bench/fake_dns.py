@@ -0,0 +1,89 @@
+# d:\桌面\cloudflare-ip-optimizer-main\bench\fake_dns.py
+"""
+模拟华为云 DNS v2 API 的本地 HTTP 服务：在内存中保存记录集，
+支持查询 (GET .../recordsets)、新增 (POST /v2/zones/<zone>/recordsets)、修改 (PUT .../recordsets/<id>)
+和删除 (DELETE .../recordsets/<id>)。
+不校验签名，可配置每个请求的模拟延迟。
+"""
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+
+class FakeHuaweiDns:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.recordsets = {}
+        self.requests = []
+        self._server = None
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _body(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                return json.loads(self.rfile.read(length) or b'{}')
+
+            def _handle(self):
+                fake.requests.append((self.command, self.path))
+                if fake.latency:
+                    time.sleep(fake.latency)
+                url = urlparse(self.path)
+                parts = [p for p in url.path.split('/') if p]
+                with fake._lock:
+                    if self.command == 'GET' and parts[-1] == 'recordsets':
+                        query = parse_qs(url.query)
+                        records = [r for r in fake.recordsets.values()
+                                   if (not query.get('name') or r['name'] == query['name'][0])
+                                   and (not query.get('type') or r.get('type') == query['type'][0])]
+                        return self._reply(200, {'recordsets': records, 'metadata': {'total_count': len(records)}})
+                    if self.command == 'POST' and parts[-1] == 'recordsets':
+                        body = self._body()
+                        record = {'id': uuid.uuid4().hex, 'zone_id': parts[-2], 'line': 'default_view', **body}
+                        fake.recordsets[record['id']] = record
+                        return self._reply(202, record)
+                    if self.command == 'PUT' and len(parts) >= 2 and parts[-2] == 'recordsets':
+                        record = fake.recordsets.get(parts[-1])
+                        if record is None:
+                            return self._reply(404, {'code': 'DNS.0312', 'message': 'recordset not found'})
+                        record.update(self._body())
+                        return self._reply(202, record)
+                    if self.command == 'DELETE' and len(parts) >= 2 and parts[-2] == 'recordsets':
+                        record = fake.recordsets.pop(parts[-1], None)
+                        if record is None:
+                            return self._reply(404, {'code': 'DNS.0312', 'message': 'recordset not found'})
+                        return self._reply(202, record)
+                return self._reply(404, {'code': 'DNS.0000', 'message': 'not found'})
+
+            do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="FakeHuaweiDns", daemon=True).start()
+        return self.endpoint
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
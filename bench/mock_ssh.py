@@ -0,0 +1,209 @@
+# d:\桌面\cloudflare-ip-optimizer-main\bench\mock_ssh.py
+"""
+本地 paramiko SSH/SFTP 模拟服务器，所有远程路径映射到 root 目录下。
+支持 SFTP 子系统以及更新流程中用到的远程命令（mv、sha256sum、md5sum），
+sleep 用于模拟卡住的更新后命令，其余命令直接返回成功。
+"""
+import hashlib
+import os
+import shlex
+import socket
+import threading
+import time
+import paramiko
+
+
+class _SFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class _SFTPInterface(paramiko.SFTPServerInterface):
+    def __init__(self, server, root, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.root = root
+
+    def _path(self, path):
+        return os.path.join(self.root, self.canonicalize(path).lstrip('/'))
+
+    def list_folder(self, path):
+        local = self._path(path)
+        try:
+            result = []
+            for name in os.listdir(local):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                result.append(attr)
+            return result
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._path(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    lstat = stat
+
+    def open(self, path, flags, attr):
+        local = self._path(path)
+        try:
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+            fd = os.open(local, flags | getattr(os, 'O_BINARY', 0), 0o644)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = 'ab' if flags & os.O_APPEND else 'wb'
+        elif flags & os.O_RDWR:
+            mode = 'a+b' if flags & os.O_APPEND else 'r+b'
+        else:
+            mode = 'rb'
+        handle = _SFTPHandle(flags)
+        handle.filename = local
+        handle.readfile = handle.writefile = os.fdopen(fd, mode)
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._path(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.replace(self._path(oldpath), self._path(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    posix_rename = rename
+
+    def mkdir(self, path, attr):
+        try:
+            os.makedirs(self._path(path), exist_ok=True)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class _ServerInterface(paramiko.ServerInterface):
+    def __init__(self, mock):
+        self.mock = mock
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        if (username, password) == (self.mock.username, self.mock.password):
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        threading.Thread(target=self.mock.run_command, args=(channel, command.decode('utf-8')), daemon=True).start()
+        return True
+
+
+class MockSSHServer:
+    """在 127.0.0.1 的随机端口上监听的 SSH/SFTP 服务器，用于离线基准测试"""
+
+    def __init__(self, root: str, username: str = 'root', password: str = 'password'):
+        self.root = root
+        self.username = username
+        self.password = password
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.commands = []
+        self.connections = 0
+        self._sock = None
+        self._transports = []
+        self._stopped = threading.Event()
+
+    def local_path(self, remote_path: str) -> str:
+        return os.path.join(self.root, remote_path.lstrip('/'))
+
+    def start(self) -> int:
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        threading.Thread(target=self._accept_loop, name="MockSSH", daemon=True).start()
+        return self._sock.getsockname()[1]
+
+    def stop(self):
+        self._stopped.set()
+        for transport in self._transports:
+            transport.close()
+        if self._sock:
+            self._sock.close()
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            self.connections += 1
+            transport = paramiko.Transport(conn)
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler('sftp', paramiko.SFTPServer, _SFTPInterface, self.root)
+            self._transports.append(transport)
+            try:
+                transport.start_server(server=_ServerInterface(self))
+            except paramiko.SSHException:
+                transport.close()
+
+    def run_command(self, channel, command: str):
+        self.commands.append(command)
+        status, out, err = self._execute(command)
+        if out:
+            channel.sendall(out.encode('utf-8'))
+        if err:
+            channel.sendall_stderr(err.encode('utf-8'))
+        channel.send_exit_status(status)
+        # 只发送 EOF 而不主动关闭通道：此时 exec 请求的确认消息可能尚未发出，
+        # 提前关闭会让客户端误报 "Channel closed"。通道由客户端关闭。
+        channel.shutdown_write()
+
+    def _execute(self, command: str) -> tuple[int, str, str]:
+        try:
+            argv = shlex.split(command)
+        except ValueError as e:
+            return 2, '', str(e)
+        if not argv:
+            return 0, '', ''
+
+        name, args = argv[0], [arg for arg in argv[1:] if not arg.startswith('-')]
+        try:
+            if name == 'mv' and len(args) == 2:
+                os.replace(self.local_path(args[0]), self.local_path(args[1]))
+                return 0, '', ''
+            if name in ('sha256sum', 'md5sum') and args:
+                digest = hashlib.sha256 if name == 'sha256sum' else hashlib.md5
+                lines = []
+                for path in args:
+                    with open(self.local_path(path), 'rb') as f:
+                        lines.append(f"{digest(f.read()).hexdigest()}  {path}")
+                return 0, '\n'.join(lines) + '\n', ''
+            if name == 'sleep' and args:
+                time.sleep(float(args[0]))
+                return 0, '', ''
+        except OSError as e:
+            return 1, '', f"{name}: {e}"
+        # 其它命令（例如重启服务）视为成功
+        return 0, '', ''
@@ -0,0 +1,477 @@
+# d:\桌面\cloudflare-ip-optimizer-main\bench\run_bench.py
+"""
+离线基准测试：使用模拟的 cfst、本地 SSH/SFTP 服务器和模拟的华为云 DNS API，
+在不依赖真实网络和路由器的情况下测量各环节耗时，并以 JSON 输出结果。
+
+用法（在项目根目录执行）:
+  python -m bench.run_bench                       # 完整测试，结果输出到标准输出
+  python -m bench.run_bench --quick -o out.json   # 小规模快速测试
+  python -m bench.run_bench --baseline old.json   # 与基线比较，中位耗时变慢超过阈值时退出码为 1
+"""
+import argparse
+import configparser
+import importlib.util
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(BENCH_DIR)
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+from src.optimizer import CloudflareOptimizer  # noqa: E402
+from src.api import create_app  # noqa: E402
+from src.state import app_state  # noqa: E402
+from src.logbuffer import RingBufferHandler  # noqa: E402
+from src.ssh_pool import close_all  # noqa: E402
+from src import updater  # noqa: E402
+from bench.fake_cfst import generate_rows, write_csv  # noqa: E402
+from bench.mock_ssh import MockSSHServer  # noqa: E402
+from bench.fake_dns import FakeHuaweiDns  # noqa: E402
+
+FAKE_CFST = os.path.join(BENCH_DIR, 'fake_cfst.py')
+SSH_USER, SSH_PASSWORD = 'root', 'bench'
+HOSTS_PATH = '/etc/hosts'
+ADGUARD_PATH = '/etc/AdGuardHome.yaml'
+CHECKSUM_HOSTS_PATH = '/etc/hosts.checksum'
+# 推送完成的状态
+TERMINAL_STATES = ('ok', 'failed', 'timeout', 'superseded')
+# 华为云 SDK 未安装时跳过 DNS 相关测试（只检查是否可以导入，不实际导入）
+HUAWEI_SDK = importlib.util.find_spec('huaweicloudsdkdns') is not None
+
+FULL_SIZES = {'rows': [10, 1000, 100_000, 1_000_000], 'hosts_lines': [1000, 10_000, 100_000],
+              'rewrites': [100, 1000, 10_000], 'api_requests': 5000, 'pipeline_rows': 10_000}
+QUICK_SIZES = {'rows': [10, 1000, 10_000], 'hosts_lines': [1000, 10_000], 'rewrites': [100, 1000],
+               'api_requests': 1000, 'pipeline_rows': 1000}
+
+
+def measure(func, repeat: int, setup=None) -> dict:
+    """执行 func repeat 次（每次之前执行 setup，不计入耗时），返回耗时统计（秒）"""
+    timings = []
+    for _ in range(max(1, repeat)):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {'runs': len(timings), 'min_s': round(min(timings), 6), 'median_s': round(statistics.median(timings), 6),
+            'mean_s': round(statistics.fmean(timings), 6)}
+
+
+def repeat_for(size: int, base: int) -> int:
+    """大规模数据减少重复次数"""
+    return base if size <= 10_000 else max(1, base // 3)
+
+
+def percentile(values: list[float], pct: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def random_ip(rng: random.Random) -> str:
+    return f"104.{rng.randint(16, 31)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def make_hosts_content(lines: int, domains: int = 50) -> str:
+    filler = [f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255} host{i}.lan" for i in range(lines)]
+    block = [updater.START_MARKER] + [f"1.1.1.1 cf{i}.example.com" for i in range(domains)] + [updater.END_MARKER]
+    middle = len(filler) // 2
+    return '\n'.join(filler[:middle] + block + filler[middle:]) + '\n'
+
+
+def make_adguard_content(rewrites: int) -> str:
+    lines = ['http:', '  address: 0.0.0.0:3000', 'dns:', '  bind_hosts:', '    - 0.0.0.0', '  port: 53',
+             '  upstream_dns:'] + [f"    - https://dns{i}.example.net/dns-query" for i in range(200)]
+    lines += ['filtering:', '  protection_enabled: true', '  rewrites:']
+    for i in range(rewrites):
+        lines += [f"    - domain: cf{i}.example.com", "      answer: 1.1.1.1"]
+    lines += ['  safe_search:', '    enabled: false', 'schema_version: 28']
+    return '\n'.join(lines) + '\n'
+
+
+def make_config() -> configparser.ConfigParser:
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'cfst': {'params': '-n 200 -t 4 -tl 9999 -o result.csv', 'mode': 'cfst', 'stall_timeout': '0'},
+        'History': {'enabled': 'false', 'db_file': 'history.db'},
+        'Publish': {'max_workers': '4', 'timeout': '60', 'retries': '0'},
+    })
+    return config
+
+
+def stop_server(server, thread: threading.Thread):
+    """在 waitress 的事件循环线程内关闭所有连接和监听套接字，循环随之退出，避免从其他线程关闭引发 EBADF"""
+    def close_all():
+        for channel in list(server._map.values()):
+            channel.close()
+
+    server.trigger.pull_trigger(close_all)
+    thread.join(timeout=5)
+    server.task_dispatcher.shutdown()
+
+
+def make_optimizer(workdir: str, config: configparser.ConfigParser) -> CloudflareOptimizer:
+    optimizer = CloudflareOptimizer(config, config_dir=workdir)
+    # 使用模拟的 cfst 可执行文件
+    optimizer.tool_dir = workdir
+    optimizer.tool_path = FAKE_CFST
+    return optimizer
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.sizes = QUICK_SIZES if args.quick else FULL_SIZES
+        self.workdir = tempfile.mkdtemp(prefix='cfopt_bench_')
+        self.results = []
+
+    def add(self, name: str, params: dict = None, **fields):
+        entry = {'name': name, 'params': params or {}, **fields}
+        self.results.append(entry)
+        logging.warning(f"[bench] {name} {entry['params']}: "
+                        f"{fields.get('median_s', fields.get('skipped', ''))}")
+
+    # ===== 结果解析 =====
+
+    def bench_parse_results(self):
+        for history in (False, True):
+            config = make_config()
+            config['History']['enabled'] = str(history).lower()
+            optimizer = make_optimizer(self.workdir, config)
+            for rows in self.sizes['rows']:
+                write_csv(optimizer.output_filepath, generate_rows(rows))
+                name = 'parse_results_with_history' if history else 'parse_results'
+                self.add(name, {'rows': rows}, **measure(optimizer._parse_results, repeat_for(rows, self.args.repeat)))
+            if optimizer.history:
+                optimizer.history.close()
+
+    # ===== cfst 调用（流式读取进度） =====
+
+    def bench_cfst_run(self):
+        optimizer = make_optimizer(self.workdir, make_config())
+        for rows in self.sizes['rows']:
+            os.environ['FAKE_CFST_ROWS'] = str(rows)
+
+            def run():
+                from src.runner import RunTracker
+                if not optimizer._run_cfst(optimizer.params, RunTracker('cfst')):
+                    raise RuntimeError('模拟 cfst 运行失败')
+
+            self.add('cfst_run', {'rows': rows}, **measure(run, repeat_for(rows, self.args.repeat)))
+
+    # ===== 文件内容处理 =====
+
+    def bench_process_content(self):
+        rng = random.Random(1)
+        for lines in self.sizes['hosts_lines']:
+            content = make_hosts_content(lines)
+            self.add('process_hosts_content', {'lines': lines}, **measure(
+                lambda: updater._process_hosts_content(content, random_ip(rng)), repeat_for(lines, self.args.repeat)))
+        for rewrites in self.sizes['rewrites']:
+            content = make_adguard_content(rewrites)
+            self.add('process_adguard_content', {'rewrites': rewrites}, **measure(
+                lambda: updater._process_adguard_content(content, random_ip(rng)),
+                repeat_for(rewrites * 10, self.args.repeat)))
+
+    # ===== API 并发压测 =====
+
+    def bench_api(self):
+        from waitress.server import create_server
+
+        optimizer = make_optimizer(self.workdir, make_config())
+        write_csv(optimizer.output_filepath, generate_rows(1000))
+        optimizer._parse_results()
+        app = create_app(optimizer, os.path.join(ROOT_DIR, 'templates'), os.path.join(ROOT_DIR, 'static'))
+        log_buffer = RingBufferHandler(2000)
+        log_buffer.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        for i in range(2000):
+            log_buffer.emit(logging.makeLogRecord({'msg': f"bench log line {i}", 'levelname': 'INFO'}))
+        app.config['LOG_BUFFER'] = log_buffer
+
+        server = create_server(app, host='127.0.0.1', port=0, threads=self.args.api_threads)
+        server_thread = threading.Thread(target=server.run, name='BenchWaitress', daemon=True)
+        server_thread.start()
+        base_url = f"http://127.0.0.1:{server.effective_port}"
+
+        etag = requests.get(f"{base_url}/api/results").headers.get('ETag')
+        cases = [
+            ('/api/best_ip', {}),
+            ('/api/results', {}),
+            ('/api/results', {'If-None-Match': etag}),
+            ('/api/results', {'Accept-Encoding': 'gzip'}),
+            ('/api/run_status', {}),
+            ('/api/logs?since=0&limit=200', {}),
+        ]
+        total = self.sizes['api_requests']
+        concurrency = self.args.concurrency
+        try:
+            for path, headers in cases:
+                local = threading.local()
+
+                def request_once(_):
+                    session = getattr(local, 'session', None)
+                    if session is None:
+                        session = local.session = requests.Session()
+                    start = time.perf_counter()
+                    resp = session.get(f"{base_url}{path}", headers=headers)
+                    resp.content
+                    return time.perf_counter() - start, resp.status_code
+
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    samples = list(executor.map(request_once, range(total)))
+                elapsed = time.perf_counter() - start
+                latencies = [latency for latency, _ in samples]
+                errors = sum(1 for _, status in samples if status >= 400)
+                self.add('api', {'path': path, 'headers': sorted(headers), 'concurrency': concurrency},
+                         requests=total, errors=errors, rps=round(total / elapsed, 1),
+                         median_s=round(statistics.median(latencies), 6),
+                         p95_s=round(percentile(latencies, 95), 6), p99_s=round(percentile(latencies, 99), 6))
+        finally:
+            stop_server(server, server_thread)
+
+    # ===== SSH 推送 =====
+
+    def start_ssh(self):
+        root = os.path.join(self.workdir, 'router')
+        os.makedirs(os.path.join(root, 'etc'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'tmp'), exist_ok=True)
+        server = MockSSHServer(root, SSH_USER, SSH_PASSWORD)
+        return server, server.start()
+
+    def ssh_sections(self, config, port, hosts_lines, rewrites, server):
+        with open(server.local_path(HOSTS_PATH), 'w', encoding='utf-8') as f:
+            f.write(make_hosts_content(hosts_lines))
+        with open(server.local_path(CHECKSUM_HOSTS_PATH), 'w', encoding='utf-8') as f:
+            f.write(make_hosts_content(hosts_lines))
+        with open(server.local_path(ADGUARD_PATH), 'w', encoding='utf-8') as f:
+            f.write(make_adguard_content(rewrites))
+        common = {'enabled': 'true', 'host': '127.0.0.1', 'port': str(port), 'username': SSH_USER,
+                  'password': SSH_PASSWORD, 'post_update_command': '/etc/init.d/dnsmasq restart'}
+        config.read_dict({
+            'OpenWRT': {**common, 'target': 'openwrt', 'openwrt_hosts_path': HOSTS_PATH},
+            'OpenWRT:checksum': {**common, 'target': 'openwrt', 'openwrt_hosts_path': CHECKSUM_HOSTS_PATH,
+                                 'sync_mode': 'checksum'},
+            'OpenWRT:adguard': {**common, 'target': 'adguardhome', 'adguardhome_config_path': ADGUARD_PATH},
+        })
+
+    def bench_ssh(self):
+        server, port = self.start_ssh()
+        rng = random.Random(2)
+        config = make_config()
+        try:
+            for hosts_lines, rewrites in zip(self.sizes['hosts_lines'], self.sizes['rewrites']):
+                self.ssh_sections(config, port, hosts_lines, rewrites, server)
+                for target, func, section, size in (
+                        ('openwrt', updater.update_openwrt_hosts, 'OpenWRT', {'lines': hosts_lines}),
+                        ('openwrt_checksum', updater.update_openwrt_hosts, 'OpenWRT:checksum', {'lines': hosts_lines}),
+                        ('adguardhome', updater.update_adguard_hosts, 'OpenWRT:adguard', {'rewrites': rewrites})):
+                    def push(ip=None):
+                        if not func(config[section], ip or random_ip(rng)):
+                            raise RuntimeError(f"推送到模拟 SSH 服务器失败 ({target})")
+
+                    self.add('ssh_push_cold', {'target': target, **size}, **measure(push, 3, setup=close_all))
+                    push()
+                    self.add('ssh_push_warm', {'target': target, **size}, **measure(push, self.args.repeat))
+                    # 最优 IP 未变化时的重复推送
+                    push('1.0.0.1')
+                    self.add('ssh_push_noop', {'target': target, **size}, **measure(
+                        lambda: push('1.0.0.1'), self.args.repeat))
+        finally:
+            close_all()
+            server.stop()
+
+    # ===== 华为云 DNS 发布 =====
+
+    def dns_publisher(self, endpoint):
+        from src.huawei_dns_update import HuaweiDnsPublisher
+        return HuaweiDnsPublisher('ak', 'sk', 'project', 'zone', domain='bench.example.com.', endpoint=endpoint)
+
+    def bench_dns(self):
+        if not HUAWEI_SDK:
+            self.add('dns_publish', skipped="华为云 SDK 未安装: huaweicloudsdkdns")
+            return
+
+        fake = FakeHuaweiDns(latency=self.args.dns_latency)
+        endpoint = fake.start()
+        rng = random.Random(3)
+        try:
+            publisher = self.dns_publisher(endpoint)
+            self.add('dns_publish_changed', {'latency': self.args.dns_latency}, **measure(
+                lambda: publisher.publish([random_ip(rng) for _ in range(10)]), self.args.repeat))
+            ips = [random_ip(rng) for _ in range(10)]
+            publisher.publish(ips)
+            self.add('dns_publish_unchanged', {}, **measure(lambda: publisher.publish(ips), self.args.repeat))
+            self.add('dns_publish_force', {'latency': self.args.dns_latency}, **measure(
+                lambda: publisher.publish(ips, force=True), self.args.repeat))
+        finally:
+            fake.stop()
+
+    # ===== 完整流程：测速 -> 解析 -> 推送 =====
+
+    def bench_pipeline(self):
+        server, port = self.start_ssh()
+        fake_dns = None
+        rows = self.sizes['pipeline_rows']
+        config = make_config()
+        self.ssh_sections(config, port, self.sizes['hosts_lines'][0], self.sizes['rewrites'][0], server)
+        if HUAWEI_SDK:
+            fake_dns = FakeHuaweiDns(latency=self.args.dns_latency)
+            config.read_dict({'HuaweiDNS': {'enabled': 'true', 'ak': 'ak', 'sk': 'sk', 'project_id': 'project',
+                                            'zone_id': 'zone', 'domain': 'bench.example.com.',
+                                            'endpoint': fake_dns.start()}})
+
+        optimizer = make_optimizer(self.workdir, config)
+        os.environ['FAKE_CFST_ROWS'] = str(rows)
+        os.environ['FAKE_CFST_DELAY'] = str(self.args.cfst_delay)
+        scan_times, publish_times = [], []
+
+        def run():
+            os.environ['FAKE_CFST_SEED'] = str(random.randint(1, 1_000_000))
+            start = time.perf_counter()
+            optimizer.run_speed_test()
+            scanned = time.perf_counter()
+            targets = [name for name, _ in optimizer.publisher.targets()]
+            deadline = time.time() + 120
+            while time.time() < deadline:
+                if all(app_state.push_status.get(name, {}).get('state') in TERMINAL_STATES for name in targets):
+                    break
+                time.sleep(0.005)
+            failed = {name: app_state.push_status[name] for name in targets
+                      if app_state.push_status.get(name, {}).get('state') != 'ok'}
+            if failed:
+                raise RuntimeError(f"推送未全部成功: {failed}")
+            scan_times.append(scanned - start)
+            publish_times.append(time.perf_counter() - scanned)
+
+        try:
+            stats = measure(run, self.args.repeat)
+            self.add('pipeline', {'rows': rows, 'cfst_delay': self.args.cfst_delay,
+                                  'targets': [name for name, _ in optimizer.publisher.targets()]},
+                     **stats, scan_median_s=round(statistics.median(scan_times), 6),
+                     publish_median_s=round(statistics.median(publish_times), 6),
+                     ssh_connections=server.connections)
+        finally:
+            os.environ.pop('FAKE_CFST_DELAY', None)
+            close_all()
+            server.stop()
+            if fake_dns:
+                fake_dns.stop()
+
+    def run(self, only: list[str]):
+        suites = {
+            'parse': self.bench_parse_results,
+            'cfst': self.bench_cfst_run,
+            'content': self.bench_process_content,
+            'api': self.bench_api,
+            'ssh': self.bench_ssh,
+            'dns': self.bench_dns,
+            'pipeline': self.bench_pipeline,
+        }
+        try:
+            for name, suite in suites.items():
+                if not only or name in only:
+                    suite()
+        finally:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+        return self.results
+
+
+def result_key(entry: dict) -> str:
+    return f"{entry['name']} {json.dumps(entry.get('params', {}), sort_keys=True)}"
+
+
+def compare(results: list[dict], baseline: list[dict], threshold: float) -> list[dict]:
+    """返回中位耗时超过基线 threshold 倍的测试项"""
+    baseline_by_key = {result_key(entry): entry for entry in baseline if 'median_s' in entry}
+    regressions = []
+    for entry in results:
+        old = baseline_by_key.get(result_key(entry))
+        if old and 'median_s' in entry and old['median_s'] > 0:
+            ratio = entry['median_s'] / old['median_s']
+            entry['baseline_median_s'] = old['median_s']
+            entry['ratio'] = round(ratio, 3)
+            if ratio > threshold:
+                regressions.append({'key': result_key(entry), 'ratio': entry['ratio']})
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT_DIR, capture_output=True,
+                              text=True, timeout=5).stdout.strip()
+    except Exception:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cloudflare IP 优选服务离线基准测试')
+    parser.add_argument('--quick', action='store_true', help='使用较小的数据规模')
+    parser.add_argument('--only', default='', help='只运行指定的测试组，逗号分隔: parse,cfst,content,api,ssh,dns,pipeline')
+    parser.add_argument('--repeat', type=int, default=5, help='每项测试的重复次数')
+    parser.add_argument('--concurrency', type=int, default=32, help='API 压测的并发客户端数')
+    parser.add_argument('--api-threads', type=int, default=8, help='API 压测时 waitress 的工作线程数')
+    parser.add_argument('--cfst-delay', type=float, default=0.0, help='完整流程中模拟 cfst 延迟测速阶段的耗时（秒）')
+    parser.add_argument('--dns-latency', type=float, default=0.02, help='模拟 DNS API 每个请求的延迟（秒）')
+    parser.add_argument('-o', '--output', help='结果 JSON 的输出文件，默认输出到标准输出')
+    parser.add_argument('--baseline', help='用于比较的基线 JSON 文件')
+    parser.add_argument('--threshold', type=float, default=1.25, help='中位耗时超过基线该倍数时视为性能回退')
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出服务自身的 INFO 日志')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING,
+                        format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    # 压测时 waitress 会频繁打印任务队列深度的警告，paramiko 会打印模拟服务器断开连接的错误
+    logging.getLogger('waitress.queue').setLevel(logging.ERROR)
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    started = time.time()
+    only = [item.strip() for item in args.only.split(',') if item.strip()]
+    results = Bench(args).run(only)
+    report = {
+        'meta': {
+            'timestamp': started,
+            'duration_s': round(time.time() - started, 3),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'quick': args.quick,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            regressions = compare(results, json.load(f)['results'], args.threshold)
+        report['regressions'] = regressions
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if regressions:
+        logging.error(f"[bench] 发现 {len(regressions)} 项性能回退: {regressions}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\adguard_api.py
+import logging
+import threading
+import requests
+from .assignment import PublishPlan
+from . import metrics
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def _get_session(base_url: str, username: str, password: str) -> requests.Session:
+    """按 (地址, 用户名, 密码) 复用 HTTP 会话，保持 keep-alive 连接"""
+    key = (base_url, username, password)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = requests.Session()
+            if username:
+                session.auth = (username, password)
+            _sessions[key] = session
+        return session
+
+
+def diff_rewrites(current: list[dict], desired: dict[str, list[str]]):
+    """
+    比较线上的重写规则与期望的 {域名: [IP, ...]}，返回 (updates, adds, deletes)。
+    updates 为 [(旧规则, 新规则)]：同一域名下多余的旧 answer 优先改写为缺少的新 answer，
+    剩余的旧 answer 删除，仍缺少的 answer 新增；不在 desired 中的域名不做改动。
+    """
+    updates, adds, deletes = [], [], []
+    for domain, answers in desired.items():
+        existing = [entry.get('answer') for entry in current if entry.get('domain') == domain]
+        stale = [answer for answer in existing if answer not in answers]
+        missing = [answer for answer in answers if answer not in existing]
+        for old, new in zip(stale, missing):
+            updates.append(({'domain': domain, 'answer': old}, {'domain': domain, 'answer': new}))
+        deletes.extend({'domain': domain, 'answer': old} for old in stale[len(missing):])
+        adds.extend({'domain': domain, 'answer': new} for new in missing[len(stale):])
+    return updates, adds, deletes
+
+
+class AdGuardClient:
+    """AdGuard Home 重写规则 HTTP API 的最小封装"""
+
+    def __init__(self, base_url: str, username: str = '', password: str = '', timeout: float = 10):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = _get_session(self.base_url, username, password)
+
+    def _request(self, method: str, path: str, **kwargs) -> requests.Response:
+        resp = self.session.request(method, f"{self.base_url}/control/rewrite/{path}", timeout=self.timeout, **kwargs)
+        resp.raise_for_status()
+        return resp
+
+    def list(self) -> list[dict]:
+        return self._request('GET', 'list').json() or []
+
+    def add(self, entry: dict):
+        self._request('POST', 'add', json=entry)
+
+    def delete(self, entry: dict):
+        self._request('POST', 'delete', json=entry)
+
+    def update(self, old: dict, new: dict) -> bool:
+        """原地修改一条规则；AdGuard Home 版本过旧、不支持 update 接口时返回 False"""
+        resp = self.session.put(f"{self.base_url}/control/rewrite/update", json={'target': old, 'update': new},
+                                timeout=self.timeout)
+        if resp.status_code in (404, 405):
+            return False
+        resp.raise_for_status()
+        return True
+
+
+def update_adguard_api(config, best_ip: str, plan: PublishPlan = None):
+    """
+    通过 AdGuard Home 的 HTTP API 更新 DNS 重写规则：按分配方案 plan（缺省时所有域名都指向 best_ip），
+    每个域名可以有多条规则，只修改 answer 发生变化的规则，
+    无需读写整个配置文件，也无需重启 AdGuard Home。
+    API 无法连接且配置了 adguardhome_config_path 时，回退为通过 SSH 改写配置文件中的 rewrites 块。
+    成功（包括规则无需更改）返回 True，失败返回 False。
+    """
+    if not config.getboolean('enabled', fallback=False):
+        return False
+
+    plan = (plan or PublishPlan(best_ip)).for_target(config)
+    base_url = config.get('adguardhome_api_url', fallback='').strip() or f"http://{config.get('host')}:3000"
+    domains = [d.strip() for d in config.get('adguardhome_domains', fallback='').split(',') if d.strip()]
+    client = AdGuardClient(base_url, config.get('adguardhome_api_username', fallback=''),
+                           config.get('adguardhome_api_password', fallback=''),
+                           timeout=config.getfloat('adguardhome_api_timeout', fallback=10))
+
+    logging.info(f"AdGuard Home API 更新: 正在读取 {base_url} 的重写规则")
+    try:
+        with metrics.SSH_OP_SECONDS.time(config.name, 'api_read'):
+            current = client.list()
+    except requests.ConnectionError as e:
+        if config.getboolean('adguardhome_api_fallback', fallback=True) and config.get('adguardhome_config_path', fallback=''):
+            logging.warning(f"AdGuard Home API 更新: 无法连接 {base_url} ({e})，回退为通过 SSH 修改配置文件。")
+            from .updater import update_adguard_hosts
+            return update_adguard_hosts(config, best_ip, plan)
+        logging.error(f"AdGuard Home API 更新: 无法连接 {base_url}: {e}")
+        return False
+    except (requests.RequestException, ValueError) as e:
+        logging.error(f"AdGuard Home API 更新: 读取重写规则失败: {e}")
+        return False
+
+    # 未指定域名时更新所有已有的重写规则
+    managed = domains or list(dict.fromkeys(entry.get('domain') for entry in current if entry.get('domain')))
+    if not managed:
+        logging.info("AdGuard Home API 更新: 没有重写规则可以更新。请在 AdGuard Home 界面添加 DNS 重写规则，或配置 adguardhome_domains。")
+        return True
+
+    updates, adds, deletes = diff_rewrites(current, {domain: plan.ips_for(domain) for domain in managed})
+    if not (updates or adds or deletes):
+        logging.info("AdGuard Home API 更新: 所有重写规则的 IP 地址已是最新，无需更新。")
+        return True
+
+    try:
+        with metrics.SSH_OP_SECONDS.time(config.name, 'api_write'):
+            use_update = True
+            for old, new in updates:
+                use_update = use_update and client.update(old, new)
+                if not use_update:
+                    # 旧版本没有 update 接口，改为先删除再添加
+                    client.delete(old)
+                    client.add(new)
+            for entry in deletes:
+                client.delete(entry)
+            for entry in adds:
+                client.add(entry)
+    except requests.RequestException as e:
+        logging.error(f"AdGuard Home API 更新: 修改重写规则失败: {e}")
+        return False
+
+    logging.info(f"AdGuard Home API 更新: 已将 {len(managed)} 个域名的重写规则更新为 {plan.describe()} "
+                 f"(修改 {len(updates)}，新增 {len(adds)}，删除 {len(deletes)})")
+    return True
@@ -1,8 +1,17 @@
-from flask import Flask, jsonify, current_app, render_template, request
+from flask import Flask, Response, jsonify, current_app, render_template, request, g
 from .optimizer import CloudflareOptimizer  # 确保使用相对导入
-from .state import app_state
+from .state import app_state, DEFAULT_PROFILE
+from .runner import get_run_status
+from .profiles import profile_names, profile_config, probe_budget
+from .speedtest import bandwidth_budget
+from .jobqueue import run_queue, TRIGGER_MANUAL
+from .events import event_bus
+from .payloads import rebuild_payloads
+from .cluster import TOKEN_HEADER, start_probe_job, check_probe_ranges, cluster_token
+from . import metrics, startup_report
 from apscheduler.triggers.cron import CronTrigger
-import threading
+import hmac
+import time
 import logging
 import configparser
 
@@ -10,36 +19,291 @@ def create_app(optimizer: CloudflareOptimizer, template_folder: str, static_fold
     """创建并配置 Flask 应用实例 (Application Factory)"""
     app = Flask(__name__, template_folder=template_folder, static_folder=static_folder)
     app.config['OPTIMIZER_INSTANCE'] = optimizer
+    app.config['PROFILES'] = {DEFAULT_PROFILE: optimizer}
+
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+        startup_report.first_request()
+
+    @app.after_request
+    def record_request_time(response):
+        # 按路由模板（而不是实际路径）统计，避免 /api/history/ip/<ip> 等产生大量标签
+        started = g.pop('request_started', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            metrics.HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, route, request.method,
+                                                 response.status_code)
+        return response
+
+    @app.route('/api/startup', methods=['GET'])
+    def get_startup_report():
+        # 启动各阶段耗时、首个请求到达时间、峰值内存及已加载的重量级依赖
+        return jsonify(startup_report.report())
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        # Prometheus 文本格式的指标
+        peak_rss = startup_report.peak_rss_bytes()
+        if peak_rss:
+            metrics.PEAK_RSS_BYTES.set(peak_rss)
+        return Response(metrics.render_all(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+    @app.route('/api/events', methods=['GET'])
+    def get_events():
+        # Server-Sent Events: 最优IP、结果、任务进度、推送状态及日志的实时推送
+        # 断线重连时浏览器通过 Last-Event-ID 请求头续传；也可用 ?last_event_id= 指定，?types=a,b 与 ?profile= 过滤
+        config = current_app.config.get('CONFIG')
+        max_clients = config.getint('API', 'max_event_clients', fallback=8) if config else 8
+        last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+        try:
+            last_event_id = event_bus.parse_id(last_event_id) if last_event_id else None
+        except ValueError:
+            return jsonify({"error": "Last-Event-ID 格式无效"}), 400
+        types = {item.strip() for item in request.args.get('types', '').split(',') if item.strip()}
+        if not event_bus.subscribe(max_clients):
+            return jsonify({"error": f"事件订阅者已达上限 ({max_clients})"}), 503
+
+        response = Response(event_bus.stream(last_event_id, types, request.args.get('profile')),
+                            content_type='text/event-stream; charset=utf-8')
+        response.headers['Cache-Control'] = 'no-cache'
+        # 禁止反向代理（nginx）缓冲事件流
+        response.headers['X-Accel-Buffering'] = 'no'
+        response.call_on_close(event_bus.unsubscribe)
+        return response
 
     @app.route('/', methods=['GET'])
     def index():
         return render_template('index.html')
 
+    def serve_cached(name: str, state=app_state) -> Response:
+        """返回预先序列化的响应；支持 If-None-Match (304) 与 gzip 压缩"""
+        payload = state.payloads.get(name)
+        if payload is None:
+            rebuild_payloads(state)
+            payload = state.payloads[name]
+
+        use_gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+        # gzip 与未压缩的响应是不同的表示，使用不同的 ETag
+        etag = f"{payload.etag}-gzip" if use_gzip else payload.etag
+
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        elif use_gzip:
+            response = Response(payload.gzip_body, status=payload.status, mimetype='application/json')
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response = Response(payload.body, status=payload.status, mimetype='application/json')
+
+        response.set_etag(etag)
+        response.headers['X-Results-Version'] = str(state.results_version)
+        response.headers['Vary'] = 'Accept-Encoding'
+        # 要求客户端每次都携带 ETag 重新验证，结果未变化时只需返回 304
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
     @app.route('/api/best_ip', methods=['GET'])
     def get_best_ip():
-        if app_state.best_ip:
-            return jsonify({"best_ip": app_state.best_ip})
-        return jsonify({"error": "最优IP尚未确定"}), 404
+        return serve_cached('best_ip')
 
     @app.route('/api/results', methods=['GET'])
     def get_results():
-        if app_state.last_results:
-            # 仅返回前10条结果给前端，减轻前端渲染压力
-            return jsonify(app_state.last_results[:10])
-        # 如果没有结果，返回空列表，前端会显示“暂无结果”
-        return jsonify([])
+        # 仅返回前10条结果给前端，减轻前端渲染压力；如果没有结果，返回空列表，前端会显示“暂无结果”
+        return serve_cached('results')
+
+    @app.route('/api/results_v6', methods=['GET'])
+    def get_results_v6():
+        # 双栈优选的 IPv6 结果（前10条），未启用双栈时为空列表
+        return serve_cached('results_v6')
+
+    def profile_optimizer(name: str):
+        return app.config['PROFILES'].get(name)
+
+    @app.route('/api/profiles', methods=['GET'])
+    def list_profiles():
+        # 所有优选配置的概况及全局测速预算
+        profiles = []
+        for name, profile in app.config['PROFILES'].items():
+            state = profile.state
+            profiles.append({
+                "name": name,
+                "best_ip": state.best_ip,
+                "best_ip_v6": state.best_ip_v6,
+                "results": len(state.last_results),
+                "last_scan_at": state.last_scan_at,
+                "running": state.optimizer_lock.locked(),
+                "params": ' '.join(profile.params),
+                "targets": [target for target, _ in profile.publisher.targets()],
+            })
+        return jsonify({"budget": probe_budget.status(), "download_budget": bandwidth_budget.status(), "profiles": profiles})
+
+    @app.route('/api/profiles/<name>/best_ip', methods=['GET'])
+    def get_profile_best_ip(name):
+        profile = profile_optimizer(name)
+        if profile is None:
+            return jsonify({"error": f"profile {name} 不存在"}), 404
+        return serve_cached('best_ip', profile.state)
+
+    @app.route('/api/profiles/<name>/results', methods=['GET'])
+    def get_profile_results(name):
+        profile = profile_optimizer(name)
+        if profile is None:
+            return jsonify({"error": f"profile {name} 不存在"}), 404
+        return serve_cached('results', profile.state)
+
+    @app.route('/api/profiles/<name>/results_v6', methods=['GET'])
+    def get_profile_results_v6(name):
+        profile = profile_optimizer(name)
+        if profile is None:
+            return jsonify({"error": f"profile {name} 不存在"}), 404
+        return serve_cached('results_v6', profile.state)
+
+    @app.route('/api/profiles/<name>/status', methods=['GET'])
+    def get_profile_status(name):
+        # 单个 profile 的任务进度、心跳检测及推送状态
+        profile = profile_optimizer(name)
+        if profile is None:
+            return jsonify({"error": f"profile {name} 不存在"}), 404
+        state = profile.state
+        return jsonify({"best_ip": state.best_ip, "best_ip_v6": state.best_ip_v6, "run_status": get_run_status(state),
+                        "queue": run_queue.status(name),
+                        "health": state.health_status, "push_status": state.push_status})
+
+    @app.route('/api/profiles/<name>/run_test', methods=['POST'])
+    def run_profile_test(name):
+        profile = profile_optimizer(name)
+        if profile is None:
+            return jsonify({"error": f"profile {name} 不存在"}), 404
+        return submit_manual_run(profile, f"[{name}] ")
+
+    def submit_manual_run(optimizer_instance: CloudflareOptimizer, label: str = '') -> Response:
+        """提交手动优选；已有排队或运行中的任务时合并到该任务，同样返回 202"""
+        job, coalesced = run_queue.submit(optimizer_instance, TRIGGER_MANUAL)
+        if coalesced:
+            message = f"{label}优选任务 #{job.id} 已在{'运行' if job.state == 'running' else '排队'}中，本次请求已合并"
+        else:
+            message = f"{label}IP优选任务 #{job.id} 已提交"
+        return jsonify({"message": message, "coalesced": coalesced, "job": job.to_dict()}), 202
+
+    @app.route('/api/autotune', methods=['GET'])
+    def get_autotune():
+        # 各 profile 的测速并发数自动调节：当前选用的并发、上限及每次扫描的样本历史
+        result = {}
+        for name, profile in app.config['PROFILES'].items():
+            if profile.autotune:
+                result[name] = {"enabled": True, **profile.autotune.status()}
+            else:
+                result[name] = {"enabled": False, "concurrency": int(profile._param(profile.params, '-n', 200))}
+        return jsonify(result)
+
+    @app.route('/api/queue', methods=['GET'])
+    def get_queue():
+        # 优选任务队列：运行中、排队中（按优先级）及最近结束的任务，?profile=<名称> 只返回该 profile 的任务
+        return jsonify(run_queue.status(request.args.get('profile')))
+
+    @app.route('/api/queue/cancel', methods=['POST'])
+    def cancel_queue():
+        # 取消 profile（默认为 default）排队中及运行中的任务，可用 job_id 只取消指定任务
+        data = request.get_json(silent=True) or {}
+        name = data.get('profile') or request.args.get('profile') or DEFAULT_PROFILE
+        job_id = data.get('job_id') or request.args.get('job_id')
+        if profile_optimizer(name) is None:
+            return jsonify({"error": f"profile {name} 不存在"}), 404
+        try:
+            job_id = int(job_id) if job_id is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "job_id 必须是整数"}), 400
+        cancelled = run_queue.cancel(name, job_id)
+        if not cancelled:
+            return jsonify({"error": "没有可以取消的任务"}), 404
+        return jsonify({"message": f"已取消 {len(cancelled)} 个任务", "cancelled": cancelled})
+
+    @app.route('/api/run_status', methods=['GET'])
+    def run_status():
+        # 返回当前（或最近一次）优选任务的实时进度：阶段、已测/总数、IP/秒、预计剩余时间及部分结果
+        return jsonify(get_run_status())
+
+    @app.route('/api/health', methods=['GET'])
+    def get_health():
+        # 最近一次心跳检测中各候选 IP 的健康状态
+        return jsonify({"best_ip": app_state.best_ip, "best_ip_v6": app_state.best_ip_v6,
+                        "candidates": app_state.health_status})
+
+    @app.route('/api/push_status', methods=['GET'])
+    def get_push_status():
+        # 各推送目标最近一次推送的状态与耗时
+        return jsonify(app_state.push_status)
+
+    @app.route('/api/history/best', methods=['GET'])
+    def history_best():
+        # 最近 N 小时内表现最好的 IP，例如 /api/history/best?hours=24&limit=10
+        optimizer_instance: CloudflareOptimizer = app.config['OPTIMIZER_INSTANCE']
+        if not optimizer_instance.history:
+            return jsonify({"error": "测速历史记录未启用"}), 404
+        hours = request.args.get('hours', 24, type=float)
+        limit = request.args.get('limit', 10, type=int)
+        min_samples = request.args.get('min_samples', 1, type=int)
+        return jsonify(optimizer_instance.history.best_ips(hours=hours, limit=limit, min_samples=min_samples))
+
+    @app.route('/api/history/ip/<ip>', methods=['GET'])
+    def history_ip(ip):
+        # 单个 IP 的历史趋势，例如 /api/history/ip/104.16.1.1?hours=168
+        optimizer_instance: CloudflareOptimizer = app.config['OPTIMIZER_INSTANCE']
+        if not optimizer_instance.history:
+            return jsonify({"error": "测速历史记录未启用"}), 404
+        hours = request.args.get('hours', 24 * 7, type=float)
+        return jsonify({"ip": ip, "records": optimizer_instance.history.ip_trend(ip, hours=hours)})
+
+    def cluster_authorized():
+        # worker 端校验 coordinator 携带的共享令牌；未配置令牌时拒绝所有集群请求
+        token = cluster_token(app.config['OPTIMIZER_INSTANCE'].config)
+        return bool(token) and hmac.compare_digest(request.headers.get(TOKEN_HEADER, ''), token)
+
+    @app.route('/api/cluster/probe', methods=['POST'])
+    def cluster_probe():
+        # worker 端：接受 coordinator 下发的 IP 段并在后台测速，返回任务 ID 供轮询
+        optimizer_instance: CloudflareOptimizer = app.config['OPTIMIZER_INSTANCE']
+        if optimizer_instance.cluster_role not in ('worker', 'coordinator'):
+            return jsonify({"error": "本节点未启用集群模式"}), 403
+        if not cluster_authorized():
+            return jsonify({"error": "集群令牌无效"}), 401
+        ranges = (request.get_json(silent=True) or {}).get('ranges')
+        if not ranges or not isinstance(ranges, list):
+            return jsonify({"error": "缺少 ranges 参数"}), 400
+        error = check_probe_ranges(ranges, optimizer_instance.probe_scope())
+        if error:
+            return jsonify({"error": error}), 400
+        lock_timeout = optimizer_instance.config.getint('Cluster', 'timeout', fallback=900)
+        job_id = start_probe_job(optimizer_instance, [str(item) for item in ranges], lock_timeout)
+        return jsonify({"job_id": job_id, "site": optimizer_instance.cluster_site}), 202
+
+    @app.route('/api/cluster/probe/<job_id>', methods=['GET'])
+    def cluster_probe_status(job_id):
+        # worker 端：返回探测任务的状态，完成后附带结果行
+        if not cluster_authorized():
+            return jsonify({"error": "集群令牌无效"}), 401
+        job = app_state.cluster_jobs.get(job_id)
+        if job is None:
+            return jsonify({"error": "任务不存在"}), 404
+        return jsonify(job)
+
+    @app.route('/api/cluster/results', methods=['GET'])
+    def cluster_results():
+        # coordinator 端：全局排名及各站点视图，?site=<站点> 只返回该站点的测量结果
+        results = app_state.cluster_results
+        site = request.args.get('site')
+        if site:
+            if site not in results.get('sites', {}):
+                return jsonify({"error": f"站点 {site} 不存在"}), 404
+            return jsonify({"site": site, "rows": results['sites'][site]})
+        return jsonify(results)
 
     @app.route('/api/run_test', methods=['POST'])
     def run_test_manual():
         # 从 app.config 获取 optimizer 实例
         optimizer_instance: CloudflareOptimizer = app.config['OPTIMIZER_INSTANCE']
-        # 在后台线程中运行，避免阻塞API请求
-        if not app_state.optimizer_lock.locked():
-            thread = threading.Thread(target=optimizer_instance.run_speed_test)
-            thread.start()
-            return jsonify({"message": "IP优选任务已启动"}), 202
-        else:
-            return jsonify({"message": "优选任务已在运行中，请稍后再试"}), 429
+        # 提交到任务队列，由队列的工作线程执行，避免阻塞API请求
+        return submit_manual_run(optimizer_instance)
 
     @app.route('/api/config', methods=['GET'])
     def get_config():
@@ -55,15 +319,20 @@ def create_app(optimizer: CloudflareOptimizer, template_folder: str, static_fold
 
     @app.route('/api/logs', methods=['GET'])
     def get_logs():
-        # 读取日志文件内容并返回
-        log_file_path = current_app.config['LOG_FILE_PATH']
-        try:
-            with open(log_file_path, 'r', encoding='utf-8') as f:
-                logs = f.readlines()
-            return jsonify(logs)
-        except FileNotFoundError:
-            logging.warning(f"日志文件未找到: {log_file_path}")
-            return jsonify({"error": "日志文件未找到"}), 404
+        # 从内存环形缓冲区返回日志，开销与日志文件大小无关
+        # ?since=<cursor>&limit=<n> 只返回游标之后的新日志: {"cursor": ..., "lines": [...], "truncated": ...}
+        # 不带 since 时保持原有格式，返回缓冲区中最近的日志行列表
+        log_buffer = current_app.config.get('LOG_BUFFER')
+        if log_buffer is None:
+            logging.warning("日志缓冲区未初始化")
+            return jsonify({"error": "日志缓冲区未初始化"}), 404
+
+        since = request.args.get('since', type=int)
+        limit = request.args.get('limit', type=int)
+        result = log_buffer.get_lines(since=since, limit=limit)
+        if since is None:
+            return jsonify(result['lines'])
+        return jsonify(result)
 
     @app.route('/api/config', methods=['POST'])  # 修改为 POST 方法
     def update_config():
@@ -87,17 +356,36 @@ def create_app(optimizer: CloudflareOptimizer, template_folder: str, static_fold
             if optimizer_instance:
                 optimizer_instance.reload_config()
 
+            # 2.1 各 profile 由新的全局配置重新生成自己的配置；增删 profile 需要重启服务
+            profiles = current_app.config['PROFILES']
+            for name, profile in profiles.items():
+                if name == DEFAULT_PROFILE:
+                    continue
+                if name not in profile_names(config):
+                    logging.warning(f"[profile:{name}] 已删除或停用，重启服务后生效。")
+                    continue
+                profile_config(config, name, into=profile.config)
+                profile.reload_config()
+            new_profiles = set(profile_names(config)) - set(profiles)
+            if new_profiles:
+                logging.warning(f"新增的 profile {', '.join(sorted(new_profiles))} 将在重启服务后生效。")
+            probe_budget.configure(config.getint('Profiles', 'probe_budget', fallback=0), len(profiles))
+            bandwidth_budget.configure(config.getfloat('Profiles', 'download_budget', fallback=0))
+            run_queue.configure(config.getint('Profiles', 'max_concurrent_runs', fallback=0))
+
             # 3. 重新加载并应用定时任务
             scheduler = current_app.config.get('SCHEDULER')
             if scheduler:
-                new_optimize_cron = config.get('Scheduler', 'optimize_cron', fallback='0 3 * * *')
-                new_heartbeat_cron = config.get('Scheduler', 'heartbeat_cron', fallback='*/5 * * * *')
-
-                scheduler.reschedule_job('job_optimize_ip', trigger=CronTrigger.from_crontab(new_optimize_cron))
-                scheduler.reschedule_job('job_heartbeat_check', trigger=CronTrigger.from_crontab(new_heartbeat_cron))
-                
-                logging.info(f"定时优选任务已更新，新 Cron: {new_optimize_cron}")
-                logging.info(f"心跳检测任务已更新，新 Cron: {new_heartbeat_cron}")
+                for name, profile in profiles.items():
+                    suffix, label = ('', '') if name == DEFAULT_PROFILE else (f":{name}", f" [{name}]")
+                    new_optimize_cron = profile.config.get('Scheduler', 'optimize_cron', fallback='0 3 * * *')
+                    new_heartbeat_cron = profile.config.get('Scheduler', 'heartbeat_cron', fallback='*/5 * * * *')
+
+                    scheduler.reschedule_job(f'job_optimize_ip{suffix}', trigger=CronTrigger.from_crontab(new_optimize_cron))
+                    scheduler.reschedule_job(f'job_heartbeat_check{suffix}', trigger=CronTrigger.from_crontab(new_heartbeat_cron))
+                    
+                    logging.info(f"定时优选任务{label}已更新，新 Cron: {new_optimize_cron}")
+                    logging.info(f"心跳检测任务{label}已更新，新 Cron: {new_heartbeat_cron}")
 
             return jsonify({"message": "配置已更新并成功热重载！"}), 200
         except Exception as e:
@@ -0,0 +1,149 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\assignment.py
+"""
+发布策略：决定每个域名解析到哪些 IP。
+
+- single（默认）：所有域名都指向最优 IP。
+- spread：从排名前 top_k 的结果中选出得分接近第一名的 IP 组成 IP 池，再用 rendezvous（最高随机权重）
+  哈希把各域名分散到池中的 IP 上，每个域名可以分配 records_per_domain 个 IP。
+  排名变化时只有原本分配到被移出 IP 池的 IP 的域名才会改变，其余域名的解析保持稳定。
+
+双栈优选时 IPv4 与 IPv6 各自按同样的策略生成 IP 池，每个域名同时分配 IPv4 (A) 与 IPv6 (AAAA) 地址。
+[Publish] ipv6 = auto 时只有 IPv6 路径不比 IPv4 差才发布 IPv6：客户端通常优先使用 AAAA 记录，
+发布更慢的 IPv6 地址反而会让客户端走更差的路径。
+"""
+import hashlib
+import logging
+from .results import COL_IP, COL_LOSS, COL_LATENCY, row_float, row_speed
+
+POLICY_SINGLE = 'single'
+POLICY_SPREAD = 'spread'
+IPV6_AUTO = 'auto'
+IPV6_ALWAYS = 'always'
+IPV6_OFF = 'off'
+
+
+def _weight(domain: str, ip: str) -> int:
+    digest = hashlib.blake2b(f"{domain.lower()}|{ip}".encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+def select_pool(rows: list[dict], top_k: int, score_tolerance: float) -> list[str]:
+    """
+    从排名前 top_k 的结果中选出 IP 池：丢包率不高于第一名，且平均延迟不超过第一名的 (1 + score_tolerance) 倍。
+    第一名缺少延迟数据（例如故障切换时提升的 IP）时不按延迟筛选。
+    """
+    candidates = [row for row in rows[:max(1, top_k)] if row.get(COL_IP)]
+    if not candidates:
+        return []
+    best_loss = row_float(candidates[0], COL_LOSS)
+    best_latency = row_float(candidates[0], COL_LATENCY)
+    latency_limit = best_latency * (1 + score_tolerance) if best_latency > 0 else float('inf')
+    pool = [row[COL_IP] for row in candidates
+            if row_float(row, COL_LOSS) <= best_loss and row_float(row, COL_LATENCY) <= latency_limit]
+    return list(dict.fromkeys([candidates[0][COL_IP]] + pool))
+
+
+def ipv6_not_slower(best_v4: dict, best_v6: dict, tolerance: float) -> bool:
+    """
+    比较两个地址族最优 IP 的测速结果：IPv6 的丢包率不高于 IPv4，并且两者都有下载速度时 IPv6 不低于 IPv4 的
+    (1 - tolerance) 倍，否则平均延迟不超过 IPv4 的 (1 + tolerance) 倍。缺少 IPv4 结果时返回 True。
+    """
+    if not best_v4:
+        return True
+    if row_float(best_v6, COL_LOSS) > row_float(best_v4, COL_LOSS):
+        return False
+    speed_v4, speed_v6 = row_speed(best_v4), row_speed(best_v6)
+    if speed_v4 > 0 and speed_v6 > 0:
+        return speed_v6 >= speed_v4 * (1 - tolerance)
+    latency_v4, latency_v6 = row_float(best_v4, COL_LATENCY), row_float(best_v6, COL_LATENCY)
+    return latency_v4 <= 0 or 0 < latency_v6 <= latency_v4 * (1 + tolerance)
+
+
+def _assign(domain: str, pool: list[str], records: int) -> list[str]:
+    if len(pool) <= 1:
+        return list(pool)
+    return sorted(pool, key=lambda ip: _weight(domain, ip), reverse=True)[:records]
+
+
+class PublishPlan:
+    """
+    一次推送使用的 IP 分配方案：ips_for(domain) 返回该域名应解析到的 IP 列表（IPv4 在前，IPv6 在后）。
+    pool_v6 为空时只发布 IPv4。
+    """
+
+    def __init__(self, best_ip: str, pool: list[str] = None, records_per_domain: int = 1, pool_v6: list[str] = None):
+        self.best_ip = best_ip
+        self.pool = list(pool) if pool else [best_ip]
+        self.pool_v6 = list(pool_v6 or [])
+        self.records_per_domain = max(1, min(records_per_domain, len(self.pool)))
+        self._records_v6 = max(1, min(records_per_domain, len(self.pool_v6)))
+        self._cache = {}
+
+    def ips_for(self, domain: str) -> list[str]:
+        if len(self.pool) == 1 and len(self.pool_v6) <= 1:
+            return self.pool + self.pool_v6
+        ips = self._cache.get(domain)
+        if ips is None:
+            ips = self._cache[domain] = _assign(domain, self.pool, self.records_per_domain) + \
+                _assign(domain, self.pool_v6, self._records_v6)
+        return list(ips)
+
+    def for_target(self, section) -> 'PublishPlan':
+        """
+        目标配置节中设置了 records_per_domain 时返回覆盖后的方案（例如某个目标只支持单条记录），
+        设置 ipv6 = false 时不向该目标发布 IPv6
+        """
+        records = section.getint('records_per_domain', fallback=self.records_per_domain)
+        pool_v6 = self.pool_v6 if section.getboolean('ipv6', fallback=True) else []
+        if records == self.records_per_domain and pool_v6 is self.pool_v6:
+            return self
+        return PublishPlan(self.best_ip, self.pool, records, pool_v6)
+
+    def describe(self) -> str:
+        if len(self.pool) == 1:
+            text = self.best_ip
+        else:
+            text = f"{len(self.pool)} 个 IP ({', '.join(self.pool)})，每个域名 {self.records_per_domain} 个"
+        if len(self.pool_v6) == 1:
+            text += f"，IPv6 {self.pool_v6[0]}"
+        elif self.pool_v6:
+            text += f"，IPv6 {len(self.pool_v6)} 个 ({', '.join(self.pool_v6)})，每个域名 {self._records_v6} 个"
+        return text
+
+
+def _family_pool(config, policy: str, best_ip: str, rows: list[dict]) -> list[str]:
+    if policy != POLICY_SPREAD or not rows:
+        return [best_ip]
+    top_k = config.getint('Publish', 'top_k', fallback=10)
+    pool = select_pool(rows, top_k, config.getfloat('Publish', 'score_tolerance', fallback=0.2))
+    if best_ip and best_ip not in pool:
+        pool = [best_ip] + pool[:top_k - 1]
+    return pool
+
+
+def publish_ipv6(config, rows: list[dict], rows_v6: list[dict]) -> bool:
+    """按 [Publish] ipv6 (auto / always / off) 与 ipv6_tolerance 判断是否发布 IPv6"""
+    mode = config.get('Publish', 'ipv6', fallback=IPV6_AUTO).strip().lower()
+    if mode == IPV6_OFF or not rows_v6:
+        return False
+    if mode == IPV6_ALWAYS:
+        return True
+    return ipv6_not_slower(rows[0] if rows else None, rows_v6[0],
+                           config.getfloat('Publish', 'ipv6_tolerance', fallback=0.1))
+
+
+def build_plan(config, best_ip: str, rows: list[dict], best_ip_v6: str = None, rows_v6: list[dict] = None) -> PublishPlan:
+    """
+    根据 [Publish] 的 policy / top_k / records_per_domain / score_tolerance 生成分配方案；
+    传入 best_ip_v6（双栈优选）时按同样的策略生成 IPv6 IP 池，是否发布由 publish_ipv6 决定
+    """
+    policy = config.get('Publish', 'policy', fallback=POLICY_SINGLE).strip().lower()
+    records = config.getint('Publish', 'records_per_domain', fallback=1) if policy == POLICY_SPREAD else 1
+    pool_v6 = []
+    if best_ip_v6:
+        rows_v6 = rows_v6 or [{COL_IP: best_ip_v6}]
+        if publish_ipv6(config, rows, rows_v6):
+            pool_v6 = _family_pool(config, policy, best_ip_v6, rows_v6)
+        else:
+            logging.info(f"推送: IPv6 最优IP {best_ip_v6} 的测速结果不如 IPv4，本次不发布 IPv6 地址。")
+    return PublishPlan(best_ip, _family_pool(config, policy, best_ip, rows), records, pool_v6)
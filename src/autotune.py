@@ -0,0 +1,265 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\autotune.py
+"""
+测速并发数 (-n) 自动调节。
+
+每次完整扫描记录一个样本：并发数、已测/可用 IP 数（可用率）、扫描前段与后段的可用率，以及扫描期间主机的
+最高负载（1 分钟平均负载 / CPU 核数）。出现以下任一情况即判定并发过高：
+- 主机负载超过 max_load；
+- 扫描后段的可用率比前段低 tolerance 以上（触发了运营商/Cloudflare 的临时限制），
+  前后段都按参考扫描同一位置的可用率归一化，排除各 IP 段本身可用率不同的影响；
+- 可用率比最近在更低并发下测得的最好可用率低 tolerance 以上。
+并发过高时降低到 0.75 倍，并把该并发记为上限；否则每次增加 step，但不超过上限 - step，
+从而收敛到不降低可用率的最高并发。上限在 CEILING_TTL 次扫描后失效，以便网络条件好转后重新尝试。
+内置引擎在扫描过程中也会按同样的条件即时降低并发（只降不升）。
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from .state import DEFAULT_PROFILE
+from . import metrics
+
+# 保留的样本数量
+HISTORY_SIZE = 50
+# 可用率按每 WINDOW_IPS 个已测 IP 统计一个窗口
+WINDOW_IPS = 100
+# 已测 IP 少于该数量的扫描（例如增量复测）不作为样本
+MIN_SAMPLE_IPS = 200
+# 比较可用率时参考的最近样本数
+BASELINE_SAMPLES = 10
+# 扫描中按最近 RECENT_WINDOWS 个窗口合并计算可用率，并要求下降超过 IN_RUN_FACTOR 倍 tolerance 才降低并发，
+# 避免单个窗口的随机波动导致误判
+RECENT_WINDOWS = 5
+IN_RUN_FACTOR = 2
+# 并发上限在多少次扫描后失效
+CEILING_TTL = 20
+DECREASE_FACTOR = 0.75
+AUTOTUNE_VERSION = 1
+
+
+def host_load():
+    """每个 CPU 核的 1 分钟平均负载；不支持 getloadavg 的系统（Windows）返回 None"""
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        return None
+
+
+class RunSample:
+    """
+    一次扫描中的观测数据，由 RunTracker 在延迟测速阶段的每次进度更新时调用 on_progress。
+    IP 按 IP 段顺序测速，各段的可用率本身就不同，因此每个窗口的可用率都与参考扫描（最近一次未降级的扫描）
+    同一位置的窗口相比，用比值判断扫描后段是否变差。
+    adjustable 为 True（内置引擎）时扫描中即时降低 limit；cfst 的 -n 在启动后无法修改，只记录观测数据。
+    """
+
+    def __init__(self, tuner: 'ConcurrencyTuner', concurrency: int, adjustable: bool = False):
+        self.tuner = tuner
+        self.concurrency = concurrency
+        self.adjustable = adjustable
+        # 内置引擎的实时并发上限，扫描中判定并发过高时降低
+        self.limit = concurrency
+        self.reference = list(tuner.reference)
+        self.done = 0
+        self.valid = 0
+        # 各窗口的可用率；有参考扫描时另记 (实际可用数, 按参考扫描同一位置窗口的可用率估计的可用数)
+        self.windows = []
+        self.ratios = []
+        # 扫描中降低并发后，从该位置起重新建立前段基准
+        self._ratio_start = 0
+        self.peak_load = None
+        self.backoffs = 0
+        self.started = time.time()
+        self._window_done = 0
+        self._window_valid = 0
+
+    def on_progress(self, done: int, valid: int):
+        self.done = done
+        if valid is not None:
+            self.valid = valid
+        if done - self._window_done < WINDOW_IPS:
+            return
+        window = (self.valid - self._window_valid) / (done - self._window_done)
+        index = len(self.windows)
+        self.windows.append(window)
+        if index < len(self.reference) and self.reference[index] > 0:
+            size = done - self._window_done
+            self.ratios.append((self.valid - self._window_valid, self.reference[index] * size))
+        self._window_done, self._window_valid = done, self.valid
+        load = host_load()
+        if load is not None:
+            self.peak_load = max(self.peak_load or 0.0, load)
+        if not self.adjustable:
+            return
+        reason = self._in_run_reason(load)
+        if reason and self.limit > self.tuner.minimum:
+            new_limit = max(self.tuner.minimum, int(self.limit * DECREASE_FACTOR))
+            logging.warning(f"并发自动调节{self.tuner.label}: {reason}，本次扫描的并发由 {self.limit} 降为 {new_limit}。")
+            self.limit = new_limit
+            self.backoffs += 1
+            self._ratio_start = len(self.ratios)
+
+    def _in_run_reason(self, load):
+        if load is not None and load > self.tuner.max_load:
+            return f"主机负载 {load:.2f} 超过 {self.tuner.max_load:g}"
+        ratios = self.ratios[self._ratio_start:]
+        if len(ratios) >= 2 * RECENT_WINDOWS:
+            baseline = _pooled(ratios[:-RECENT_WINDOWS])
+            recent = _pooled(ratios[-RECENT_WINDOWS:])
+            if baseline and recent < baseline * (1 - self.tuner.tolerance * IN_RUN_FACTOR):
+                return f"可用率降至参考扫描的 {recent:.0%}（前段为 {baseline:.0%}）"
+        return ''
+
+    def to_dict(self) -> dict:
+        third = len(self.ratios) // 3
+        return {
+            "at": time.time(),
+            "concurrency": self.concurrency,
+            "final_concurrency": self.limit,
+            "probed": self.done,
+            "valid": self.valid,
+            "yield": round(self.valid / self.done, 4) if self.done else 0.0,
+            # 前 1/3 与后 1/3 窗口相对参考扫描的可用率，没有参考扫描时为 None
+            "early_ratio": _round(_pooled(self.ratios[:third])),
+            "late_ratio": _round(_pooled(self.ratios[-third:])) if third else None,
+            "peak_load": _round(self.peak_load),
+            "backoffs": self.backoffs,
+            "duration": round(time.time() - self.started, 1),
+        }
+
+
+def _pooled(ratios: list):
+    """合并多个窗口的 (实际可用数, 估计可用数)，返回实际 / 估计"""
+    expected = sum(item[1] for item in ratios)
+    return sum(item[0] for item in ratios) / expected if expected else None
+
+
+def _round(value):
+    return round(value, 4) if value is not None else None
+
+
+class ConcurrencyTuner:
+    """
+    一个 profile 的并发调节器。当前并发、上限及样本历史保存在 path（JSON），重启后继续调节。
+    """
+
+    def __init__(self, path: str, initial: int, profile: str = DEFAULT_PROFILE):
+        self.path = path
+        self.profile = profile
+        self.label = '' if profile == DEFAULT_PROFILE else f" [{profile}]"
+        self._lock = threading.Lock()
+        self.concurrency = initial
+        self.ceiling = None
+        self.ceiling_runs = 0
+        # 参考扫描（最近一次未判定为并发过高的扫描）各窗口的可用率
+        self.reference = []
+        self.history = deque(maxlen=HISTORY_SIZE)
+        self.minimum, self.maximum, self.step = 50, 1000, 50
+        self.tolerance, self.max_load = 0.1, 1.5
+        self._load()
+
+    def configure(self, section):
+        """从 [cfst] 读取 autotune_min / autotune_max / autotune_step / autotune_tolerance / autotune_max_load"""
+        with self._lock:
+            self.minimum = max(1, section.getint('autotune_min', fallback=50))
+            self.maximum = max(self.minimum, section.getint('autotune_max', fallback=1000))
+            self.step = max(1, section.getint('autotune_step', fallback=50))
+            self.tolerance = section.getfloat('autotune_tolerance', fallback=0.1)
+            self.max_load = section.getfloat('autotune_max_load', fallback=1.5)
+            self.concurrency = min(max(self.concurrency, self.minimum), self.maximum)
+        metrics.PROBE_CONCURRENCY.set(self.concurrency, self.profile)
+
+    def start(self, concurrency: int, adjustable: bool = False) -> RunSample:
+        """开始一次扫描的观测，concurrency 为实际使用的并发（可能被测速预算缩减）"""
+        return RunSample(self, concurrency, adjustable)
+
+    def record(self, sample: RunSample):
+        """扫描结束后记录样本并决定下一次的并发"""
+        if sample.done < MIN_SAMPLE_IPS:
+            return
+        entry = sample.to_dict()
+        with self._lock:
+            reason = self._degraded(entry)
+            previous = self.concurrency
+            if self.ceiling and self.ceiling_runs >= CEILING_TTL:
+                self.ceiling = None
+            self.ceiling_runs += 1
+            if reason:
+                self.ceiling, self.ceiling_runs = entry['concurrency'], 0
+                self.concurrency = max(self.minimum, min(entry['final_concurrency'],
+                                                         int(entry['concurrency'] * DECREASE_FACTOR)))
+            elif entry['concurrency'] >= self.concurrency:
+                # 被测速预算缩减的扫描不代表当前并发，不据此增加
+                target = min(self.maximum, self.concurrency + self.step)
+                if self.ceiling:
+                    target = min(target, self.ceiling - self.step)
+                self.concurrency = max(self.concurrency, target)
+            if not reason:
+                # 参考扫描取历次未降级扫描的滑动平均，降低单次扫描的随机波动
+                self.reference = [(old + new) / 2 for old, new in zip(self.reference, sample.windows)] + \
+                    list(sample.windows[len(self.reference):])
+            entry.update(reason=reason, next_concurrency=self.concurrency)
+            self.history.append(entry)
+            concurrency = self.concurrency
+        if concurrency != previous:
+            logging.info(f"并发自动调节{self.label}: 可用率 {entry['yield']:.1%}"
+                         f"{'，' + reason if reason else ''}，下次扫描并发 {previous} -> {concurrency}。")
+        metrics.PROBE_CONCURRENCY.set(concurrency, self.profile)
+        self._save()
+
+    def _degraded(self, entry: dict) -> str:
+        """（持有锁时调用）判定本次扫描是否说明并发过高，返回原因"""
+        if entry['backoffs']:
+            return f"扫描中降低并发 {entry['backoffs']} 次"
+        if entry['peak_load'] is not None and entry['peak_load'] > self.max_load:
+            return f"主机负载 {entry['peak_load']:.2f} 超过 {self.max_load:g}"
+        if entry['early_ratio'] and entry['late_ratio'] is not None \
+                and entry['late_ratio'] < entry['early_ratio'] * (1 - self.tolerance):
+            return f"扫描后段可用率降至参考扫描的 {entry['late_ratio']:.0%}（前段为 {entry['early_ratio']:.0%}）"
+        recent = list(self.history)[-BASELINE_SAMPLES:]
+        baseline = max((item['yield'] for item in recent if item['concurrency'] < entry['concurrency']), default=0)
+        if baseline and entry['yield'] < baseline * (1 - self.tolerance):
+            return f"可用率 {entry['yield']:.1%} 低于较低并发时的 {baseline:.1%}"
+        return ''
+
+    def status(self) -> dict:
+        with self._lock:
+            return {
+                "concurrency": self.concurrency,
+                "ceiling": self.ceiling,
+                "min": self.minimum,
+                "max": self.maximum,
+                "step": self.step,
+                "history": list(self.history),
+            }
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') != AUTOTUNE_VERSION:
+                return
+            self.concurrency = int(data['concurrency'])
+            self.ceiling = data.get('ceiling')
+            self.ceiling_runs = data.get('ceiling_runs', 0)
+            self.reference = data.get('reference', [])
+            self.history.extend(data.get('history', []))
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"读取并发自动调节记录 {self.path} 失败: {e}")
+
+    def _save(self):
+        with self._lock:
+            data = {'version': AUTOTUNE_VERSION, 'concurrency': self.concurrency, 'ceiling': self.ceiling,
+                    'ceiling_runs': self.ceiling_runs, 'reference': [round(w, 4) for w in self.reference],
+                    'history': list(self.history)}
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"保存并发自动调节记录 {self.path} 失败: {e}")
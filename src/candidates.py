@@ -0,0 +1,161 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\candidates.py
+import ipaddress
+import logging
+import numpy as np
+
+# 每个 /24 段包含的地址数
+BLOCK_SIZE = 256
+
+# 16 位整数 -> "a.b" 的查找表，ints_to_ips 首次调用时生成
+_HALVES = None
+
+
+def _unique(ips: np.ndarray) -> np.ndarray:
+    """排序并去重（比 np.unique 的哈希实现更快）"""
+    ips = np.sort(ips)
+    if ips.size:
+        ips = ips[np.concatenate(([True], ips[1:] != ips[:-1]))]
+    return ips
+
+
+def parse_cidrs(lines: list[str]) -> tuple[np.ndarray, np.ndarray, list[str]]:
+    """
+    将 CIDR/单个 IP 列表解析为 IPv4 整数区间 [starts, ends]（闭区间，uint64 数组）。
+    IPv6 段不参与抽样，原样返回，由测速工具自行处理。
+    """
+    starts, ends, ipv6 = [], [], []
+    for line in lines:
+        item = line.strip()
+        if not item or item.startswith('#'):
+            continue
+        try:
+            network = ipaddress.ip_network(item, strict=False)
+        except ValueError:
+            logging.warning(f"候选IP生成: 跳过无法识别的 IP 段 '{item}'")
+            continue
+        if network.version == 6:
+            ipv6.append(item)
+            continue
+        starts.append(int(network.network_address))
+        ends.append(int(network.broadcast_address))
+    return np.array(starts, dtype=np.uint64), np.array(ends, dtype=np.uint64), ipv6
+
+
+def merge_ranges(starts: np.ndarray, ends: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """合并重叠或相邻的区间（向量化），返回按起点排序的不相交区间"""
+    if starts.size == 0:
+        return starts, ends
+    order = np.argsort(starts, kind='stable')
+    starts, ends = starts[order], ends[order]
+    running_end = np.maximum.accumulate(ends)
+    # 当前区间起点超过之前所有区间的最大终点 + 1 时，开始一个新的合并区间
+    new_group = np.empty(starts.size, dtype=bool)
+    new_group[0] = True
+    new_group[1:] = starts[1:] > running_end[:-1] + 1
+    group_ids = np.cumsum(new_group) - 1
+    merged_starts = starts[new_group]
+    merged_ends = np.zeros(merged_starts.size, dtype=np.uint64)
+    np.maximum.at(merged_ends, group_ids, ends)
+    return merged_starts, merged_ends
+
+
+def subtract_ranges(starts, ends, block_starts, block_ends):
+    """从区间集合中扣除黑名单区间"""
+    for block_start, block_end in zip(block_starts, block_ends):
+        overlap = (starts <= block_end) & (ends >= block_start)
+        if not overlap.any():
+            continue
+        keep_starts, keep_ends = starts[~overlap], ends[~overlap]
+        over_starts, over_ends = starts[overlap], ends[overlap]
+        left = over_starts < block_start
+        right = over_ends > block_end
+        starts = np.concatenate([keep_starts, over_starts[left], np.full(right.sum(), block_end + 1, dtype=np.uint64)])
+        ends = np.concatenate([keep_ends, np.full(left.sum(), block_start - 1, dtype=np.uint64), over_ends[right]])
+    return merge_ranges(starts, ends)
+
+
+def sample_per_block(starts, ends, per_block, weights=None, rng=None) -> np.ndarray:
+    """
+    分层抽样：在每个区间覆盖的每个 /24 段中随机抽取 per_block 个 IP（weights 为各区间的权重系数）。
+    per_block * 权重不是整数时，每个 /24 段抽取其整数部分个 IP，再以小数部分为概率多抽取一个，
+    例如权重 0.5 时平均每两个 /24 段抽取一个 IP。
+    /24 段完整时跳过 .0 与 .255。返回去重并排序后的 uint32 IP 数组。
+    """
+    rng = rng or np.random.default_rng()
+    if starts.size == 0:
+        return np.array([], dtype=np.uint32)
+
+    first_block = starts // BLOCK_SIZE
+    block_counts = (ends // BLOCK_SIZE - first_block + 1).astype(np.int64)
+    range_index = np.repeat(np.arange(starts.size), block_counts)
+    # 每个区间内的块序号: 0, 1, 2, ...
+    offsets = np.arange(range_index.size) - np.repeat(np.cumsum(block_counts) - block_counts, block_counts)
+    block_base = (first_block[range_index] + offsets.astype(np.uint64)) * BLOCK_SIZE
+
+    low = np.maximum(block_base, starts[range_index])
+    high = np.minimum(block_base + BLOCK_SIZE - 1, ends[range_index])
+    full_block = (low == block_base) & (high == block_base + BLOCK_SIZE - 1)
+    low = np.where(full_block, low + 1, low)
+    high = np.where(full_block, high - 1, high)
+
+    if weights is None:
+        k = np.full(range_index.size, per_block, dtype=np.int64)
+    else:
+        expected = np.maximum(per_block * weights[range_index], 0)
+        whole = np.floor(expected)
+        k = (whole + (rng.random(range_index.size) < expected - whole)).astype(np.int64)
+
+    rows = np.repeat(np.arange(range_index.size), k)
+    span = (high - low + 1)[rows].astype(np.float64)
+    ips = low[rows] + np.floor(rng.random(rows.size) * span).astype(np.uint64)
+    return _unique(ips.astype(np.uint32))
+
+
+def ints_to_ips(ips: np.ndarray) -> list[str]:
+    """将 uint32 数组转换为点分十进制字符串列表（按高/低 16 位查表后向量化拼接）"""
+    global _HALVES
+    if _HALVES is None:
+        _HALVES = np.array([f"{i >> 8}.{i & 0xFF}" for i in range(1 << 16)])
+    ips = ips.astype(np.uint32)
+    return np.char.add(np.char.add(_HALVES[ips >> 16], '.'), _HALVES[ips & 0xFFFF]).tolist()
+
+
+def generate_candidates(lines: list[str], per_block: int = 1, blocklist: list[str] = None,
+                        weights: dict = None, rng=None) -> list[str]:
+    """
+    从 CIDR 列表生成候选IP：解析并合并重叠区间，扣除黑名单，然后按 /24 段分层（可加权）抽样。
+    weights 为 {CIDR: 权重系数}，匹配到的区间每个 /24 段抽取 per_block * 权重 个 IP。
+    """
+    starts, ends, ipv6 = parse_cidrs(lines)
+    range_weights = None
+    if weights:
+        # 加权时先按原始区间展开权重，合并只在权重相同的区间之间进行
+        range_weights = np.ones(starts.size, dtype=np.float64)
+        for cidr, weight in weights.items():
+            w_starts, w_ends, _ = parse_cidrs([cidr])
+            if w_starts.size:
+                inside = (starts >= w_starts[0]) & (ends <= w_ends[0])
+                range_weights[inside] = weight
+        groups = []
+        for weight in np.unique(range_weights):
+            mask = range_weights == weight
+            groups.append((weight, *merge_ranges(starts[mask], ends[mask])))
+    else:
+        groups = [(1.0, *merge_ranges(starts, ends))]
+
+    block_starts, block_ends, _ = parse_cidrs(blocklist or [])
+    samples = []
+    for weight, group_starts, group_ends in groups:
+        if block_starts.size:
+            group_starts, group_ends = subtract_ranges(group_starts, group_ends, block_starts, block_ends)
+        group_weights = np.full(group_starts.size, weight) if range_weights is not None else None
+        samples.append(sample_per_block(group_starts, group_ends, per_block, group_weights, rng))
+
+    ips = _unique(np.concatenate(samples)) if samples else np.array([], dtype=np.uint32)
+    return ints_to_ips(ips) + ipv6
+
+
+def write_candidates(path: str, candidates: list[str]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(candidates))
+        f.write('\n')
@@ -0,0 +1,267 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\cluster.py
+import ipaddress
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from .runner import CancelToken
+from .state import app_state
+from .results import COL_IP, COL_SENT, COL_RECEIVED, COL_LOSS, COL_LATENCY, COL_SPEED, COL_COLO, row_float, row_speed
+
+TOKEN_HEADER = 'X-Cluster-Token'
+# 需要共享令牌的集群角色
+CLUSTER_ROLES = ('worker', 'coordinator')
+# 已完成的探测任务在 worker 上保留的时间（秒）
+JOB_RETENTION = 3600
+# 单次探测请求最多包含的 IP 段数量
+MAX_PROBE_RANGES = 65536
+
+_jobs_lock = threading.Lock()
+
+
+def _split_evenly(items: list, parts: int) -> list[list]:
+    size, remainder = divmod(len(items), parts)
+    chunks, start = [], 0
+    for index in range(parts):
+        end = start + size + (1 if index < remainder else 0)
+        chunks.append(items[start:end])
+        start = end
+    return chunks
+
+
+def split_ranges(ranges: list[str], parts: int) -> list[list[str]]:
+    """
+    将 IP 段均分为 parts 份，每份是一段连续的子网列表，保证各节点分到的待测 IP 数量大致相同。
+    IPv4 段按 /24 拆分；IPv6 段无法逐块展开（测速时按块抽样），每个段只拆成不少于 parts 份，
+    两个地址族分别均分。
+    """
+    parts = max(1, parts)
+    blocks_v4, blocks_v6 = [], []
+    for item in ranges:
+        try:
+            network = ipaddress.ip_network(item.strip(), strict=False)
+        except ValueError:
+            continue
+        if network.version == 4:
+            block_prefix, blocks = 24, blocks_v4
+        else:
+            block_prefix, blocks = min(120, network.prefixlen + (parts - 1).bit_length()), blocks_v6
+        if network.prefixlen >= block_prefix:
+            blocks.append(str(network))
+        else:
+            blocks.extend(str(subnet) for subnet in network.subnets(new_prefix=block_prefix))
+
+    return [v4 + v6 for v4, v6 in zip(_split_evenly(blocks_v4, parts), _split_evenly(blocks_v6, parts))]
+
+
+def check_probe_ranges(ranges: list, allowed: list[str]) -> str:
+    """
+    校验 coordinator 下发的 IP 段：数量不超过 MAX_PROBE_RANGES，且都位于本机配置的 IP 段 (allowed) 之内，
+    避免集群接口被用来扫描任意网络。通过时返回空字符串，否则返回错误信息。
+    """
+    if len(ranges) > MAX_PROBE_RANGES:
+        return f"IP 段数量 {len(ranges)} 超过上限 {MAX_PROBE_RANGES}"
+    scope = []
+    for item in allowed:
+        try:
+            scope.append(ipaddress.ip_network(item.strip(), strict=False))
+        except ValueError:
+            continue
+    for item in ranges:
+        try:
+            network = ipaddress.ip_network(str(item).strip(), strict=False)
+        except ValueError:
+            return f"无法识别的 IP 段 '{item}'"
+        if not any(network.version == allowed_network.version and network.subnet_of(allowed_network)
+                   for allowed_network in scope):
+            return f"IP 段 {network} 不在本机配置的测速 IP 段内"
+    return ''
+
+
+def cluster_token(config) -> str:
+    return config.get('Cluster', 'token', fallback='').strip()
+
+
+def merge_site_results(site_rows: dict[str, list[dict]]) -> list[dict]:
+    """
+    将各站点对同一批 IP 的测速结果合并为全局排名：
+    优先在更多站点可用的 IP，其次最差站点的丢包率、所有站点的平均延迟更低的 IP。
+    返回的行与 result.csv 格式一致，并附带各站点延迟。
+    """
+    by_ip = {}
+    for site, rows in site_rows.items():
+        for row in rows:
+            ip = row.get(COL_IP)
+            if ip:
+                by_ip.setdefault(ip, {})[site] = row
+
+    merged = []
+    for ip, per_site in by_ip.items():
+        latencies = [row_float(row, COL_LATENCY) for row in per_site.values()]
+        losses = [row_float(row, COL_LOSS) for row in per_site.values()]
+        colo = next((row.get(COL_COLO) for row in per_site.values() if row.get(COL_COLO)), '')
+        merged.append({
+            COL_IP: ip,
+            COL_SENT: str(sum(int(row_float(row, COL_SENT)) for row in per_site.values())),
+            COL_RECEIVED: str(sum(int(row_float(row, COL_RECEIVED)) for row in per_site.values())),
+            COL_LOSS: f"{max(losses):.2f}",
+            COL_LATENCY: f"{sum(latencies) / len(latencies):.2f}",
+            COL_SPEED: f"{min(row_speed(row) for row in per_site.values()):.2f}",
+            COL_COLO: colo,
+            'sites_ok': len(per_site),
+            'max_latency': round(max(latencies), 2),
+            'site_latency': {site: row_float(row, COL_LATENCY) for site, row in per_site.items()},
+        })
+
+    merged.sort(key=lambda r: (-r['sites_ok'], float(r[COL_LOSS]), float(r[COL_LATENCY])))
+    return merged
+
+
+# ===== worker 端 =====
+
+def start_probe_job(optimizer, ranges: list[str], lock_timeout: float) -> str:
+    """在后台执行 coordinator 下发的探测任务，返回任务 ID"""
+    job_id = uuid.uuid4().hex
+    with _jobs_lock:
+        now = time.time()
+        for old_id in [k for k, v in app_state.cluster_jobs.items() if now - v['created_at'] > JOB_RETENTION]:
+            del app_state.cluster_jobs[old_id]
+        app_state.cluster_jobs[job_id] = {
+            'state': 'queued', 'site': optimizer.cluster_site, 'rows': [], 'error': '', 'created_at': now,
+            'ranges': len(ranges),
+        }
+
+    def run():
+        job = app_state.cluster_jobs[job_id]
+        # 与本机的定时优选互斥，避免同时扫描
+        if not optimizer.state.optimizer_lock.acquire(timeout=lock_timeout):
+            job.update(state='failed', error='本机优选任务长时间未结束')
+            return
+        try:
+            job['state'] = 'running'
+            logging.info(f"集群 worker: 开始探测 coordinator 下发的 {len(ranges)} 个 IP 段...")
+            job['rows'] = optimizer.probe_ranges(ranges, tag=job_id[:8])
+            job['state'] = 'done'
+            logging.info(f"集群 worker: 探测完成，{len(job['rows'])} 个 IP 可用。")
+        except Exception as e:
+            logging.error(f"集群 worker: 探测任务失败: {e}")
+            job.update(state='failed', error=str(e))
+        finally:
+            optimizer.state.optimizer_lock.release()
+
+    threading.Thread(target=run, name=f"ClusterProbe-{job_id[:8]}", daemon=True).start()
+    return job_id
+
+
+# ===== coordinator 端 =====
+
+class ClusterCoordinator:
+    """
+    coordinator 模式：将候选 IP 段均分给各 worker（以及本机）并行扫描，
+    再把合并后的前 K 个 IP 交给所有节点复测，得到每个站点对同一批 IP 的测量结果，
+    最终合并为全局排名和按站点的视图。
+    """
+
+    def __init__(self, optimizer):
+        self.optimizer = optimizer
+        config = optimizer.config
+        self.workers = [url.strip().rstrip('/') for url in config.get('Cluster', 'workers', fallback='').split(',')
+                        if url.strip()]
+        self.token = cluster_token(config)
+        self.include_local = config.getboolean('Cluster', 'include_local', fallback=True)
+        self.timeout = config.getint('Cluster', 'timeout', fallback=900)
+        self.poll_interval = config.getfloat('Cluster', 'poll_interval', fallback=2)
+        self.verify_top_k = config.getint('Cluster', 'verify_top_k', fallback=20)
+
+    def _headers(self):
+        return {TOKEN_HEADER: self.token} if self.token else {}
+
+    def _run_remote(self, worker: str, ranges: list[str], cancel: CancelToken = None) -> tuple[str, list[dict]]:
+        """
+        在远程 worker 上执行探测并等待结果，返回 (站点名, 结果行)。
+        cancel 为本次优选任务的 CancelToken，任务被取消或超时时立即停止等待。
+        """
+        # requests 仅在 coordinator 模式下导入
+        import requests
+
+        cancel = cancel or CancelToken()
+        resp = requests.post(f"{worker}/api/cluster/probe", json={"ranges": ranges},
+                             headers=self._headers(), timeout=10)
+        resp.raise_for_status()
+        job_id = resp.json()['job_id']
+
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            if cancel.wait(self.poll_interval):
+                raise RuntimeError(f"任务{cancel.reason}，停止等待 {worker}")
+            resp = requests.get(f"{worker}/api/cluster/probe/{job_id}", headers=self._headers(), timeout=10)
+            resp.raise_for_status()
+            job = resp.json()
+            if job['state'] == 'done':
+                return job.get('site') or worker, job.get('rows', [])
+            if job['state'] == 'failed':
+                raise RuntimeError(job.get('error') or '探测失败')
+        raise TimeoutError(f"等待 {worker} 超过 {self.timeout} 秒")
+
+    def _run_round(self, assignments: list[tuple[str, list[str]]], round_name: str, tag: str,
+                   tracker=None) -> dict[str, list[dict]]:
+        """并行执行一轮探测，assignments 为 [(worker 地址或 'local', IP 段)]；返回 {站点: 结果行}"""
+        site_rows = {}
+
+        def run_one(worker, ranges):
+            if not ranges:
+                return None
+            if worker == 'local':
+                return self.optimizer.cluster_site, self.optimizer.probe_ranges(ranges, tag=tag, tracker=tracker)
+            return self._run_remote(worker, ranges, tracker.cancel if tracker else None)
+
+        with ThreadPoolExecutor(max_workers=len(assignments) or 1, thread_name_prefix="ClusterRound") as executor:
+            futures = {executor.submit(run_one, worker, ranges): worker for worker, ranges in assignments}
+            for future, worker in futures.items():
+                try:
+                    result = future.result()
+                except Exception as e:
+                    if tracker and tracker.cancel.is_set():
+                        logging.warning(f"集群 coordinator: 任务{tracker.cancel.reason}，已停止等待节点 {worker} 的{round_name}探测。")
+                    else:
+                        logging.error(f"集群 coordinator: 节点 {worker} 的{round_name}探测失败: {e}")
+                    continue
+                if result:
+                    site, rows = result
+                    site_rows.setdefault(site, []).extend(rows)
+                    logging.info(f"集群 coordinator: 节点 {site} 完成{round_name}探测，{len(rows)} 个 IP 可用。")
+        return site_rows
+
+    def run(self, ranges: list[str], tracker=None) -> list[dict]:
+        """执行一次分布式优选，返回全局排名（result.csv 格式的行）"""
+        nodes = (['local'] if self.include_local else []) + self.workers
+        if not nodes:
+            raise RuntimeError("集群 coordinator: 没有可用的节点")
+
+        chunks = split_ranges(ranges, len(nodes))
+        logging.info(f"集群 coordinator: 将 {sum(len(c) for c in chunks)} 个子网分配给 {len(nodes)} 个节点扫描...")
+        scan_rows = self._run_round(list(zip(nodes, chunks)), '扫描', 'scan', tracker)
+        if tracker and tracker.cancel.is_set():
+            return []
+        scan_ranking = sorted((row for rows in scan_rows.values() for row in rows),
+                              key=lambda r: (row_float(r, COL_LOSS), row_float(r, COL_LATENCY, 9999)))
+        top_ips = list(dict.fromkeys(row[COL_IP] for row in scan_ranking))[:self.verify_top_k]
+        if not top_ips:
+            return []
+
+        # 第二轮：所有节点复测同一批 IP，得到每个站点的视图，找出各地都好的 IP
+        logging.info(f"集群 coordinator: 所有节点复测前 {len(top_ips)} 个 IP...")
+        verify_rows = self._run_round([(node, top_ips) for node in nodes], '复测', 'verify', tracker)
+        if tracker and tracker.cancel.is_set():
+            return []
+        global_ranking = merge_site_results(verify_rows)
+
+        app_state.cluster_results = {
+            'updated_at': time.time(),
+            'nodes': [self.optimizer.cluster_site if node == 'local' else node for node in nodes],
+            'global': global_ranking,
+            'sites': verify_rows,
+            'scan_sites': {site: len(rows) for site, rows in scan_rows.items()},
+        }
+        return global_ranking
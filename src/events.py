@@ -0,0 +1,143 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\events.py
+"""
+进程内的事件总线，/api/events 以 Server-Sent Events 推送给前端和外部订阅者，替代定时轮询。
+
+事件类型：
+- best_ip：最优 IP 变化 {best_ip, previous, reason}
+- results：结果更新 {version, count, best_ip}
+- run_started / run_progress / run_finished：优选任务开始、进度（每秒至多一次）、结束
+- push：推送目标状态变化 {name, state, ip, error, ...}
+- log：新日志行 {cursor, line}，cursor 与 /api/logs?since= 的游标一致
+- reset：客户端的 Last-Event-ID 已不在缓冲区中（断线太久或服务已重启），应重新获取完整状态
+
+每个事件的 id 为 "<epoch>-<序号>"：epoch 标识本次进程启动，序号递增。断线重连时浏览器自动以 Last-Event-ID
+请求头带上最后收到的 id，从该位置之后继续推送；epoch 与当前进程不同（服务已重启，序号重新从 1 开始）时推送 reset。
+"""
+import json
+import threading
+import time
+from collections import deque, namedtuple
+from itertools import islice
+from .state import DEFAULT_PROFILE
+from . import metrics
+
+EVENT_BEST_IP = 'best_ip'
+EVENT_RESULTS = 'results'
+EVENT_RUN_STARTED = 'run_started'
+EVENT_RUN_PROGRESS = 'run_progress'
+EVENT_RUN_FINISHED = 'run_finished'
+EVENT_PUSH = 'push'
+EVENT_LOG = 'log'
+EVENT_RESET = 'reset'
+
+# 保留在内存中、可供断线重连补发的事件数量
+DEFAULT_CAPACITY = 2000
+
+Event = namedtuple('Event', ('id', 'type', 'profile', 'data'))
+
+
+def format_sse(event_id: str, event_type: str, data: str) -> str:
+    """按 text/event-stream 格式编码一个事件（data 为不含换行的 JSON）"""
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data}\n\n"
+
+
+class EventBus:
+    """
+    固定容量的事件环形缓冲区。publish 只是一次加锁的追加并唤醒等待的订阅者，
+    没有订阅者时开销可以忽略；订阅者按 id 读取，互不影响。
+    """
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        self._events = deque(maxlen=capacity)
+        self._next_id = 1
+        # 本次进程启动的标识（毫秒时间戳），区分重启前后的同一序号
+        self.epoch = format(time.time_ns() // 1_000_000, 'x')
+        self._cond = threading.Condition()
+        self._clients = 0
+        self._clients_lock = threading.Lock()
+
+    def publish(self, event_type: str, data: dict, profile: str = DEFAULT_PROFILE):
+        payload = json.dumps({"profile": profile, **data}, ensure_ascii=False, separators=(',', ':'))
+        with self._cond:
+            self._events.append(Event(self._next_id, event_type, profile, payload))
+            self._next_id += 1
+            self._cond.notify_all()
+        metrics.EVENTS_PUBLISHED.inc(event_type)
+
+    @property
+    def last_id(self) -> int:
+        with self._cond:
+            return self._next_id - 1
+
+    def format_id(self, seq: int) -> str:
+        return f"{self.epoch}-{seq}"
+
+    def parse_id(self, value: str) -> int:
+        """
+        解析客户端的 Last-Event-ID，返回序号；id 属于之前的进程（epoch 不同或旧的纯数字 id）时返回 -1，
+        read 会据此返回 reset。格式错误时抛出 ValueError。
+        """
+        epoch, sep, seq = value.strip().rpartition('-')
+        seq = int(seq)
+        if seq < 0:
+            raise ValueError(f"无效的事件 id: {value}")
+        return seq if sep and epoch == self.epoch else -1
+
+    def read(self, after: int, timeout: float):
+        """
+        返回 (events, reset)：id 大于 after 的事件，没有时最多等待 timeout 秒。
+        after 已被挤出缓冲区、大于当前最大 id 或为 -1（服务重启）时 reset 为 True，此时不补发，返回空列表。
+        """
+        with self._cond:
+            if after == self._next_id - 1:
+                self._cond.wait(timeout)
+            oldest = self._events[0].id if self._events else self._next_id
+            if after > self._next_id - 1 or after < oldest - 1:
+                return [], True
+            return list(islice(self._events, after - oldest + 1, None)), False
+
+    def subscribe(self, max_clients: int = 0) -> bool:
+        """登记一个订阅者；已达到 max_clients（0 表示不限制）时返回 False"""
+        with self._clients_lock:
+            if max_clients and self._clients >= max_clients:
+                return False
+            self._clients += 1
+            metrics.EVENT_CLIENTS.set(self._clients)
+            return True
+
+    def unsubscribe(self):
+        with self._clients_lock:
+            self._clients = max(0, self._clients - 1)
+            metrics.EVENT_CLIENTS.set(self._clients)
+
+    def stream(self, last_event_id: int = None, types: set = None, profile: str = None, keepalive: float = 15):
+        """
+        生成 SSE 文本流。last_event_id 为 parse_id 返回的序号，为空时只推送之后的新事件；types / profile 用于过滤事件（日志不按 profile 过滤）。
+        客户端断开后，WSGI 服务器在下一次写入（最迟 keepalive 秒后）时结束该生成器。
+        """
+        yield "retry: 3000\n\n"
+        cursor = self.last_id if last_event_id is None else last_event_id
+        last_write = time.monotonic()
+        while True:
+            events, reset = self.read(cursor, keepalive)
+            if reset:
+                cursor = self.last_id
+                chunk = format_sse(self.format_id(cursor), EVENT_RESET, '{}')
+            else:
+                cursor = events[-1].id if events else cursor
+                chunk = ''.join(format_sse(self.format_id(event.id), event.type, event.data) for event in events
+                                if (not types or event.type in types)
+                                and (profile is None or event.profile == profile or event.type == EVENT_LOG))
+            if not chunk and time.monotonic() - last_write >= keepalive:
+                # 注释行，保持连接并及时发现已断开的客户端
+                chunk = ": keep-alive\n\n"
+            if chunk:
+                last_write = time.monotonic()
+                yield chunk
+
+
+event_bus = EventBus()
+
+
+def publish(event_type: str, data: dict, profile: str = DEFAULT_PROFILE):
+    event_bus.publish(event_type, data, profile)
@@ -1,37 +1,126 @@
 # d:\桌面\cloudflare-ip-optimizer-main\src\heartbeat.py
+import asyncio
 import subprocess
 import sys
 import logging
-from .state import app_state
+import time
+from .results import COL_IP, COL_RECEIVED, ip_family
+from .tcping import probe_ip
+from .jobqueue import run_queue, TRIGGER_FAILOVER
+from . import metrics
+
+
+def _ping(ip: str) -> bool:
+    """使用系统 ping 命令检测单个 IP（旧版心跳方式）"""
+    # 根据不同操作系统构造 ping 命令
+    # -c 1 (Linux/macOS) / -n 1 (Windows): 发送1个包
+    # -W 5 (Linux) / -w 5000 (Windows): 超时5秒，增加超时以应对网络波动
+    # IPv6 地址: Linux 使用 ping -6，macOS 使用 ping6，Windows 的 ping 自动识别
+    if sys.platform == "win32":
+        command = ["ping", "-n", "1", "-w", "5000", ip]
+    elif ip_family(ip) == 6 and sys.platform == "darwin":
+        command = ["ping6", "-c", "1", ip]
+    elif ip_family(ip) == 6:
+        command = ["ping", "-6", "-c", "1", "-W", "5", ip]
+    else:
+        command = ["ping", "-c", "1", "-W", "5", ip]
+    # 使用 subprocess.run 来执行命令，并隐藏输出
+    result = subprocess.run(command, capture_output=True, text=True, check=False)
+    return result.returncode == 0
+
+
+def _probe_candidates(ips: list[str], port: int, attempts: int, timeout: float) -> dict:
+    """并发地对多个 IP 各进行 attempts 次 TCP 握手，返回 {ip: 失败次数}"""
+    async def probe_all():
+        rows = await asyncio.gather(*(probe_ip(ip, port, attempts, timeout) for ip in ips))
+        return {ip: attempts - int(row[COL_RECEIVED]) for ip, row in zip(ips, rows)}
+    return asyncio.run(probe_all())
+
+
+def _queue_reoptimize(optimizer_instance):
+    """以故障切换的优先级提交一次重新优选，不阻塞调度器线程；已有排队或运行中的优选时合并到该任务"""
+    run_queue.submit(optimizer_instance, TRIGGER_FAILOVER)
+
+
+def _candidates(best_ip: str, rows: list, top_n: int) -> list[str]:
+    """最优IP及其后的前 top_n 个候选 IP"""
+    return [best_ip] + [
+        row.get(COL_IP) for row in rows
+        if row.get(COL_IP) and row.get(COL_IP) != best_ip
+    ][:top_n]
+
 
 def check_best_ip(optimizer_instance):
     """
-    Ping 当前的最优IP，如果失败则触发一次新的优选。
+    心跳检测：并发检测最优IP及后续的前 N 个候选 IP。
+    最优IP在 n 次握手中失败不少于 k 次时判定为失效，立即切换到下一个健康的候选 IP 并推送，
+    随后在后台排队一次重新优选。没有健康的候选 IP 时直接在后台重新优选。
+    双栈优选且 IPv6 地址正在被发布时，IPv6 的最优IP及候选 IP 一并检测，两个地址族各自故障切换。
     """
-    if not app_state.best_ip:
+    state = optimizer_instance.state
+    if not state.best_ip:
         logging.info("心跳检测：未设置最优IP，跳过本次检测。")
+        metrics.HEARTBEAT_CHECKS.inc('skipped', optimizer_instance.profile)
         return
 
-    logging.info(f"心跳检测：正在 Ping 最优IP -> {app_state.best_ip}")
+    config = optimizer_instance.config
+    mode = config.get('Heartbeat', 'mode', fallback='tcp').strip().lower()
+    port = config.getint('Heartbeat', 'port', fallback=443)
+    top_n = config.getint('Heartbeat', 'top_n', fallback=5)
+    attempts = config.getint('Heartbeat', 'attempts', fallback=3)
+    failure_threshold = config.getint('Heartbeat', 'failure_threshold', fallback=2)
+    timeout = config.getint('Heartbeat', 'timeout_ms', fallback=2000) / 1000
+    rescan_on_failover = config.getboolean('Heartbeat', 'rescan_on_failover', fallback=True)
 
-    # 根据不同操作系统构造 ping 命令
-    # -c 1 (Linux/macOS) / -n 1 (Windows): 发送1个包
-    # -W 5 (Linux) / -w 5000 (Windows): 超时5秒，增加超时以应对网络波动
-    if sys.platform == "win32":
-        command = ["ping", "-n", "1", "-w", "5000", app_state.best_ip]
-    else:
-        command = ["ping", "-c", "1", "-W", "5", app_state.best_ip]
+    # (最优IP, 候选 IP) 按地址族排列，IPv4 在前
+    families = [_candidates(state.best_ip, state.last_results, top_n)]
+    if state.best_ip_v6 and state.ipv6_active:
+        families.append(_candidates(state.best_ip_v6, state.last_results_v6, top_n))
+    candidates = [ip for family in families for ip in family]
 
+    started = time.perf_counter()
     try:
-        # 使用 subprocess.run 来执行命令，并隐藏输出
-        result = subprocess.run(command, capture_output=True, text=True, check=False)
-        
-        if result.returncode == 0:
-            logging.info(f"心跳检测成功：IP {app_state.best_ip} 响应正常。")
+        if mode == 'ping':
+            best_ips = [family[0] for family in families]
+            logging.info(f"心跳检测：正在 Ping 最优IP -> {', '.join(best_ips)}")
+            failures = {ip: sum(0 if _ping(ip) else 1 for _ in range(attempts)) for ip in best_ips}
         else:
-            logging.warning(f"心跳检测失败：IP {app_state.best_ip} 无法访问。将触发一次新的IP优选。")
-            # 调用优选实例来运行测试
-            optimizer_instance.run_speed_test()
-
+            logging.info(f"心跳检测：正在对 {len(candidates)} 个 IP 进行 TCP 握手检测 (端口 {port}, 每个 {attempts} 次)")
+            failures = _probe_candidates(candidates, port, attempts, timeout)
     except Exception as e:
-        logging.error(f"执行 Ping 命令时出错: {e}")
+        logging.error(f"执行心跳检测时出错: {e}")
+        metrics.HEARTBEAT_CHECKS.inc('error', optimizer_instance.profile)
+        return
+    metrics.HEARTBEAT_SECONDS.observe(time.perf_counter() - started, mode, optimizer_instance.profile)
+
+    now = time.time()
+    state.health_status = {
+        ip: {"failures": count, "attempts": attempts, "healthy": count < failure_threshold, "checked_at": now}
+        for ip, count in failures.items()
+    }
+    optimizer_instance.save_snapshot()
+
+    reoptimize = False
+    for family in families:
+        best_ip = family[0]
+        if failures[best_ip] < failure_threshold:
+            logging.info(f"心跳检测成功：IP {best_ip} 响应正常 ({attempts - failures[best_ip]}/{attempts})。")
+            metrics.HEARTBEAT_CHECKS.inc('healthy', optimizer_instance.profile)
+            continue
+
+        logging.warning(f"心跳检测失败：IP {best_ip} 在 {attempts} 次检测中失败 {failures[best_ip]} 次。")
+        next_ip = next((ip for ip in family[1:] if failures.get(ip, attempts) < failure_threshold), None)
+        if next_ip:
+            metrics.HEARTBEAT_CHECKS.inc('failover', optimizer_instance.profile)
+            optimizer_instance.promote_best_ip(next_ip, failed_ip=best_ip)
+            if rescan_on_failover:
+                logging.info("心跳检测：已切换到备用IP，将在后台重新执行一次IP优选。")
+                reoptimize = True
+        else:
+            logging.warning("心跳检测：没有健康的备用IP，将在后台触发一次新的IP优选。")
+            metrics.HEARTBEAT_CHECKS.inc('no_healthy', optimizer_instance.profile)
+            reoptimize = True
+
+    # 两个地址族都需要重新优选时只提交一次（同一 profile 的请求也会在队列中合并）
+    if reoptimize:
+        _queue_reoptimize(optimizer_instance)
@@ -0,0 +1,101 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\history.py
+import logging
+import sqlite3
+import threading
+import time
+from .results import (
+    COL_IP, COL_SENT, COL_RECEIVED, COL_LOSS, COL_LATENCY, COL_COLO, row_float, row_speed
+)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS measurements (
+    id INTEGER PRIMARY KEY,
+    ts REAL NOT NULL,
+    ip TEXT NOT NULL,
+    sent INTEGER,
+    received INTEGER,
+    loss REAL,
+    latency REAL,
+    speed REAL,
+    colo TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_measurements_ip_ts ON measurements (ip, ts);
+CREATE INDEX IF NOT EXISTS idx_measurements_ts ON measurements (ts);
+"""
+
+
+class HistoryStore:
+    """
+    基于 SQLite 的 IP 测速历史记录。
+    每次优选的所有结果行在一个事务中批量写入，并按 (ip, ts) 建立索引以便查询单个 IP 的趋势。
+    """
+
+    def __init__(self, db_path: str, retention_days: int = 30):
+        self.db_path = db_path
+        self.retention_days = retention_days
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+
+    def record_run(self, results: list[dict], timestamp: float = None) -> int:
+        """批量写入一次优选的全部结果，并清理超出保留期的旧数据。返回写入的行数。"""
+        ts = timestamp or time.time()
+        rows = [
+            (ts, row.get(COL_IP), int(row_float(row, COL_SENT)), int(row_float(row, COL_RECEIVED)),
+             row_float(row, COL_LOSS), row_float(row, COL_LATENCY), row_speed(row), row.get(COL_COLO) or '')
+            for row in results if row.get(COL_IP)
+        ]
+        if not rows:
+            return 0
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO measurements (ts, ip, sent, received, loss, latency, speed, colo) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if self.retention_days > 0:
+                self._conn.execute("DELETE FROM measurements WHERE ts < ?",
+                                   (ts - self.retention_days * 86400,))
+        logging.info(f"历史记录: 已写入 {len(rows)} 条测速记录。")
+        return len(rows)
+
+    def best_ips(self, hours: float = 24, limit: int = 10, min_samples: int = 1) -> list[dict]:
+        """最近 hours 小时内表现最好的 IP：按平均丢包率、平均延迟排序"""
+        since = time.time() - hours * 3600
+        with self._lock:
+            cursor = self._conn.execute(
+                """
+                SELECT m.ip AS ip,
+                       COUNT(*) AS samples,
+                       ROUND(AVG(loss), 4) AS avg_loss,
+                       ROUND(AVG(latency), 2) AS avg_latency,
+                       ROUND(MIN(latency), 2) AS min_latency,
+                       ROUND(MAX(speed), 2) AS max_speed,
+                       MAX(ts) AS last_seen,
+                       -- 地区码取该 IP 最新一条记录的值（按 (ip, ts) 索引查找）
+                       (SELECT latest.colo FROM measurements AS latest
+                        WHERE latest.ip = m.ip ORDER BY latest.ts DESC LIMIT 1) AS colo
+                FROM measurements AS m
+                WHERE ts >= ?
+                GROUP BY m.ip
+                HAVING COUNT(*) >= ?
+                ORDER BY avg_loss ASC, avg_latency ASC
+                LIMIT ?
+                """, (since, min_samples, limit))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def ip_trend(self, ip: str, hours: float = 24 * 7) -> list[dict]:
+        """单个 IP 在最近 hours 小时内的全部测速记录，按时间升序"""
+        since = time.time() - hours * 3600
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT ts, sent, received, loss, latency, speed, colo FROM measurements "
+                "WHERE ip = ? AND ts >= ? ORDER BY ts ASC", (ip, since))
+            return [dict(row) for row in cursor.fetchall()]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
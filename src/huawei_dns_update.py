@@ -1,8 +1,11 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import time
 import logging
+import threading
 import requests
 
 from huaweicloudsdkcore.auth.credentials import BasicCredentials
@@ -12,10 +15,12 @@ from huaweicloudsdkdns.v2.model import (
     ListRecordSetsRequest,
     UpdateRecordSetRequest,
     CreateRecordSetRequest,
+    DeleteRecordSetRequest,
     UpdateRecordSetReq
 )
 
 # ===== 配置 =====
+# 作为独立脚本运行时使用；在服务中运行时读取 config.ini 的 [HuaweiDNS] 配置节
 AK = os.getenv("HW_AK")
 SK = os.getenv("HW_SK")
 PROJECT_ID = os.getenv("HW_PROJECT_ID")
@@ -23,26 +28,173 @@ ZONE_ID = os.getenv("HW_ZONE_ID")
 REGION_NAME = "cn-east-3"
 DOMAIN_NAME = "cdn.akk.pp.ua."
 RECORD_TYPE = "A"
+# 双栈优选时另外发布的 IPv6 记录类型
+RECORD_TYPE_V6 = "AAAA"
 TTL = 300
 MAX_RECORDS = 10
 
 API_IPS_URL = "http://0.0.0.0/api/results"
+# 双栈优选的 IPv6 结果，服务未启用双栈时为空列表
+API_IPS_V6_URL = "http://0.0.0.0/api/results_v6"
+# --watch 模式订阅的事件流，结果更新时立即发布，无需定时轮询
+API_EVENTS_URL = "http://0.0.0.0/api/events?types=results"
 
-logging.basicConfig(
-    filename="huawei_dns_sdk.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(message)s"
-)
 
 class SimpleRegion:
-    def __init__(self, name):
+    def __init__(self, name, endpoint=None):
         self.name = name
         self.id = name  # 华为SDK需要用到region.id
-        self.endpoints = [f"https://dns.{name}.myhuaweicloud.com"]
+        self.endpoints = [endpoint or f"https://dns.{name}.myhuaweicloud.com"]
+
+
+class HuaweiDnsPublisher:
+    """
+    进程内的华为云 DNS 发布器。
+    DnsClient、默认线路记录集 ID 以及上次发布的 IP 集合都会被缓存：
+    IP 集合未变化时不发起任何 API 请求；变化时直接按缓存的记录集 ID 更新。
+    """
+
+    def __init__(self, ak, sk, project_id, zone_id, region=REGION_NAME, domain=DOMAIN_NAME,
+                 record_type=RECORD_TYPE, ttl=TTL, max_records=MAX_RECORDS, endpoint=None):
+        self.ak = ak
+        self.sk = sk
+        self.project_id = project_id
+        self.zone_id = zone_id
+        self.region = region
+        self.domain = domain if domain.endswith('.') else f"{domain}."
+        self.record_type = record_type
+        self.ttl = ttl
+        self.max_records = max_records
+        # 自定义 API 地址（例如离线基准测试中的模拟服务），为空时使用 region 对应的官方地址
+        self.endpoint = endpoint or None
+        self._client = None
+        self._recordset_id = None
+        self._published = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, section, record_type=RECORD_TYPE):
+        """从 [HuaweiDNS] 配置节创建发布器，AK/SK 等留空时回退到环境变量"""
+        return cls(
+            ak=section.get('ak', fallback='') or AK,
+            sk=section.get('sk', fallback='') or SK,
+            project_id=section.get('project_id', fallback='') or PROJECT_ID,
+            zone_id=section.get('zone_id', fallback='') or ZONE_ID,
+            region=section.get('region', fallback=REGION_NAME),
+            domain=section.get('domain', fallback=DOMAIN_NAME),
+            record_type=record_type,
+            ttl=section.getint('ttl', fallback=TTL),
+            max_records=section.getint('max_records', fallback=MAX_RECORDS),
+            endpoint=section.get('endpoint', fallback=''),
+        )
+
+    def config_key(self):
+        return (self.ak, self.sk, self.project_id, self.zone_id, self.region, self.domain,
+                self.record_type, self.ttl, self.max_records, self.endpoint)
+
+    def _get_client(self):
+        if self._client is None:
+            creds = BasicCredentials(self.ak, self.sk, self.project_id)
+            self._client = DnsClient.new_builder() \
+                .with_credentials(creds) \
+                .with_region(SimpleRegion(self.region, self.endpoint)) \
+                .build()
+        return self._client
+
+    def _find_default_record(self):
+        """查询默认线路的记录集，返回记录集对象或 None"""
+        request = ListRecordSetsRequest()
+        request.zone_id = self.zone_id
+        request.name = self.domain
+        request.type = self.record_type
+        resp = self._get_client().list_record_sets(request)
+        records = resp.recordsets or []
+        logging.info(f"华为DNS: 查询到的记录数: {len(records)}")
+
+        # 找默认线路记录，通常线路字段 line 为空或"default"表示默认线路
+        for r in records:
+            line = getattr(r, "line", "") or getattr(r, "line_id", "")
+            if line in ("默认", "default", "default_view", ""):
+                return r
+        return None
+
+    def publish(self, ips: list[str], force: bool = False) -> bool:
+        """
+        将 ips（去重后取前 max_records 个）发布到默认线路记录集。
+        force=True 时忽略缓存，重新查询线上记录（用于定时校准）。成功或无需更新时返回 True。
+        """
+        best_ips = list(dict.fromkeys(ip for ip in ips if ip))[:self.max_records]
+        if not best_ips:
+            logging.info("华为DNS: 没有可发布的优选IP，跳过。")
+            return False
+
+        with self._lock:
+            if not force and self._published == set(best_ips):
+                logging.info("华为DNS: IP 列表与上次发布的一致，无需更新。")
+                return True
+
+            try:
+                if force or self._recordset_id is None:
+                    default_record = self._find_default_record()
+                    self._recordset_id = default_record.id if default_record else None
+                    if default_record and set(default_record.records or []) == set(best_ips):
+                        self._published = set(best_ips)
+                        logging.info("华为DNS: IP 列表与默认线路已有记录一致，无需更新。")
+                        return True
+
+                body = UpdateRecordSetReq(name=self.domain, type=self.record_type, ttl=self.ttl, records=best_ips)
+                if self._recordset_id:
+                    update_req = UpdateRecordSetRequest()
+                    update_req.zone_id = self.zone_id
+                    update_req.recordset_id = self._recordset_id
+                    update_req.body = body
+                    self._get_client().update_record_set(update_req)
+                    logging.info(f"华为DNS: 修改默认线路记录成功: {best_ips}")
+                else:
+                    # 新增默认线路记录
+                    create_req = CreateRecordSetRequest()
+                    create_req.zone_id = self.zone_id
+                    create_req.body = body
+                    resp = self._get_client().create_record_set(create_req)
+                    self._recordset_id = getattr(resp, 'id', None)
+                    logging.info(f"华为DNS: 新增默认线路记录成功: {best_ips}")
+
+                self._published = set(best_ips)
+                return True
+
+            except exceptions.ClientRequestException as e:
+                logging.error(f"华为DNS: 更新记录失败: {e}")
+                # 记录集可能已在控制台被删除或修改，下次重新查询
+                self._recordset_id = None
+                self._published = None
+                return False
+
+
+    def clear(self) -> bool:
+        """删除默认线路的记录集（例如 IPv6 本次不发布时删除 AAAA 记录），记录不存在或删除成功时返回 True"""
+        with self._lock:
+            if self._published == set():
+                return True
+            try:
+                default_record = self._find_default_record()
+                if default_record:
+                    delete_req = DeleteRecordSetRequest()
+                    delete_req.zone_id = self.zone_id
+                    delete_req.recordset_id = default_record.id
+                    self._get_client().delete_record_set(delete_req)
+                    logging.info(f"华为DNS: 已删除默认线路的 {self.record_type} 记录: {default_record.records}")
+                self._recordset_id = None
+                self._published = set()
+                return True
+            except exceptions.ClientRequestException as e:
+                logging.error(f"华为DNS: 删除 {self.record_type} 记录失败: {e}")
+                self._published = None
+                return False
+
 
-def get_best_ips(limit=50):
+def get_best_ips(limit=50, url=API_IPS_URL):
     try:
-        resp = requests.get(API_IPS_URL, timeout=10)
+        resp = requests.get(url, timeout=10)
         resp.raise_for_status()
         data = resp.json()
         ips = [item.get("IP 地址") for item in data if item.get("IP 地址")]
@@ -55,86 +207,74 @@ def get_best_ips(limit=50):
         print(f"获取优选IP失败: {e}")
         return []
 
-def main():
-    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - 脚本开始执行...")
-    logging.info("脚本开始执行")
 
-    creds = BasicCredentials(AK, SK, PROJECT_ID)
-    client = DnsClient.new_builder() \
-        .with_credentials(creds) \
-        .with_region(SimpleRegion(REGION_NAME)) \
-        .build()
+def watch_results(reconnect_delay=5):
+    """
+    订阅服务的 /api/events，每次结果更新（或事件无法续传、需要重新获取）时产出一次事件类型。
+    断线后等待 reconnect_delay 秒，带上 Last-Event-ID 重新连接。
+    """
+    last_event_id = None
+    while True:
+        headers = {'Last-Event-ID': last_event_id} if last_event_id else {}
+        try:
+            # 读取超时需大于服务端的保活间隔（15 秒）
+            with requests.get(API_EVENTS_URL, headers=headers, stream=True, timeout=(10, 60)) as resp:
+                resp.raise_for_status()
+                event_type = None
+                for line in resp.iter_lines(decode_unicode=True):
+                    if line.startswith('id:'):
+                        last_event_id = line[3:].strip()
+                    elif line.startswith('event:'):
+                        event_type = line[6:].strip()
+                    elif not line:
+                        if event_type in ('results', 'reset'):
+                            yield event_type
+                        event_type = None
+        except requests.RequestException as e:
+            logging.error(f"订阅事件流失败: {e}")
+        time.sleep(reconnect_delay)
 
+
+def publish_all(publisher, publisher_v6, force=False):
+    """获取优选IP并发布 A 记录；服务有 IPv6 结果（双栈优选）时同时发布 AAAA 记录。返回 A 记录是否已是最新"""
     best_ips = get_best_ips(MAX_RECORDS)
     if not best_ips:
-        print("未获取到优选IP，退出。")
-        return
+        return False
+    success = publisher.publish(best_ips, force=force)
+    best_ips_v6 = get_best_ips(MAX_RECORDS, API_IPS_V6_URL)
+    if best_ips_v6:
+        publisher_v6.publish(best_ips_v6, force=force)
+    return success
 
-    request = ListRecordSetsRequest()
-    request.zone_id = ZONE_ID
-    request.name = DOMAIN_NAME
-    request.type = RECORD_TYPE
 
-    try:
-        resp = client.list_record_sets(request)
-        records = resp.recordsets
-        print(f"查询到的记录数: {len(records)}")
-        logging.info(f"查询到的记录数: {len(records)}")
-    except exceptions.ClientRequestException as e:
-        print(f"获取记录失败: {e}")
-        logging.error(f"获取记录失败: {e}")
-        return
+def watch(publisher, publisher_v6):
+    """--watch 模式：启动时发布一次，之后每次结果更新时重新获取并发布（记录一致时不发起更新请求）"""
+    publish_all(publisher, publisher_v6, force=True)
+    for _ in watch_results():
+        publish_all(publisher, publisher_v6)
 
-    # 找默认线路记录，通常线路字段 line 为空或"default"表示默认线路
-    default_record = None
-    for r in records:
-        line = getattr(r, "line", "") or getattr(r, "line_id", "")
-        if line in ("默认", "default", "default_view", ""):
-            default_record = r
-            break
-
-    if default_record:
-        old_ips = default_record.records or []
-        if set(old_ips) != set(best_ips):
-            update_req_body = UpdateRecordSetReq(
-                name=DOMAIN_NAME,
-                type=RECORD_TYPE,
-                ttl=TTL,
-                records=best_ips
-            )
-            update_req = UpdateRecordSetRequest()
-            update_req.zone_id = ZONE_ID
-            update_req.recordset_id = default_record.id
-            update_req.body = update_req_body
 
-            try:
-                client.update_record_set(update_req)
-                print(f"修改默认线路记录成功: {best_ips}")
-                logging.info(f"修改默认线路记录成功: {best_ips}")
-            except exceptions.ClientRequestException as e:
-                print(f"修改默认线路记录失败: {e}")
-                logging.error(f"修改默认线路记录失败: {e}")
-        else:
-            print("IP 列表与默认线路已有记录一致，无需更新")
-    else:
-        # 新增默认线路记录
-        create_req_body = UpdateRecordSetReq(
-            name=DOMAIN_NAME,
-            type=RECORD_TYPE,
-            ttl=TTL,
-            records=best_ips
-        )
-        create_req = CreateRecordSetRequest()
-        create_req.zone_id = ZONE_ID
-        create_req.body = create_req_body
+def main():
+    """独立脚本入口：通过 HTTP 从服务获取优选IP并发布；带 --watch 参数时常驻并订阅结果更新"""
+    logging.basicConfig(
+        filename="huawei_dns_sdk.log",
+        level=logging.INFO,
+        format="%(asctime)s - %(message)s"
+    )
+    print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - 脚本开始执行...")
+    logging.info("脚本开始执行")
 
-        try:
-            client.create_record_set(create_req)
-            print(f"新增默认线路记录成功: {best_ips}")
-            logging.info(f"新增默认线路记录成功: {best_ips}")
-        except exceptions.ClientRequestException as e:
-            print(f"新增默认线路记录失败: {e}")
-            logging.error(f"新增默认线路记录失败: {e}")
+    publisher = HuaweiDnsPublisher(AK, SK, PROJECT_ID, ZONE_ID)
+    publisher_v6 = HuaweiDnsPublisher(AK, SK, PROJECT_ID, ZONE_ID, record_type=RECORD_TYPE_V6)
+    if '--watch' in sys.argv[1:]:
+        print("常驻模式: 订阅结果更新事件...")
+        watch(publisher, publisher_v6)
+        return
+
+    if publish_all(publisher, publisher_v6, force=True):
+        print("默认线路记录已是最新。")
+    else:
+        print("未获取到优选IP或更新默认线路记录失败，详见日志。")
 
     print(f"{time.strftime('%Y-%m-%d %H:%M:%S')} - 脚本执行结束.")
     logging.info("脚本执行结束")
@@ -0,0 +1,215 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\jobqueue.py
+"""
+优选任务队列：定时任务、心跳故障切换、启动检查及 API 触发的优选都提交到这里，不再直接调用 run_speed_test。
+
+- 合并：同一 profile 已有排队或运行中的任务时，新的请求合并到该任务，而不是被丢弃或重复执行；
+- 优先级：故障切换 > 手动 > 启动检查 > 定时任务，并发数达到 [Profiles] max_concurrent_runs 时按优先级出队；
+- 超时：任务运行超过 [cfst] run_timeout 秒后被取消，cfst 的整个进程树随之终止；
+- 取消：/api/queue/cancel 可以取消排队中或运行中的任务；
+- 集群探测：worker 正在执行 coordinator 下发的探测任务时，开始运行的任务等待探测结束后再测速，而不是被跳过。
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from .runner import CancelToken, get_run_status
+from .profiles import probe_budget
+from .state import DEFAULT_PROFILE
+from . import metrics
+
+TRIGGER_FAILOVER = 'failover'
+TRIGGER_MANUAL = 'manual'
+TRIGGER_STARTUP = 'startup'
+TRIGGER_CRON = 'cron'
+# 数值越小越先执行
+PRIORITIES = {TRIGGER_FAILOVER: 0, TRIGGER_MANUAL: 1, TRIGGER_STARTUP: 2, TRIGGER_CRON: 3}
+
+# /api/queue 中保留的已结束任务数量
+HISTORY_SIZE = 20
+
+
+class RunJob:
+    """一次排队的优选任务；合并进来的请求记录在 triggers 中"""
+
+    def __init__(self, job_id: int, optimizer, trigger: str):
+        self.id = job_id
+        self.optimizer = optimizer
+        self.profile = optimizer.profile
+        self.triggers = [trigger]
+        self.priority = PRIORITIES[trigger]
+        self.coalesced = 0
+        self.state = 'queued'
+        self.message = ''
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.deadline = None
+        self.timed_out = False
+        self.cancel = CancelToken()
+        self._done = threading.Event()
+
+    def merge(self, trigger: str):
+        if trigger not in self.triggers:
+            self.triggers.append(trigger)
+        self.priority = min(self.priority, PRIORITIES[trigger])
+        self.coalesced += 1
+
+    def wait(self, timeout: float = None) -> bool:
+        """等待任务结束，超时返回 False"""
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "profile": self.profile,
+            "state": self.state,
+            "triggers": list(self.triggers),
+            "priority": self.priority,
+            "coalesced": self.coalesced,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "deadline": self.deadline,
+            "message": self.message,
+        }
+
+
+class RunQueue:
+    """
+    所有 profile 共用的优选任务队列。每个 profile 同时最多有一个运行中的任务，
+    max_concurrent 限制所有 profile 同时运行的任务数，0 表示不限制（各 profile 并发运行）。
+    """
+
+    def __init__(self, max_concurrent: int = 0):
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._pending = {}
+        self._running = {}
+        self._history = deque(maxlen=HISTORY_SIZE)
+        self.max_concurrent = max(0, max_concurrent)
+
+    def configure(self, max_concurrent: int):
+        with self._lock:
+            self.max_concurrent = max(0, max_concurrent)
+            self._dispatch()
+
+    def submit(self, optimizer, trigger: str):
+        """
+        提交一次优选请求，返回 (任务, 是否被合并)。
+        该 profile 已有排队或运行中（且未被取消）的任务时合并到该任务：运行中的任务结束后即是最新结果，无需再跑一次。
+        """
+        label = _label(optimizer.profile)
+        with self._lock:
+            job = self._pending.get(optimizer.profile) or self._running.get(optimizer.profile)
+            if job is not None and not job.cancel.is_set():
+                job.merge(trigger)
+                metrics.RUN_REQUESTS.inc(trigger, 'coalesced', optimizer.profile)
+                logging.info(f"优选任务队列{label}: {trigger} 请求已合并到{'运行' if job.state == 'running' else '排队'}中的任务 #{job.id}。")
+                return job, True
+            job = RunJob(next(self._ids), optimizer, trigger)
+            self._pending[optimizer.profile] = job
+            metrics.RUN_REQUESTS.inc(trigger, 'queued', optimizer.profile)
+            logging.info(f"优选任务队列{label}: 已提交任务 #{job.id} ({trigger})。")
+            self._dispatch()
+            return job, False
+
+    def cancel(self, profile: str, job_id: int = None) -> list[dict]:
+        """取消该 profile 排队中及运行中的任务（指定 job_id 时只取消该任务），返回被取消的任务"""
+        cancelled = []
+        with self._lock:
+            job = self._pending.get(profile)
+            if job is not None and job_id in (None, job.id):
+                del self._pending[profile]
+                self._finish(job, 'cancelled', '排队中被取消')
+                cancelled.append(job)
+            job = self._running.get(profile)
+            if job is not None and job_id in (None, job.id) and not job.cancel.is_set():
+                job.cancel.cancel('已取消')
+                cancelled.append(job)
+            self._dispatch()
+        if cancelled:
+            # 正在等待测速预算的任务立即结束等待
+            probe_budget.wake()
+        for job in cancelled:
+            logging.warning(f"优选任务队列{_label(profile)}: 任务 #{job.id} 已取消。")
+        return [job.to_dict() for job in cancelled]
+
+    def status(self, profile: str = None) -> dict:
+        with self._lock:
+            pending = sorted(self._pending.values(), key=lambda job: (job.priority, job.id))
+            running = list(self._running.values())
+            history = list(self._history)
+        if profile is not None:
+            pending = [job for job in pending if job.profile == profile]
+            running = [job for job in running if job.profile == profile]
+            history = [job for job in history if job.profile == profile]
+        return {
+            "max_concurrent": self.max_concurrent,
+            "depth": len(pending),
+            "running": [job.to_dict() for job in running],
+            "pending": [job.to_dict() for job in pending],
+            "history": [job.to_dict() for job in reversed(history)],
+        }
+
+    def _dispatch(self):
+        """（持有锁时调用）按优先级启动可以运行的排队任务"""
+        while not self.max_concurrent or len(self._running) < self.max_concurrent:
+            ready = [job for profile, job in self._pending.items() if profile not in self._running]
+            if not ready:
+                break
+            job = min(ready, key=lambda job: (job.priority, job.id))
+            del self._pending[job.profile]
+            self._running[job.profile] = job
+            job.state = 'running'
+            job.started_at = time.time()
+            threading.Thread(target=self._run, args=(job,), name=f"RunJob-{job.profile}-{job.id}", daemon=True).start()
+        metrics.RUN_QUEUE_DEPTH.set(len(self._pending))
+
+    def _run(self, job: RunJob):
+        timeout = job.optimizer.run_timeout
+        timer = None
+        if timeout > 0:
+            job.deadline = job.started_at + timeout
+            timer = threading.Timer(timeout, self._expire, args=(job, timeout))
+            timer.daemon = True
+            timer.start()
+        success = False
+        try:
+            success = job.optimizer.run_speed_test(cancel=job.cancel)
+        except Exception as e:
+            logging.error(f"优选任务队列{_label(job.profile)}: 任务 #{job.id} 出错: {e}")
+        finally:
+            if timer:
+                timer.cancel()
+            if job.cancel.is_set():
+                state = 'timeout' if job.timed_out else 'cancelled'
+            else:
+                state = 'succeeded' if success else 'failed'
+            message = job.cancel.reason or get_run_status(job.optimizer.state).get('message', '')
+            with self._lock:
+                del self._running[job.profile]
+                self._finish(job, state, message)
+                self._dispatch()
+
+    @staticmethod
+    def _expire(job: RunJob, timeout: int):
+        logging.error(f"优选任务队列{_label(job.profile)}: 任务 #{job.id} 运行超过 {timeout} 秒，正在终止...")
+        job.timed_out = True
+        job.cancel.cancel(f"超时 (运行超过 {timeout} 秒)")
+        probe_budget.wake()
+
+    def _finish(self, job: RunJob, state: str, message: str = ''):
+        job.state = state
+        job.message = message
+        job.finished_at = time.time()
+        self._history.append(job)
+        metrics.RUN_JOBS.inc(job.triggers[0], state, job.profile)
+        job._done.set()
+
+
+def _label(profile: str) -> str:
+    return '' if profile == DEFAULT_PROFILE else f" [{profile}]"
+
+
+run_queue = RunQueue()
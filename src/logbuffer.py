@@ -0,0 +1,60 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\logbuffer.py
+import logging
+import threading
+from collections import deque
+
+
+class RingBufferHandler(logging.Handler):
+    """
+    将最近的日志行保存在固定大小的内存环形缓冲区中。
+    每一行都有一个递增的序号（游标），客户端只需传入上次拿到的游标即可获取新增的日志，
+    查询开销与服务运行时长和日志文件大小无关。
+    on_line(序号, 日志行) 在每行写入后调用，用于把日志推送到事件流。
+    """
+
+    def __init__(self, capacity: int = 2000, on_line=None):
+        super().__init__()
+        self._buffer = deque(maxlen=capacity)
+        self._next_seq = 0
+        self._buffer_lock = threading.Lock()
+        self.on_line = on_line
+
+    def emit(self, record):
+        try:
+            line = self.format(record) + '\n'
+        except Exception:
+            self.handleError(record)
+            return
+        with self._buffer_lock:
+            seq = self._next_seq
+            self._buffer.append((seq, line))
+            self._next_seq += 1
+        if self.on_line:
+            self.on_line(seq, line)
+
+    def get_lines(self, since: int = None, limit: int = None) -> dict:
+        """
+        返回 {cursor, lines, truncated}。
+        since 为空时返回缓冲区中最新的 limit 行；否则返回序号 >= since 的行（最多 limit 行）。
+        cursor 为下次请求应传入的 since；truncated 表示有部分日志已被挤出缓冲区。
+        """
+        with self._buffer_lock:
+            entries = list(self._buffer)
+            next_seq = self._next_seq
+
+        oldest = entries[0][0] if entries else next_seq
+        truncated = False
+        if since is None:
+            if limit:
+                entries = entries[-limit:]
+        else:
+            since = max(since, 0)
+            if since > next_seq:
+                since = next_seq  # 服务重启后客户端的游标可能超前，从当前位置重新开始
+            truncated = since < oldest
+            entries = entries[max(since - oldest, 0):]
+            if limit:
+                entries = entries[:limit]
+
+        cursor = entries[-1][0] + 1 if entries else (next_seq if since is None else max(since, oldest))
+        return {"cursor": cursor, "lines": [line for _, line in entries], "truncated": truncated}
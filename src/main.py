@@ -1,7 +1,10 @@
 # d:\桌面\cloudflare-ip-optimizer-main\src\main.py
+# 最先导入，以便从进程启动开始计时
+from . import startup_report
 import configparser
 from typing import Any
 import logging
+import logging.handlers
 import os
 import sys
 import threading
@@ -12,54 +15,118 @@ from apscheduler.triggers.cron import CronTrigger
 # 使用相对导入，因为所有 .py 文件都在 src 包中
 from .optimizer import CloudflareOptimizer
 from .heartbeat import check_best_ip
-from .state import app_state
+from .state import app_state, ProfileState, DEFAULT_PROFILE
+from .profiles import profile_names, profile_config, probe_budget
+from .speedtest import bandwidth_budget
+from .jobqueue import run_queue, TRIGGER_CRON, TRIGGER_STARTUP
+from .cluster import CLUSTER_ROLES, cluster_token
 from .api import create_app  # 导入新的 api 模块
+from .logbuffer import RingBufferHandler
+from .events import publish, EVENT_LOG
 
 
-def setup_scheduler(optimizer: CloudflareOptimizer, config: configparser.ConfigParser) -> BackgroundScheduler:
-    """配置并启动调度器"""
-    scheduler = BackgroundScheduler(timezone="Asia/Shanghai")
-    
+def job_id(base: str, profile: str) -> str:
+    """默认 profile 沿用原有的任务 ID，其余 profile 加上名称后缀"""
+    return base if profile == DEFAULT_PROFILE else f"{base}:{profile}"
+
+
+def add_profile_jobs(scheduler: BackgroundScheduler, optimizer: CloudflareOptimizer):
+    """为一个 profile 添加定时优选、心跳检测及华为DNS校准任务"""
+    config = optimizer.config
+    profile = optimizer.profile
+    label = '' if profile == DEFAULT_PROFILE else f" [{profile}]"
+
     # 添加 fallback 增加健壮性
     optimize_cron = config.get('Scheduler', 'optimize_cron', fallback='0 */4 * * *')
     scheduler.add_job(
-        optimizer.run_speed_test,
+        lambda: run_queue.submit(optimizer, TRIGGER_CRON),
         trigger=CronTrigger.from_crontab(optimize_cron),
-        id='job_optimize_ip',
-        name='定时优选Cloudflare IP'
+        id=job_id('job_optimize_ip', profile),
+        name=f'定时优选Cloudflare IP{label}'
     )
-    logging.info(f"已添加定时优选任务，Cron: {optimize_cron}")
+    logging.info(f"已添加定时优选任务{label}，Cron: {optimize_cron}")
 
     # 添加 fallback 增加健壮性
     heartbeat_cron = config.get('Scheduler', 'heartbeat_cron', fallback='*/5 * * * *')
     scheduler.add_job(
         lambda: check_best_ip(optimizer),
         trigger=CronTrigger.from_crontab(heartbeat_cron),
-        id='job_heartbeat_check',
-        name='最优IP心跳检测'
+        id=job_id('job_heartbeat_check', profile),
+        name=f'最优IP心跳检测{label}'
     )
-    logging.info(f"已添加心跳检测任务，Cron: {heartbeat_cron}")
+    logging.info(f"已添加心跳检测任务{label}，Cron: {heartbeat_cron}")
     
-    # 新增：华为DNS更新任务
+    # 华为DNS定时校准任务：最优IP集合变化时会立即发布，这里定期重新查询线上记录，纠正被手动修改的记录
     dns_update_cron = config.get('Scheduler', 'dns_update_cron', fallback=None)
     if dns_update_cron:
-        def run_huawei_dns_update():
-            # 这里执行你放在 src 目录的脚本，比如 src/huawei_dns_update.py
-            # 也可以改成绝对路径，或其它执行方式
-            subprocess.run(["python3", "src/huawei_dns_update.py"], check=False)
-        
         scheduler.add_job(
-            run_huawei_dns_update,
+            lambda: optimizer.publisher.reconcile_dns(
+                optimizer.ranked_ips(), optimizer.ranked_ips(6) if optimizer.state.ipv6_active else []),
             trigger=CronTrigger.from_crontab(dns_update_cron),
-            id='job_huawei_dns_update',
-            name='华为DNS定时更新'
+            id=job_id('job_huawei_dns_update', profile),
+            name=f'华为DNS定时校准{label}'
         )
-        logging.info(f"已添加华为DNS更新任务，Cron: {dns_update_cron}")
+        logging.info(f"已添加华为DNS校准任务{label}，Cron: {dns_update_cron}")
+
 
+def setup_scheduler(optimizers: dict) -> BackgroundScheduler:
+    """配置并启动调度器，optimizers 为 {profile 名称: CloudflareOptimizer}"""
+    scheduler = BackgroundScheduler(timezone="Asia/Shanghai")
+    for optimizer in optimizers.values():
+        add_profile_jobs(scheduler, optimizer)
     scheduler.start()
     return scheduler
 
+
+def create_profile_optimizers(config: configparser.ConfigParser, config_dir: str) -> dict:
+    """为每个 [profile:名称] 创建独立的 CloudflareOptimizer 及状态"""
+    optimizers = {}
+    for name in profile_names(config):
+        if name == DEFAULT_PROFILE:
+            logging.error(f"profile 名称 '{DEFAULT_PROFILE}' 已被默认配置使用，忽略 [profile:{name}]。")
+            continue
+        state = ProfileState(name)
+        app_state.profiles[name] = state
+        optimizers[name] = CloudflareOptimizer(profile_config(config, name), config_dir=config_dir, state=state)
+        logging.info(f"已加载优选配置 [profile:{name}]: {' '.join(optimizers[name].params)}")
+    return optimizers
+
+
+def run_startup_test(optimizer: CloudflareOptimizer):
+    """通过任务队列执行启动时的优选，并等待其结束"""
+    job, _ = run_queue.submit(optimizer, TRIGGER_STARTUP)
+    job.wait()
+
+
+def startup_check(optimizer: CloudflareOptimizer, restored: bool):
+    """校验已有结果或运行新测试的启动逻辑（工具已下载）"""
+    state = optimizer.state
+    label = '' if optimizer.profile == DEFAULT_PROFILE else f" [{optimizer.profile}]"
+    if not restored:
+        if not os.path.exists(optimizer.output_filepath):
+            # 文件不存在，立即执行一次优选
+            logging.info(f"启动检查{label}: {os.path.basename(optimizer.output_filepath)} 不存在，将立即执行一次IP优选...")
+            run_startup_test(optimizer)
+            return
+        logging.info(f"启动检查{label}: 发现已存在的 {os.path.basename(optimizer.output_filepath)}，将进行解析。")
+        optimizer.load_results_from_file()
+
+    if not state.best_ip:
+        logging.warning(f"启动检查{label}: 没有可用的已有结果，将执行一次新的IP优选。")
+        run_startup_test(optimizer)
+        return
+
+    age = optimizer.results_age()
+    if age is None or age > optimizer.snapshot_max_age:
+        logging.info(f"启动检查{label}: 已有结果超过 {optimizer.snapshot_max_age / 3600:g} 小时，将重新执行IP优选。")
+        run_startup_test(optimizer)
+    else:
+        # 结果仍在有效期内，只进行心跳检测
+        logging.info(f"启动检查{label}: 已有结果仍在有效期内，进行心跳检测。")
+        check_best_ip(optimizer)
+
 def main() -> None:
+    startup_report.mark('imports')
     # 1. 确定路径
     # 无论从哪里运行脚本，都能找到正确的项目根目录和配置目录
     # __file__ -> .../src/main.py
@@ -80,7 +147,8 @@ def main() -> None:
         logging.warning(f"配置文件未找到: {CONFIG_FILE_PATH}，将使用默认配置并创建文件。")
         config = configparser.ConfigParser()
         config['cfst'] = {
-            'params': '-p 0 -o result.csv -url https://cf.xiu2.xyz/url -dn 10 -t 2 -dd '
+            'params': '-p 0 -o result.csv -url https://cf.xiu2.xyz/url -dn 10 -t 2 -dd ',
+            'mode': 'cfst'
         }
         config['Scheduler'] = {
             'optimize_cron': '0 3 * * *',
@@ -117,60 +185,85 @@ def main() -> None:
     for handler in root_logger.handlers[:]:
         root_logger.removeHandler(handler)
 
-    # 文件处理器
-    file_handler = logging.FileHandler(LOG_FILE_PATH, mode='w', encoding='utf-8')
+    log_config = config['Log'] if 'Log' in config else None
+    max_size_mb = log_config.getint('max_size_mb', fallback=5) if log_config else 5
+    backup_count = log_config.getint('backup_count', fallback=3) if log_config else 3
+    buffer_lines = log_config.getint('buffer_lines', fallback=2000) if log_config else 2000
+
+    # 文件处理器，超过 max_size_mb 后自动轮转，避免日志文件无限增长
+    file_handler = logging.handlers.RotatingFileHandler(
+        LOG_FILE_PATH, maxBytes=max_size_mb * 1024 * 1024, backupCount=backup_count, encoding='utf-8')
     file_handler.setFormatter(log_formatter)
     root_logger.addHandler(file_handler)
 
+    # 内存环形缓冲区处理器，/api/logs 直接从这里读取最近的日志，新日志同时推送到 /api/events
+    log_buffer = RingBufferHandler(capacity=buffer_lines,
+                                   on_line=lambda seq, line: publish(EVENT_LOG, {"cursor": seq, "line": line}))
+    log_buffer.setFormatter(log_formatter)
+    root_logger.addHandler(log_buffer)
+
     # 控制台处理器
     console_handler = logging.StreamHandler(sys.stdout)
     console_handler.setFormatter(log_formatter)
     root_logger.addHandler(console_handler)
 
-    # 3. 初始化核心优选器，并传入配置目录
+    startup_report.mark('config_loaded')
+
+    # 集群接口可以让节点扫描下发的 IP 段，没有共享令牌时拒绝以 worker/coordinator 模式启动
+    cluster_role = config.get('Cluster', 'role', fallback='standalone').strip().lower()
+    if cluster_role in CLUSTER_ROLES and not cluster_token(config):
+        logging.error(f"集群模式 ({cluster_role}) 必须在 [Cluster] 中配置 token，程序退出。")
+        sys.exit(1)
+
+    # 3. 初始化核心优选器（默认配置及各 [profile:名称]），并传入配置目录
     optimizer = CloudflareOptimizer(config, config_dir=CONFIG_DIR)
+    optimizers = {DEFAULT_PROFILE: optimizer, **create_profile_optimizers(config, CONFIG_DIR)}
+    probe_budget.configure(config.getint('Profiles', 'probe_budget', fallback=0), len(optimizers))
+    bandwidth_budget.configure(config.getfloat('Profiles', 'download_budget', fallback=0))
+    run_queue.configure(config.getint('Profiles', 'max_concurrent_runs', fallback=0))
 
-    # 4. 下载/检查工具
-    optimizer.download_and_extract_tool()
+    # 4. 最先从状态快照恢复上次的结果，API 启动后即可立即返回，无需等待工具下载或重新测速
+    restored = {name: profile_optimizer.restore_snapshot() for name, profile_optimizer in optimizers.items()}
+    startup_report.mark('snapshot_restored')
 
-    # 5. 启动时检查 result.csv 并决定初始操作
-    def startup_check():
-        """检查现有结果或运行新测试的启动逻辑"""
-        if not os.path.exists(optimizer.output_filepath):
-            # 文件不存在，立即执行一次优选
-            logging.info("启动检查: result.csv 不存在，将立即执行一次IP优选...")
-            optimizer.run_speed_test()
-        else:
-            # 文件存在，解析文件并进行心跳检测
-            logging.info(f"启动检查: 发现已存在的 result.csv，将进行解析和心跳测试。")
-            optimizer.load_results_from_file()
-            if app_state.best_ip:
-                check_best_ip(optimizer)
-            else:
-                logging.warning("启动检查: result.csv 解析失败或为空，将执行一次新的IP优选。")
-                optimizer.run_speed_test()
-
-    initial_run_thread = threading.Thread(target=startup_check, name="StartupCheckThread")
+    # 5. 在后台下载/检查工具，然后各 profile 并发地根据已有结果决定初始操作
+    def startup():
+        """下载/检查工具，然后对每个 profile 执行启动检查"""
+        optimizer.download_and_extract_tool()
+        threads = [threading.Thread(target=startup_check, args=(profile_optimizer, restored[name]),
+                                    name=f"StartupCheck-{name}")
+                   for name, profile_optimizer in optimizers.items()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    initial_run_thread = threading.Thread(target=startup, name="StartupCheckThread")
     initial_run_thread.start()
 
     # 6. 创建 Flask App, 并传入模板和静态文件夹路径
     app = create_app(optimizer, template_folder=TEMPLATE_DIR, static_folder=STATIC_DIR)
 
     # 7. 配置并启动调度器
-    scheduler = setup_scheduler(optimizer, config)
+    scheduler = setup_scheduler(optimizers)
 
     # 8. 在 app.config 中存储核心对象，方便在 API 路由中访问
+    app.config['PROFILES'] = optimizers
     app.config['CONFIG'] = config
     app.config['SCHEDULER'] = scheduler
     app.config['CONFIG_FILE_PATH'] = CONFIG_FILE_PATH
     app.config['LOG_FILE_PATH'] = LOG_FILE_PATH
+    app.config['LOG_BUFFER'] = log_buffer
 
     # 9. 启动API服务
+    startup_report.mark('app_ready')
     api_port = config['API'].getint('port', 6788)
-    logging.info(f"API服务将在 http://0.0.0.0:{api_port} 上启动")
+    # 每个 /api/events 订阅者占用一个工作线程，线程数需大于 max_event_clients
+    api_threads = config['API'].getint('threads', 16)
+    logging.info(f"API服务将在 http://0.0.0.0:{api_port} 上启动 ({api_threads} 个工作线程)")
     try:
         # 使用 waitress 作为生产级 WSGI 服务器
-        serve(app, host='0.0.0.0', port=api_port)
+        serve(app, host='0.0.0.0', port=api_port, threads=api_threads)
     except (KeyboardInterrupt, SystemExit):
         logging.info("收到退出信号，正在关闭调度器...")
         scheduler.shutdown()
@@ -0,0 +1,181 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\metrics.py
+"""
+轻量级的 Prometheus 指标（Counter / Gauge / Histogram），以文本格式在 /metrics 导出。
+不依赖 prometheus_client；每次记录只是一次加锁的字典更新，热路径上的开销可以忽略。
+"""
+import threading
+import time
+from bisect import bisect_left
+
+# 默认的耗时分桶（秒），覆盖毫秒级的 API 请求到分钟级的 SSH 推送
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# 完整测速、工具下载等长时间任务的分桶（秒）
+LONG_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class _Metric:
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _key(self, labels: tuple) -> tuple:
+        if len(labels) != len(self.labelnames):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.labelnames}，实际传入 {labels}")
+        return tuple(str(label) for label in labels)
+
+    def _label_str(self, key: tuple, extra: str = '') -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return '{' + ','.join(pairs) + '}' if pairs else ''
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+    type = 'counter'
+
+    def inc(self, *labels, amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._label_str(key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(_Metric):
+    """可以任意设置的数值"""
+    type = 'gauge'
+
+    def set(self, value: float, *labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def _samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{self._label_str(key)} {_format_value(value)}" for key, value in items]
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Histogram(_Metric):
+    """分桶统计（累计计数 + 总和），用于耗时等分布"""
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, *labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [各分桶计数 (最后一个为 +Inf), 总和, 总数]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def time(self, *labels) -> _Timer:
+        """with metric.time(...): 记录代码块的耗时"""
+        return _Timer(self, labels)
+
+    def _samples(self):
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{self._label_str(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {_format_value(round(total, 6))}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {count}")
+        return lines
+
+
+def render_all() -> str:
+    """以 Prometheus 文本格式 (0.0.4) 导出所有指标"""
+    with _registry_lock:
+        metrics = list(_registry)
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+# ===== 指标定义 =====
+
+TOOL_DOWNLOAD_SECONDS = Histogram(
+    'cfopt_tool_download_seconds', 'cfst 工具下载并解压的耗时', ('result',), buckets=LONG_BUCKETS)
+SPEED_TEST_SECONDS = Histogram(
+    'cfopt_speed_test_seconds', '一次测速任务（含增量、集群）的总耗时', ('engine', 'result', 'profile'), buckets=LONG_BUCKETS)
+IPS_PROBED = Counter('cfopt_ips_probed_total', '延迟测速阶段已测的 IP 数量', ('engine', 'profile'))
+PROBE_CONCURRENCY = Gauge('cfopt_probe_concurrency', '并发自动调节得到的下次扫描测速并发数 (-n)', ('profile',))
+RUN_REQUESTS = Counter('cfopt_run_requests_total', '提交到任务队列的优选请求（新任务或合并到已有任务）', ('trigger', 'outcome', 'profile'))
+RUN_JOBS = Counter('cfopt_run_jobs_total', '任务队列中已结束的优选任务', ('trigger', 'state', 'profile'))
+RUN_QUEUE_DEPTH = Gauge('cfopt_run_queue_depth', '排队等待执行的优选任务数量')
+DOWNLOAD_BYTES = Counter('cfopt_download_bytes_total', '内置下载测速下载的字节数', ('profile',))
+DOWNLOAD_TEST_SECONDS = Histogram('cfopt_download_test_seconds', '内置下载测速中单个 IP 的测速耗时', ('outcome', 'profile'))
+
+PARSE_SECONDS = Histogram('cfopt_parse_seconds', '解析结果文件并更新状态的耗时', ('profile',))
+ROWS_PARSED = Counter('cfopt_rows_parsed_total', '从结果文件解析出的行数', ('profile',))
+RESULT_ROWS = Gauge('cfopt_result_rows', '当前结果中的 IP 数量', ('profile',))
+BEST_IP_CHANGES = Counter('cfopt_best_ip_changes_total', '最优 IP 发生变化的次数', ('reason', 'profile'))
+
+SSH_CONNECT_SECONDS = Histogram('cfopt_ssh_connect_seconds', '建立 SSH 连接（握手 + 认证）的耗时', ('host',))
+SSH_OP_SECONDS = Histogram('cfopt_ssh_op_seconds', '推送过程中 SSH 读取/写入/执行命令及 AdGuard Home API 读写的耗时', ('target', 'op'))
+PUSH_SECONDS = Histogram('cfopt_push_seconds', '单个推送目标每次尝试的耗时', ('target', 'result', 'profile'))
+DNS_PUBLISH_SECONDS = Histogram('cfopt_dns_publish_seconds', '华为云 DNS 发布的耗时', ('result', 'profile'))
+
+HEARTBEAT_CHECKS = Counter('cfopt_heartbeat_checks_total', '心跳检测结果', ('outcome', 'profile'))
+HEARTBEAT_SECONDS = Histogram('cfopt_heartbeat_seconds', '一次心跳检测（并发握手）的耗时', ('mode', 'profile'))
+
+PEAK_RSS_BYTES = Gauge('cfopt_process_peak_rss_bytes', '进程的峰值常驻内存（字节）')
+HTTP_REQUEST_SECONDS = Histogram('cfopt_http_request_seconds', 'API 请求的处理耗时', ('route', 'method', 'status'))
+EVENTS_PUBLISHED = Counter('cfopt_events_published_total', '发布到事件总线 (/api/events) 的事件数量', ('type',))
+EVENT_CLIENTS = Gauge('cfopt_event_clients', '当前连接 /api/events 的订阅者数量')
@@ -2,35 +2,167 @@
 import os
 import sys
 import platform
-import requests
 import zipfile
 import tarfile
-import subprocess
 import logging
 import csv
+import ipaddress
+import random
+import time
+import socket
 from io import StringIO
-from .state import app_state
-from .updater import update_openwrt_hosts, update_adguard_hosts
+from .state import app_state, DEFAULT_PROFILE
+from .tcping import load_ranges, expand_ranges, run_tcping
+from .speedtest import DEFAULT_URL, run_download_test
+from .results import COL_IP, ip_family, write_results_csv
+from .runner import RunTracker, CancelToken, run_streaming
+from .history import HistoryStore
+from .snapshot import SnapshotStore
+from .payloads import rebuild_payloads
+from .publisher import PushManager
+from .profiles import probe_budget
+from .events import publish, EVENT_BEST_IP
+from .assignment import publish_ipv6
+from .autotune import ConcurrencyTuner
+from . import metrics
+
+# 队列中的任务等待集群探测任务释放 optimizer_lock 时检查取消的间隔（秒）
+LOCK_WAIT_INTERVAL = 0.5
+
 
 class CloudflareOptimizer:
-    def __init__(self, config, config_dir='.'):
+    def __init__(self, config, config_dir='.', state=app_state):
         self.config = config # 保存对配置对象的引用
         self.config_dir = config_dir
+        # 本实例所属 profile 的状态，默认配置即全局的 app_state
+        self.state = state
+        self.profile = state.name
         self.tool_dir = os.path.join(self.config_dir, "cfst_tool")
         self.tool_path = self._get_tool_path()
+        self.history = None
+        self.snapshot = None
+        self.autotune = None
+        self.publisher = PushManager(config, state)
         self.reload_config() # 调用新方法来加载参数
 
     def reload_config(self):
         """从 self.config 对象重新加载配置参数，以便热更新。"""
         logging.info("正在重新加载 Optimizer 配置...")
         self.params = self.config['cfst']['params'].split()
-        self.openwrt_config = self.config['OpenWRT'] if 'OpenWRT' in self.config else None
+        # 测速引擎: 'cfst' 调用外部可执行文件; 'native' 使用内置的 asyncio TCPing 引擎
+        self.mode = self.config['cfst'].get('mode', fallback='cfst').strip().lower()
+        self.native_timeout = self.config['cfst'].getint('native_timeout_ms', fallback=1000) / 1000
+        # 下载测速引擎: 'cfst' 由 cfst 逐个 IP 下载测速; 'native' 给 cfst 加上 -dd，延迟测速后由内置的多连接下载测速进行
+        # native 模式始终使用内置下载测速；params 中带 -dd 时不进行下载测速
+        self.download_engine = 'native' if self.mode == 'native' else \
+            self.config['cfst'].get('download_engine', fallback='cfst').strip().lower()
+        self.download_connections = self.config['cfst'].getint('download_connections', fallback=4)
+        self.download_parallel = self.config['cfst'].getint('download_parallel', fallback=4)
+        self.download_stable = self.config['cfst'].getfloat('download_stable', fallback=0.05)
+        # 进度停滞超过该秒数时终止 cfst 进程，0 表示不检测
+        self.stall_timeout = self.config['cfst'].getint('stall_timeout', fallback=300)
+        # 一次优选任务（含解析与推送）的最长运行时间，超时后由任务队列终止，0 表示不限制
+        self.run_timeout = self.config['cfst'].getint('run_timeout', fallback=3600)
+        # 增量优选: 先复测上次的前 K 个 IP 及其同 /24 段的少量邻居，达标则不再完整扫描
+        self.incremental = self.config['cfst'].getboolean('incremental', fallback=False)
+        self.incremental_top_k = self.config['cfst'].getint('incremental_top_k', fallback=10)
+        self.incremental_neighbours = self.config['cfst'].getint('incremental_neighbours', fallback=2)
+        self.incremental_min_pass = self.config['cfst'].getint('incremental_min_pass', fallback=3)
+        # 集群模式: standalone 独立运行; coordinator 将 IP 段分给各 worker 扫描并合并结果; worker 接受 coordinator 下发的探测任务
+        self.cluster_role = self.config.get('Cluster', 'role', fallback='standalone').strip().lower()
+        self.cluster_site = self.config.get('Cluster', 'site', fallback='') or socket.gethostname()
         self.download_config = self.config['Download'] if 'Download' in self.config else {}
+        # 双栈优选: 每次优选在 IPv4 之后再扫描 IPv6 段，两个地址族分别排名，推送时同时发布 IPv6 地址 (AAAA)
+        self.dual_stack = self.config['cfst'].getboolean('dual_stack', fallback=False)
         
         # 获取原始输出文件名并构建完整路径
         output_filename = self._find_output_filename()
-        self.output_filepath = os.path.join(self.config_dir, output_filename)
+        self.output_filepath = self._work_path(output_filename)
         self._update_output_param_with_full_path()
+        stem, ext = os.path.splitext(output_filename)
+        self.output_filepath_v6 = self._work_path(f"{stem}_v6{ext}")
+        self.params_v6 = self._ipv6_params()
+        self._setup_history()
+        self._setup_snapshot()
+        self._setup_autotune()
+        self.publisher.reload()
+
+    def _work_path(self, filename):
+        """配置目录下的工作文件路径；非默认 profile 的结果、快照等文件加上 profile 名前缀，避免并发时互相覆盖"""
+        if self.profile != DEFAULT_PROFILE:
+            directory, name = os.path.split(filename)
+            filename = os.path.join(directory, f"{self.profile}_{name}")
+        return os.path.join(self.config_dir, filename)
+
+    def _setup_snapshot(self):
+        """根据 [Snapshot] 配置启用（或关闭）状态快照"""
+        section = self.config['Snapshot'] if 'Snapshot' in self.config else None
+        enabled = section.getboolean('enabled', fallback=True) if section else True
+        # 结果超过该时长（小时）时，启动后重新测速；否则只做心跳检测
+        self.snapshot_max_age = (section.getfloat('max_age_hours', fallback=24) if section else 24) * 3600
+        if not enabled:
+            self.snapshot = None
+            return
+        snapshot_file = section.get('file', fallback='state_snapshot.json') if section else 'state_snapshot.json'
+        max_rows = section.getint('max_rows', fallback=500) if section else 500
+        self.snapshot = SnapshotStore(self._work_path(snapshot_file), max_rows, self.state)
+
+    def restore_snapshot(self):
+        """启动时从快照恢复上次的结果，成功返回 True"""
+        if not self.snapshot or not self.snapshot.load():
+            return False
+        age = self.results_age()
+        age_text = f"{age / 3600:.1f} 小时前" if age is not None else "时间未知"
+        logging.info(f"已从状态快照恢复结果: 最优IP {self.state.best_ip}，共 {len(self.state.last_results)} 条，"
+                     f"测速于 {age_text}。")
+        return True
+
+    def save_snapshot(self):
+        """结果或健康状态变化后保存状态快照"""
+        if self.snapshot:
+            self.snapshot.save()
+
+    def results_age(self):
+        """当前结果距上次测速的秒数，未知时返回 None"""
+        if self.state.last_scan_at is None:
+            return None
+        return max(0.0, time.time() - self.state.last_scan_at)
+
+    def _setup_autotune(self):
+        """根据 [cfst] autotune 启用（或关闭）测速并发数的自动调节，初始并发为 params 中的 -n"""
+        section = self.config['cfst']
+        if not section.getboolean('autotune', fallback=False):
+            self.autotune = None
+            return
+        path = self._work_path(section.get('autotune_file', fallback='autotune.json'))
+        if not self.autotune or self.autotune.path != path:
+            self.autotune = ConcurrencyTuner(path, int(self._param(self.params, '-n', 200)), self.profile)
+        self.autotune.configure(section)
+
+    def _setup_history(self):
+        """根据 [History] 配置打开（或关闭）测速历史数据库"""
+        history_config = self.config['History'] if 'History' in self.config else None
+        enabled = history_config.getboolean('enabled', fallback=True) if history_config else True
+        if not enabled:
+            if self.history:
+                self.history.close()
+                self.history = None
+            return
+
+        db_file = history_config.get('db_file', fallback='history.db') if history_config else 'history.db'
+        db_path = self._work_path(db_file)
+        retention_days = history_config.getint('retention_days', fallback=30) if history_config else 30
+        if self.history and self.history.db_path == db_path:
+            self.history.retention_days = retention_days
+            return
+
+        if self.history:
+            self.history.close()
+        try:
+            self.history = HistoryStore(db_path, retention_days)
+        except Exception as e:
+            logging.error(f"打开历史数据库 {db_path} 失败，将不记录测速历史: {e}")
+            self.history = None
 
     def _update_output_param_with_full_path(self):
         """将参数中的相对输出文件名替换为完整路径，以确保文件在正确的位置生成。"""
@@ -40,6 +172,26 @@ class CloudflareOptimizer:
         except (ValueError, IndexError):
             pass # 此错误已在 _find_output_filename 中处理
         
+    @staticmethod
+    def _param(params, name, default=None):
+        """读取参数列表中某个参数的值，不存在时返回 default"""
+        if name in params:
+            index = params.index(name)
+            if index + 1 < len(params):
+                return params[index + 1]
+        return default
+
+    def _ipv6_params(self):
+        """
+        IPv6 扫描的参数：[cfst] params_v6，留空时为 params 改用 IPv6 段文件 ipv6_file（默认 cfst 自带的 ipv6.txt，
+        内置引擎找不到该文件时使用 Cloudflare 官方 IPv6 段）。输出始终写到 IPv6 结果文件。
+        """
+        params_v6 = self.config['cfst'].get('params_v6', fallback='').split()
+        if params_v6:
+            return self._with_param(params_v6, '-o', self.output_filepath_v6)
+        ip_file = self.config['cfst'].get('ipv6_file', fallback='ipv6.txt').strip()
+        return self._replace_ip_source(self.params, self.output_filepath_v6, ip_file=ip_file)
+
     def _find_output_filename(self):
         """从参数中解析输出文件名"""
         try:
@@ -99,6 +251,9 @@ class CloudflareOptimizer:
             logging.error(f"无法映射当前系统。os_map 支持: {list(os_map.keys())}, arch_map 支持: {list(arch_map.keys())}")
             raise RuntimeError(f"不支持的操作系统或架构: {system_platform} / {system_machine}")
 
+        # requests 仅在需要下载工具时导入
+        import requests
+
         # 从 GitHub API 获取最新的 release 信息
         try:
             api_url = "https://api.github.com/repos/XIU2/CloudflareSpeedTest/releases/latest"
@@ -132,12 +287,20 @@ class CloudflareOptimizer:
 
     def download_and_extract_tool(self):
         """如果工具不存在，则下载并解压"""
+        if self.mode == 'native':
+            logging.info("当前使用内置测速引擎 (mode = native)，无需下载 cfst 工具。")
+            return
+
         if os.path.exists(self.tool_path):
             logging.info(f"cfst 工具已存在于: {self.tool_path}")
             return
 
         logging.info("cfst 工具未找到，开始下载...")
+        # requests 仅在需要下载工具时导入
+        import requests
+
         os.makedirs(self.tool_dir, exist_ok=True)
+        started = time.perf_counter()
         
         try:
             url = self._get_download_url()
@@ -180,50 +343,440 @@ class CloudflareOptimizer:
                 os.chmod(self.tool_path, 0o755)
 
             logging.info(f"工具成功解压到: {self.tool_path}")
+            metrics.TOOL_DOWNLOAD_SECONDS.observe(time.perf_counter() - started, 'ok')
 
         except Exception as e:
             logging.error(f"下载或解压工具时出错: {e}")
+            metrics.TOOL_DOWNLOAD_SECONDS.observe(time.perf_counter() - started, 'failed')
             sys.exit(1)
 
-    def run_speed_test(self):
-        """执行优选IP任务"""
-        if not app_state.optimizer_lock.acquire(blocking=False):
-            logging.warning("优选任务已在运行中，本次触发被跳过。")
-            return
+    def run_speed_test(self, cancel: CancelToken = None):
+        """
+        执行优选IP任务，成功返回 True。定时任务、心跳故障切换及 API 均通过任务队列 (jobqueue.run_queue) 调用，
+        cancel 为队列传入的 CancelToken，用于取消或超时终止。
+        """
+        if not self.state.optimizer_lock.acquire(blocking=False):
+            if cancel is None:
+                logging.warning("优选任务已在运行中，本次触发被跳过。")
+                return False
+            # 任务队列保证同一 profile 只有一个优选任务在运行，锁被占用说明集群 worker 正在执行 coordinator
+            # 下发的探测任务：等待其结束后再开始，期间任务被取消或超时则放弃
+            logging.info("优选任务: 等待集群探测任务结束...")
+            while not self.state.optimizer_lock.acquire(timeout=LOCK_WAIT_INTERVAL):
+                if cancel.is_set():
+                    logging.warning(f"优选任务: 等待集群探测任务时任务{cancel.reason}，已放弃。")
+                    return False
 
+        tracker = RunTracker(self.mode, self.state, cancel)
         try:
-            logging.info("开始执行 Cloudflare IP 优选...")
-            command = [self.tool_path] + self.params
-            
-            # 设置 cwd (current working directory) 为工具所在的目录
-            # 这可以确保工具生成的所有临时文件（如 ip.txt）都在正确的路径下
-            process = subprocess.run(
-                command, capture_output=True, text=True, encoding='utf-8', cwd=self.tool_dir)
+            # 增量复测只反映本机的网络，coordinator 模式下始终进行分布式扫描
+            if self.incremental and self.state.last_results and self.cluster_role != 'coordinator':
+                if self._run_incremental(tracker):
+                    tracker.finish(True, f"增量优选完成，最优IP: {self.state.best_ip}")
+                    return True
+                if tracker.cancel.is_set():
+                    tracker.finish(False, tracker.cancel.reason)
+                    return False
+                logging.info("增量优选: 达标 IP 数量不足，回退到完整扫描。")
 
-            if process.returncode != 0:
-                logging.error(f"cfst 执行失败，错误信息:\n{process.stderr}")
-                return
+            logging.info(f"开始执行 Cloudflare IP 优选 (引擎: {self.mode})...")
+            params = self.params
+            if self.config.getboolean('Candidates', 'enabled', fallback=False):
+                candidates_file = self._generate_candidates()
+                if candidates_file:
+                    params = self._replace_ip_source(self.params, self.output_filepath, ip_file=candidates_file)
+            if self.cluster_role == 'coordinator':
+                success = self._run_cluster(params, tracker)
+            else:
+                success = self._run_engine(params, tracker, tune=True)
+            if success:
+                self._scan_ipv6(tracker)
+            if not success or tracker.cancel.is_set():
+                tracker.finish(False, tracker.cancel.reason or "测速失败")
+                return False
 
             logging.info("IP 优选完成，开始解析结果...")
+            tracker.set_phase('parsing')
             self._parse_results()
+            tracker.finish(True, f"最优IP: {self.state.best_ip}")
+            return True
 
         except Exception as e:
             logging.error(f"执行优选任务时发生未知错误: {e}")
+            tracker.finish(False, str(e))
+            return False
+        finally:
+            self.state.optimizer_lock.release()
+
+    def _run_engine(self, params, tracker, tune=False, family=4):
+        """
+        使用当前配置的测速引擎执行一次测速，成功返回 True；并发数 (-n) 受全局测速预算限制。
+        tune=True（完整扫描）且启用了自动调节时，使用调节器给出的并发数，并把本次扫描记为调节样本。
+        family 为 6（双栈优选的 IPv6 扫描）时，内置引擎找不到 IP 段文件时使用 Cloudflare 官方 IPv6 段。
+        """
+        autotune = self.autotune if tune else None
+        threads = autotune.concurrency if autotune else int(self._param(params, '-n', 200))
+        native_download = self.download_engine == 'native' and '-dd' not in params
+        if native_download and self.mode != 'native':
+            params = list(params) + ['-dd']
+        with probe_budget.reserve(threads, self.profile, tracker.cancel) as granted:
+            if granted is None:
+                # 等待测速预算时任务被取消或超时
+                return False
+            if granted != int(self._param(params, '-n', 200)):
+                params = self._with_param(params, '-n', granted)
+            sample = autotune.start(granted, adjustable=self.mode == 'native') if autotune else None
+            tracker.observer = sample.on_progress if sample else None
+            try:
+                if self.mode == 'native':
+                    success = self._run_native(params, tracker, sample, family)
+                else:
+                    success = self._run_cfst(params, tracker)
+            finally:
+                tracker.observer = None
+        if success and sample and not tracker.cancel.is_set():
+            autotune.record(sample)
+        if success and native_download and not tracker.cancel.is_set():
+            success = self._run_download(params, tracker)
+        return success
+
+    @staticmethod
+    def _with_param(params, name, value):
+        """返回一份新的参数列表，将参数 name 的值设为 value（不存在时追加）"""
+        new_params = list(params)
+        if name in new_params and new_params.index(name) + 1 < len(new_params):
+            new_params[new_params.index(name) + 1] = str(value)
+        else:
+            new_params += [name, str(value)]
+        return new_params
+
+    def _load_param_ranges(self, params, family=4):
+        """按参数中的 -ip / -f 读取待测 IP 段"""
+        ip_file = self._param(params, '-f', 'ip.txt')
+        if not os.path.isabs(ip_file):
+            ip_file = os.path.join(self.tool_dir, ip_file)
+        return load_ranges(self._param(params, '-ip', ''), ip_file, family)
+
+    def _run_cluster(self, params, tracker):
+        """coordinator 模式：由各节点分担扫描，合并后的全局排名写入结果文件，成功返回 True"""
+        from .cluster import ClusterCoordinator
+
+        ranking = ClusterCoordinator(self).run(self._load_param_ranges(params), tracker)
+        if tracker.cancel.is_set():
+            return False
+        if not ranking:
+            logging.error("集群 coordinator: 所有节点均未返回可用 IP。")
+            return False
+        write_results_csv(self.output_filepath, ranking)
+        logging.info(f"集群 coordinator: 全局排名共 {len(ranking)} 个 IP，"
+                     f"最优IP {ranking[0][COL_IP]} 在 {ranking[0]['sites_ok']} 个站点可用。")
+        return True
+
+    def probe_scope(self):
+        """本机配置的测速 IP 段（双栈优选时包括 IPv6 段），集群 worker 只接受这些段内的探测任务"""
+        ranges = self._load_param_ranges(self.params)
+        if self.dual_stack:
+            ranges += self._load_param_ranges(self.params_v6, 6)
+        return ranges
+
+    def probe_ranges(self, ranges, tag='cluster', tracker=None):
+        """
+        对指定的 IP 段执行一次测速并返回结果行，不更新全局状态也不推送（供集群模式使用）。
+        未传入 tracker 时新建一个，并在结束时标记任务完成。
+        """
+        ranges_file = self._work_path(f'cluster_{tag}_ranges.txt')
+        output = self._work_path(f'cluster_{tag}_result.csv')
+        own_tracker = tracker is None
+        tracker = tracker or RunTracker(self.mode, self.state)
+        try:
+            with open(ranges_file, 'w', encoding='utf-8') as f:
+                f.write('\n'.join(ranges) + '\n')
+            params = self._replace_ip_source(self.params, output, ip_file=ranges_file)
+            if not self._run_engine(params, tracker):
+                raise RuntimeError("测速失败")
+            rows = []
+            if os.path.exists(output):
+                with open(output, 'r', encoding='utf-8-sig') as f:
+                    rows = list(csv.DictReader(f))
+            if own_tracker:
+                tracker.finish(True, f"集群探测完成，{len(rows)} 个 IP 可用")
+            return rows
+        except Exception as e:
+            if own_tracker:
+                tracker.finish(False, str(e))
+            raise
         finally:
-            app_state.optimizer_lock.release()
+            for path in (ranges_file, output):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _incremental_candidates(self, results):
+        """上次结果的前 K 个 IP，加上每个 IP 所在 /24 段（IPv6 为 /120）中随机抽取的少量邻居"""
+        top_ips = [row.get(COL_IP) for row in results[:self.incremental_top_k] if row.get(COL_IP)]
+        candidates = list(dict.fromkeys(top_ips))
+        seen = set(candidates)
+        for ip in top_ips:
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            block = ipaddress.ip_network(f"{ip}/{24 if address.version == 4 else 120}", strict=False)
+            base = int(block.network_address)
+            offsets = random.sample(range(1, block.num_addresses - 1),
+                                    min(self.incremental_neighbours, block.num_addresses - 2))
+            for offset in offsets:
+                neighbour = str(ipaddress.ip_address(base + offset))
+                if neighbour not in seen:
+                    seen.add(neighbour)
+                    candidates.append(neighbour)
+        return candidates
+
+    def _run_incremental(self, tracker):
+        """
+        增量优选：仅复测上次的优选 IP 及其邻居。-tl/-sl 等过滤条件照常生效，
+        通过过滤的 IP 不少于 incremental_min_pass 个时采用本次结果并返回 True。
+        双栈优选时 IPv6 同样只复测上次的 IPv6 结果，达标 IP 不足时才完整扫描 IPv6 段。
+        """
+        incremental_output = self._work_path('incremental_result.csv')
+        if not self._retest(self.params, self.state.last_results, incremental_output, tracker):
+            return False
+
+        self._incremental_ipv6(tracker)
+        if tracker.cancel.is_set():
+            return False
+        os.replace(incremental_output, self.output_filepath)
+        tracker.set_phase('parsing')
+        self._parse_results()
+        return True
+
+    def _retest(self, params, results, output, tracker, family=4):
+        """复测 results 的前 K 个 IP 及其邻居并输出到 output，通过过滤的 IP 不少于 incremental_min_pass 个时返回 True"""
+        candidates = self._incremental_candidates(results)
+        if not candidates:
+            return False
+
+        label = '增量优选' if family == 4 else '增量优选 (IPv6)'
+        logging.info(f"{label}: 复测上次前 {self.incremental_top_k} 个 IP 及其邻居，共 {len(candidates)} 个 IP...")
+        params = self._replace_ip_source(params, output, ips=candidates)
+        if not self._run_engine(params, tracker, family=family) or not os.path.exists(output):
+            return False
+
+        with open(output, 'r', encoding='utf-8-sig') as f:
+            passed = sum(1 for _ in csv.DictReader(f))
+        logging.info(f"{label}: {passed}/{len(candidates)} 个 IP 通过过滤条件 (至少需要 {self.incremental_min_pass} 个)。")
+        if passed < self.incremental_min_pass:
+            os.remove(output)
+            return False
+        return True
+
+    def _incremental_ipv6(self, tracker):
+        """双栈优选的增量复测：复测上次的 IPv6 结果，没有上次结果或达标 IP 不足时回退到完整的 IPv6 扫描"""
+        if not self.dual_stack or tracker.cancel.is_set():
+            return
+        incremental_output = self._work_path('incremental_result_v6.csv')
+        if self._retest(self.params_v6, self.state.last_results_v6, incremental_output, tracker, family=6):
+            os.replace(incremental_output, self.output_filepath_v6)
+            return
+        if not tracker.cancel.is_set():
+            self._scan_ipv6(tracker)
+
+    def _generate_candidates(self):
+        """
+        按 [Candidates] 配置从 IP 段生成候选IP文件（每个 /24 段抽取 per_block 个，可加权、可排除黑名单），
+        返回文件路径；失败时返回 None，回退到测速工具自身的抽样。
+        """
+        try:
+            # 仅在启用时导入 numpy，减少默认配置下的内存占用
+            from .candidates import generate_candidates, write_candidates
+
+            section = self.config['Candidates']
+            source = section.get('source', fallback='ip.txt')
+            source_path = source if os.path.isabs(source) else os.path.join(self.tool_dir, source)
+            ranges = load_ranges('', source_path)
+            blocklist = [item.strip() for item in section.get('blocklist', fallback='').split(',') if item.strip()]
+            weights = {}
+            for item in section.get('weights', fallback='').split(','):
+                if ':' in item:
+                    cidr, weight = item.rsplit(':', 1)
+                    weights[cidr.strip()] = float(weight)
+
+            start = time.perf_counter()
+            candidates = generate_candidates(
+                ranges, per_block=section.getint('per_block', fallback=1), blocklist=blocklist, weights=weights)
+            output_path = self._work_path(section.get('output', fallback='candidates.txt'))
+            write_candidates(output_path, candidates)
+            logging.info(f"候选IP生成: 从 {len(ranges)} 个 IP 段生成 {len(candidates)} 个候选IP，"
+                         f"耗时 {(time.perf_counter() - start) * 1000:.1f} ms")
+            return output_path if candidates else None
+        except Exception as e:
+            logging.error(f"候选IP生成失败，将使用测速工具自身的抽样: {e}")
+            return None
+
+    @staticmethod
+    def _replace_ip_source(params, output_path, ips=None, ip_file=None):
+        """返回一份新的参数列表：去掉原有的 -f/-ip/-allip/-o，改为测速指定的 IP 列表或 IP 文件，并输出到 output_path"""
+        new_params = []
+        skip_next = False
+        for param in params:
+            if skip_next:
+                skip_next = False
+                continue
+            if param in ('-f', '-ip', '-o', '--output'):
+                skip_next = True
+                continue
+            if param == '-allip':
+                continue
+            new_params.append(param)
+        if ip_file:
+            new_params += ['-f', ip_file]
+        else:
+            new_params += ['-ip', ','.join(ips)]
+        return new_params + ['-o', output_path]
+
+    def _run_cfst(self, params, tracker):
+        """调用外部 cfst 可执行文件进行测速，流式读取其进度，成功返回 True"""
+        command = [self.tool_path] + params
+
+        # 设置 cwd (current working directory) 为工具所在的目录
+        # 这可以确保工具生成的所有临时文件（如 ip.txt）都在正确的路径下
+        return run_streaming(command, self.tool_dir, tracker, stall_timeout=self.stall_timeout)
+
+    def _run_native(self, params, tracker, sample=None, family=4):
+        """
+        使用内置 asyncio TCPing 引擎测速，并按 cfst 的格式写出结果文件。
+        支持 cfst 的 -n, -t, -tp, -tl, -tll, -tlr, -f, -ip, -allip, -o 参数；下载测速由 _run_engine 随后进行。
+        sample 为并发自动调节的观测 (autotune.RunSample)，扫描中判定并发过高时按其 limit 即时降低并发。
+        """
+        ranges = self._load_param_ranges(params, family)
+        ips = expand_ranges(ranges, all_ip='-allip' in params)
+        if not ips:
+            logging.error("内置测速: 没有可测速的 IP。")
+            return False
+
+        concurrency = int(self._param(params, '-n', 200))
+        tracker.set_phase('latency')
+        logging.info(f"内置测速: 共 {len(ips)} 个 IP，并发 {concurrency}，超时 {self.native_timeout}s")
+        results = run_tcping(
+            ips,
+            port=int(self._param(params, '-tp', 443)),
+            count=int(self._param(params, '-t', 4)),
+            timeout=self.native_timeout,
+            concurrency=concurrency,
+            max_latency=float(self._param(params, '-tl', 9999)),
+            min_latency=float(self._param(params, '-tll', 0)),
+            max_loss=float(self._param(params, '-tlr', 1.0)),
+            progress_callback=tracker.update,
+            cancel=tracker.cancel,
+            concurrency_limit=(lambda: sample.limit) if sample else None,
+        )
+        if tracker.cancel.is_set():
+            logging.warning(f"内置测速: 任务{tracker.cancel.reason}，已停止。")
+            return False
+        logging.info(f"内置测速: 完成，{len(results)}/{len(ips)} 个 IP 可用。")
+
+        write_results_csv(self._param(params, '-o', self.output_filepath), results)
+        return True
+
+    def _run_download(self, params, tracker):
+        """
+        内置下载测速：读取延迟测速的结果文件，按 -url / -tp / -dn / -dt / -sl 对排名靠前的 IP 进行多连接下载测速，
+        按下载速度重新排序后写回结果文件，成功（包括没有可测 IP）返回 True。
+        """
+        output = self._param(params, '-o', self.output_filepath)
+        if not os.path.exists(output):
+            return True
+        with open(output, 'r', encoding='utf-8-sig') as f:
+            rows = list(csv.DictReader(f))
+        count = int(self._param(params, '-dn', 10))
+        if not rows or count <= 0:
+            return True
+
+        tracker.set_phase('download')
+        logging.info(f"下载测速: 从 {len(rows)} 个 IP 中按延迟排名测速，直到 {count} 个 IP 达标 "
+                     f"(每个 IP {self.download_connections} 个连接，同时测速 {self.download_parallel} 个 IP)...")
+        started = time.perf_counter()
+        rows = run_download_test(
+            rows,
+            url=self._param(params, '-url', DEFAULT_URL),
+            port=int(self._param(params, '-tp', 443)),
+            count=count,
+            duration=float(self._param(params, '-dt', 10)),
+            min_speed=float(self._param(params, '-sl', 0)),
+            connections=self.download_connections,
+            parallel=self.download_parallel,
+            stable_tolerance=self.download_stable,
+            progress_callback=tracker.update,
+            cancel=tracker.cancel,
+            profile=self.profile,
+        )
+        if tracker.cancel.is_set():
+            logging.warning(f"下载测速: 任务{tracker.cancel.reason}，已停止。")
+            return False
+        logging.info(f"下载测速: 完成，耗时 {time.perf_counter() - started:.1f}s。")
+        write_results_csv(output, rows)
+        return True
+
+    def _scan_ipv6(self, tracker):
+        """双栈优选：扫描 IPv6 段并写入 IPv6 结果文件；扫描失败时保留上次的 IPv6 结果，不影响 IPv4 的结果"""
+        if not self.dual_stack or tracker.cancel.is_set():
+            return
+        logging.info("双栈优选: 开始扫描 IPv6 段...")
+        if not self._run_engine(self.params_v6, tracker, family=6):
+            logging.warning("双栈优选: IPv6 扫描失败，保留上次的 IPv6 结果。")
+
+    def _load_ipv6_results(self, record_history=True):
+        """读取 IPv6 结果文件到 state.last_results_v6 / best_ip_v6；未启用双栈优选时清空"""
+        previous_best = self.state.best_ip_v6
+        results = []
+        if self.dual_stack and os.path.exists(self.output_filepath_v6):
+            try:
+                with open(self.output_filepath_v6, 'r', encoding='utf-8-sig') as f:
+                    results = list(csv.DictReader(f))
+            except (OSError, csv.Error) as e:
+                logging.error(f"读取 IPv6 结果文件 {self.output_filepath_v6} 失败: {e}")
+                return
+        self.state.last_results_v6 = results
+        self.state.best_ip_v6 = results[0].get(COL_IP) if results else None
+        if self.state.best_ip_v6 != previous_best:
+            reason = 'scan' if record_history else 'startup'
+            metrics.BEST_IP_CHANGES.inc(reason, self.profile)
+            publish(EVENT_BEST_IP, {"best_ip": self.state.best_ip_v6, "previous": previous_best, "reason": reason,
+                                    "family": 6}, self.profile)
+            if self.state.best_ip_v6:
+                logging.info(f"双栈优选: IPv6 最优IP: {self.state.best_ip_v6}")
+        if record_history and results and self.history:
+            try:
+                self.history.record_run(results)
+            except Exception as e:
+                logging.error(f"写入测速历史失败: {e}")
+
+    def _compare_families(self):
+        """比较两个地址族的最优结果，记录本次是否发布 IPv6 地址（/api/best_ip 的 ipv6_active）"""
+        self.state.ipv6_active = bool(self.state.best_ip_v6) and \
+            publish_ipv6(self.config, self.state.last_results, self.state.last_results_v6)
 
     def load_results_from_file(self):
         """从现有的结果文件中加载数据到应用状态"""
         if os.path.exists(self.output_filepath):
             logging.info(f"正在从 {self.output_filepath} 加载已有结果...")
-            self._parse_results()
+            # 文件中的结果在生成时已写入过历史记录，这里不再重复记录
+            self._parse_results(record_history=False)
         else:
             logging.warning(f"结果文件 {self.output_filepath} 不存在，跳过加载。")
 
 
-    def _parse_results(self):
-        """解析CSV结果文件并更新全局状态"""
+    def _parse_results(self, record_history=True):
+        """解析CSV结果文件并更新全局状态（与故障切换互斥）"""
+        with self.state.results_lock:
+            self._read_results(record_history)
+
+    def _read_results(self, record_history):
+        started = time.perf_counter()
+        previous_best = self.state.best_ip
         try:
+            # 新的测速结果以当前时间为准；从已有文件加载时以文件的修改时间为准
+            scanned_at = time.time() if record_history else os.path.getmtime(self.output_filepath)
+            self._load_ipv6_results(record_history)
             with open(self.output_filepath, 'r', encoding='utf-8-sig') as f:
                 # 使用 StringIO 来处理内存中的数据，方便 csv 模块读取
                 content = f.read()
@@ -233,26 +786,98 @@ class CloudflareOptimizer:
 
                 if not results:
                     logging.warning("优选结果为空，未找到可用IP。")
-                    app_state.best_ip = None
-                    app_state.last_results = []
+                    self.state.best_ip = None
+                    self.state.last_results = []
+                    self.state.last_scan_at = scanned_at
+                    self._compare_families()
+                    rebuild_payloads(self.state)
+                    self.save_snapshot()
+                    metrics.RESULT_ROWS.set(0, self.profile)
+                    metrics.PARSE_SECONDS.observe(time.perf_counter() - started, self.profile)
                     return
 
                 # 第一行数据通常是最佳IP
                 best_result = results[0]
-                app_state.best_ip = best_result.get('IP 地址')
-                app_state.last_results = results
-
-                logging.info(f"成功解析结果，最优IP: {app_state.best_ip}")
-
-                # 如果启用了 OpenWRT 更新，则执行更新
-                if self.openwrt_config and self.openwrt_config.getboolean('enabled') and app_state.best_ip:
-                    target = self.openwrt_config.get('target', fallback='openwrt')
-                    if target == 'adguardhome':
-                        update_adguard_hosts(self.openwrt_config, app_state.best_ip)
-                    else: # 'openwrt' or 'mosdns'
-                        update_openwrt_hosts(self.openwrt_config, app_state.best_ip)
-                
+                self.state.best_ip = best_result.get('IP 地址')
+                self.state.last_results = results
+                self.state.last_scan_at = scanned_at
+                self._compare_families()
+                rebuild_payloads(self.state)
+                self.save_snapshot()
+                metrics.PARSE_SECONDS.observe(time.perf_counter() - started, self.profile)
+                metrics.ROWS_PARSED.inc(self.profile, amount=len(results))
+                metrics.RESULT_ROWS.set(len(results), self.profile)
+                if self.state.best_ip != previous_best:
+                    reason = 'scan' if record_history else 'startup'
+                    metrics.BEST_IP_CHANGES.inc(reason, self.profile)
+                    publish(EVENT_BEST_IP, {"best_ip": self.state.best_ip, "previous": previous_best, "reason": reason,
+                                            "family": 4}, self.profile)
+
+                logging.info(f"成功解析结果，最优IP: {self.state.best_ip}")
+
+                if record_history and self.history:
+                    try:
+                        self.history.record_run(results)
+                    except Exception as e:
+                        logging.error(f"写入测速历史失败: {e}")
+
+                self._push_best_ip()
+
         except FileNotFoundError:
             logging.error(f"结果文件 '{self.output_filepath}' 未找到，解析失败。")
         except Exception as e:
             logging.error(f"解析结果时出错: {e}")
+
+    def _push_best_ip(self):
+        """将当前最优 IP 异步推送到所有已启用的路由器目标及 DNS（双栈优选时包括 IPv6 的结果）"""
+        self.publisher.dispatch(self.state.best_ip, self.ranked_ips(), self.state.last_results,
+                                self.state.best_ip_v6, self.state.last_results_v6)
+
+    def ranked_ips(self, family=4):
+        """当前结果中按排名排列的 IP 列表，family 为 6 时返回 IPv6 的结果"""
+        rows = self.state.last_results_v6 if family == 6 else self.state.last_results
+        return [row.get(COL_IP) for row in rows if row.get(COL_IP)]
+
+    def promote_best_ip(self, new_ip, failed_ip=None):
+        """
+        故障切换：将 last_results 中的 new_ip 提升为最优 IP 并立即推送，无需等待重新扫描。
+        failed_ip 会从结果中移除；结果文件同步改写，保证重启后不会回退到失效的 IP。
+        new_ip 为 IPv6 地址时在 IPv6 的结果中切换。返回是否已切换。
+        """
+        family = ip_family(new_ip)
+        results_attr, best_attr, path = ('last_results_v6', 'best_ip_v6', self.output_filepath_v6) if family == 6 \
+            else ('last_results', 'best_ip', self.output_filepath)
+        with self.state.results_lock:
+            if failed_ip and getattr(self.state, best_attr) != failed_ip:
+                # 心跳检测期间优选任务已解析出新的结果，新结果优先，不再按旧的候选 IP 切换
+                logging.info(f"故障切换: 最优IP已更新为 {getattr(self.state, best_attr)}，跳过切换到 {new_ip}。")
+                return False
+            self._promote(new_ip, failed_ip, family, results_attr, best_attr, path)
+        self._push_best_ip()
+        return True
+
+    def _promote(self, new_ip, failed_ip, family, results_attr, best_attr, path):
+        """（持有 results_lock 时调用）更新结果字段与结果文件"""
+        current = getattr(self.state, results_attr)
+        results = [row for row in current if row.get(COL_IP) not in (new_ip, failed_ip)]
+        promoted = next((row for row in current if row.get(COL_IP) == new_ip), {COL_IP: new_ip})
+        previous_best = getattr(self.state, best_attr)
+        setattr(self.state, results_attr, [promoted] + results)
+        setattr(self.state, best_attr, new_ip)
+        self._compare_families()
+        rebuild_payloads(self.state)
+        self.save_snapshot()
+        metrics.BEST_IP_CHANGES.inc('failover', self.profile)
+        publish(EVENT_BEST_IP, {"best_ip": new_ip, "previous": previous_best, "reason": 'failover', "family": family},
+                self.profile)
+        metrics.RESULT_ROWS.set(len(self.state.last_results), self.profile)
+        label = 'IPv6 ' if family == 6 else ''
+        logging.info(f"故障切换: {label}最优IP已切换为 {new_ip}" + (f"（原最优IP {failed_ip} 已移除）" if failed_ip else ""))
+
+        if self.state.optimizer_lock.locked():
+            # 扫描进行中，结果文件即将被新的测速结果替换，改写会覆盖新结果；重启时由快照恢复切换后的结果
+            return
+        try:
+            write_results_csv(path, getattr(self.state, results_attr))
+        except Exception as e:
+            logging.error(f"故障切换: 写入结果文件失败: {e}")
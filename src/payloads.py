@@ -0,0 +1,49 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\payloads.py
+import gzip
+import hashlib
+import json
+import threading
+from .state import app_state
+from .events import publish, EVENT_RESULTS
+
+# /api/results 返回的结果条数，减轻前端渲染压力
+RESULTS_LIMIT = 10
+
+_rebuild_lock = threading.Lock()
+
+
+class CachedPayload:
+    """预先序列化好的 JSON 响应，以及对应的 gzip 版本和 ETag"""
+
+    __slots__ = ('body', 'gzip_body', 'etag', 'status')
+
+    def __init__(self, data, status: int = 200):
+        self.body = json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.gzip_body = gzip.compress(self.body, compresslevel=6)
+        self.etag = hashlib.sha1(self.body).hexdigest()[:16]
+        self.status = status
+
+
+def rebuild_payloads(state=app_state):
+    """
+    在结果变化时重新生成 /api/results、/api/results_v6 与 /api/best_ip 的响应体（state 为对应 profile 的状态）。
+    API 直接返回这里缓存的字节串，不再在每次请求时切片和序列化。
+    """
+    with _rebuild_lock:
+        if state.best_ip:
+            best_ip = {"best_ip": state.best_ip}
+            if state.best_ip_v6:
+                # 双栈优选: ipv6_active 表示 IPv6 路径不比 IPv4 差、IPv6 地址正在被发布
+                best_ip.update(best_ip_v6=state.best_ip_v6, ipv6_active=state.ipv6_active)
+            best_ip_payload = CachedPayload(best_ip)
+        else:
+            best_ip_payload = CachedPayload({"error": "最优IP尚未确定"}, status=404)
+
+        state.payloads = {
+            'best_ip': best_ip_payload,
+            'results': CachedPayload(state.last_results[:RESULTS_LIMIT]),
+            'results_v6': CachedPayload(state.last_results_v6[:RESULTS_LIMIT]),
+        }
+        state.results_version += 1
+        version = state.results_version
+    publish(EVENT_RESULTS, {"version": version, "count": len(state.last_results), "best_ip": state.best_ip}, state.name)
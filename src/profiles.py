@@ -0,0 +1,164 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\profiles.py
+"""
+多个优选配置（profile）。每个 [profile:名称] 配置节是一套独立的优选：
+自己的 cfst 参数（端口、测速地址、地区码等）、定时任务、结果和推送目标，与默认配置在同一进程中并发运行，
+所有 profile 的测速并发数之和受 [Profiles] probe_budget 限制。
+"""
+import configparser
+import logging
+import threading
+from contextlib import contextmanager
+from .publisher import TARGET_SECTION, HUAWEI_DNS_SECTION
+
+PROFILE_PREFIX = 'profile:'
+# profile 配置节中写入 [Scheduler] 的键，其余不带 "配置节." 前缀的键都写入 [cfst]
+SCHEDULER_KEYS = ('optimize_cron', 'heartbeat_cron', 'dns_update_cron')
+# profile 配置节中的控制键，不写入派生配置
+CONTROL_KEYS = ('enabled', 'targets')
+# 只属于默认配置的配置节
+DEFAULT_ONLY_SECTIONS = ('Cluster', 'Profiles')
+# 等待测速预算时检查任务是否被取消的间隔（秒）
+WAIT_INTERVAL = 0.5
+
+
+def profile_names(config) -> list[str]:
+    """所有已启用的 [profile:名称] 的名称"""
+    names = []
+    for section in config.sections():
+        if section.startswith(PROFILE_PREFIX) and config.getboolean(section, 'enabled', fallback=True):
+            names.append(section[len(PROFILE_PREFIX):])
+    return names
+
+
+def _is_target_section(section: str) -> bool:
+    return section in (TARGET_SECTION, HUAWEI_DNS_SECTION) or \
+        section.startswith(f"{TARGET_SECTION}:") or section.startswith(f"{HUAWEI_DNS_SECTION}:")
+
+
+def _profile_targets(config, name: str) -> list[str]:
+    value = config.get(f"{PROFILE_PREFIX}{name}", 'targets', fallback='')
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def assigned_targets(config) -> set[str]:
+    """已分配给某个 profile 的推送目标，默认配置不再推送到这些目标"""
+    return {target for name in profile_names(config) for target in _profile_targets(config, name)}
+
+
+def profile_config(config, name: str, into: configparser.ConfigParser = None) -> configparser.ConfigParser:
+    """
+    由全局配置生成 profile 使用的配置：复制全局配置，只保留该 profile 的推送目标（targets），
+    并用 [profile:名称] 中的键覆盖 [cfst] / [Scheduler]，"配置节.键" 形式的键覆盖对应配置节，
+    例如 Heartbeat.port = 2053。传入 into 时原地刷新（配置热重载时保持对象引用不变）。
+    """
+    section_name = f"{PROFILE_PREFIX}{name}"
+    targets = _profile_targets(config, name)
+    data = {}
+    for section in config.sections():
+        if section.startswith(PROFILE_PREFIX) or section in DEFAULT_ONLY_SECTIONS:
+            continue
+        if _is_target_section(section):
+            if section not in targets:
+                continue
+            # [HuaweiDNS:名称] 作为该 profile 的 [HuaweiDNS]
+            if section.startswith(f"{HUAWEI_DNS_SECTION}:"):
+                data[HUAWEI_DNS_SECTION] = dict(config.items(section, raw=True))
+                continue
+        data[section] = dict(config.items(section, raw=True))
+
+    if section_name in config:
+        sections = {section.lower(): section for section in data}
+        for key, value in config.items(section_name, raw=True):
+            if key in CONTROL_KEYS or key in config.defaults():
+                continue
+            if '.' in key:
+                target_section, key = key.split('.', 1)
+                target_section = sections.get(target_section.lower(), target_section)
+            elif key in SCHEDULER_KEYS:
+                target_section = 'Scheduler'
+            else:
+                target_section = 'cfst'
+            data.setdefault(target_section, {})[key] = value
+
+    params = data.setdefault('cfst', {}).get('params', '').split()
+    if '-o' not in params and '--output' not in params:
+        data['cfst']['params'] = ' '.join(params + ['-o', 'result.csv'])
+
+    derived = into if into is not None else configparser.ConfigParser()
+    for section in derived.sections():
+        derived.remove_section(section)
+    derived.read_dict(data)
+    return derived
+
+
+class ProbeBudget:
+    """
+    全局的测速并发预算（cfst / 内置引擎的 -n 线程数之和）。
+    每次测速按 -n 申请；剩余预算不足时，只要不少于公平份额（总预算 / profile 数）就按剩余量缩减并发，
+    否则等待其他 profile 的测速结束。total 为 0 表示不限制。
+    等待期间任务被取消或超时（cancel 被设置）时放弃申请。
+    """
+
+    def __init__(self, total: int = 0, profiles: int = 1):
+        self._cond = threading.Condition()
+        self.in_use = 0
+        self.configure(total, profiles)
+
+    def configure(self, total: int, profiles: int = 1):
+        with self._cond:
+            self.total = max(0, total)
+            self.profiles = max(1, profiles)
+            self._cond.notify_all()
+
+    def _grant(self, amount: int):
+        if not self.total:
+            return amount
+        wanted = min(amount, self.total)
+        share = min(wanted, max(1, self.total // self.profiles))
+        available = self.total - self.in_use
+        return min(wanted, available) if available >= share else None
+
+    @contextmanager
+    def reserve(self, amount: int, owner: str = '', cancel=None):
+        """
+        申请 amount 个并发，返回实际获得的并发数，退出时归还。
+        等待期间 cancel 被设置时返回 None（未占用预算），调用方应放弃本次测速。
+        """
+        with self._cond:
+            granted = self._grant(amount)
+            if granted is None:
+                logging.info(f"测速预算: [{owner}] 等待其他 profile 的测速结束 "
+                             f"(已用 {self.in_use}/{self.total}，需要 {amount})...")
+            while granted is None:
+                if cancel is not None and cancel.is_set():
+                    break
+                # 取消时由 wake() 唤醒；按短超时重新检查，即使没有被唤醒也能及时发现取消
+                self._cond.wait(WAIT_INTERVAL)
+                granted = self._grant(amount)
+            if granted is not None and self.total:
+                self.in_use += granted
+        if granted is None:
+            logging.info(f"测速预算: [{owner}] 任务已取消，放弃等待。")
+            yield None
+            return
+        if granted < amount:
+            logging.info(f"测速预算: [{owner}] 并发数由 {amount} 缩减为 {granted}。")
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                if self.total:
+                    self.in_use = max(0, self.in_use - granted)
+                self._cond.notify_all()
+
+    def wake(self):
+        """唤醒所有等待预算的任务，使其检查是否已被取消"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def status(self) -> dict:
+        with self._cond:
+            return {"total": self.total, "in_use": self.in_use}
+
+
+probe_budget = ProbeBudget()
@@ -0,0 +1,264 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\publisher.py
+import importlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from .state import app_state
+from .assignment import build_plan
+from .results import COL_IP
+from .events import publish, EVENT_PUSH
+from . import metrics
+
+# 推送目标所在的配置节: [OpenWRT] 以及任意数量的 [OpenWRT:名称]
+TARGET_SECTION = 'OpenWRT'
+# 华为云 DNS 发布目标的配置节
+HUAWEI_DNS_SECTION = 'HuaweiDNS'
+
+# 推送插件: target -> (模块, 函数)。插件模块（及其依赖的 paramiko、requests、华为云 SDK）
+# 只在有启用的目标用到时才导入，未启用任何推送目标时不会加载
+TARGET_PLUGINS = {
+    'openwrt': ('updater', 'update_openwrt_hosts'),
+    'mosdns': ('updater', 'update_openwrt_hosts'),
+    'adguardhome': ('updater', 'update_adguard_hosts'),
+    'adguardhome_api': ('adguard_api', 'update_adguard_api'),
+}
+HUAWEI_DNS_PLUGIN = ('huawei_dns_update', 'HuaweiDnsPublisher')
+RECORD_A = 'A'
+RECORD_AAAA = 'AAAA'
+
+_plugins = {}
+_plugins_lock = threading.Lock()
+
+
+def load_plugin(module_name: str, attribute: str):
+    """按需导入插件模块并返回其中的函数或类，导入结果会被缓存"""
+    key = (module_name, attribute)
+    with _plugins_lock:
+        if key not in _plugins:
+            started = time.perf_counter()
+            module = importlib.import_module(f".{module_name}", __package__)
+            _plugins[key] = getattr(module, attribute)
+            logging.info(f"推送: 已加载插件 {module_name}.{attribute}，耗时 {(time.perf_counter() - started) * 1000:.0f} ms")
+        return _plugins[key]
+
+
+class PushManager:
+    """
+    将最优 IP 并行推送到多个路由器目标及华为云 DNS。
+    每个目标在有界线程池中独立执行，失败时按指数退避重试，并受单目标总超时限制；
+    一个目标变慢不会影响其他目标，也不会阻塞结果解析线程。
+    每个目标同时最多占用一个线程：推送进行中时新的推送只保留最新的一次，在当前推送结束后执行，
+    卡住的设备不会因反复触发推送而占满线程池。单次尝试的耗时由 SSH 命令/读写超时及 HTTP 超时限制。
+    """
+
+    def __init__(self, config, state=app_state):
+        self.config = config
+        self.state = state
+        self._executor = None
+        self._max_workers = 0
+        self._generations = {}
+        # 推送进行中的目标 -> 等待执行的最新一次推送参数（没有时为 None）
+        self._inflight = {}
+        # 按记录类型 (A / AAAA) 缓存的华为云 DNS 发布器
+        self._huawei = {}
+        self._lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """根据 [Publish] 配置调整线程池大小及重试参数"""
+        max_workers = self.config.getint('Publish', 'max_workers', fallback=4)
+        self.timeout = self.config.getint('Publish', 'timeout', fallback=60)
+        self.retries = self.config.getint('Publish', 'retries', fallback=2)
+        self.backoff = self.config.getfloat('Publish', 'retry_backoff', fallback=2.0)
+        if max_workers != self._max_workers:
+            old_executor = self._executor
+            self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="PushWorker")
+            self._max_workers = max_workers
+            if old_executor:
+                old_executor.shutdown(wait=False)
+        self._preload_plugins()
+
+    def _plugin_for(self, name, section):
+        if name == HUAWEI_DNS_SECTION:
+            return HUAWEI_DNS_PLUGIN
+        target = section.get('target', fallback='openwrt')
+        if target not in TARGET_PLUGINS:
+            raise ValueError(f"不支持的推送目标类型: {target}")
+        return TARGET_PLUGINS[target]
+
+    def _preload_plugins(self):
+        """在后台预先导入已启用目标的插件，避免首次推送（例如故障切换时）再等待导入"""
+        plugins = set()
+        for name, section in self.targets():
+            try:
+                plugins.add(self._plugin_for(name, section))
+            except ValueError as e:
+                logging.error(f"推送 [{name}]: {e}")
+        for plugin in plugins:
+            self._executor.submit(self._preload_plugin, plugin)
+
+    @staticmethod
+    def _preload_plugin(plugin):
+        try:
+            load_plugin(*plugin)
+        except Exception as e:
+            logging.error(f"推送: 加载插件 {plugin[0]} 失败: {e}")
+
+    def targets(self) -> list:
+        """返回所有已启用的推送目标 [(名称, 配置节)]，已分配给 [profile:名称] 的目标由对应的 profile 推送"""
+        from .profiles import assigned_targets
+
+        assigned = assigned_targets(self.config)
+        targets = []
+        for name in self.config.sections():
+            if name in assigned:
+                continue
+            if name in (TARGET_SECTION, HUAWEI_DNS_SECTION) or name.startswith(f"{TARGET_SECTION}:"):
+                section = self.config[name]
+                if section.getboolean('enabled', fallback=False):
+                    targets.append((name, section))
+        return targets
+
+    def dispatch(self, best_ip: str, ips: list[str] = None, rows: list[dict] = None,
+                 best_ip_v6: str = None, rows_v6: list[dict] = None):
+        """
+        异步地推送到所有已启用的目标，立即返回。路由器目标按 [Publish] policy 由 rows（排名后的结果）
+        生成各域名的 IP 分配方案，DNS 目标使用 ips 列表。
+        双栈优选时传入 best_ip_v6 / rows_v6，IPv6 地址一并写入路由器目标，DNS 目标另外发布 AAAA 记录。
+        """
+        targets = self.targets()
+        if not best_ip or not targets:
+            return
+        ips = ips or [best_ip]
+        plan = build_plan(self.config, best_ip, rows or [], best_ip_v6, rows_v6)
+        # 不发布 IPv6 时为空列表，DNS 目标的 AAAA 记录随之删除
+        ips_v6 = []
+        if plan.pool_v6:
+            ips_v6 = [row[COL_IP] for row in rows_v6 or [] if row.get(COL_IP)] or [best_ip_v6]
+
+        logging.info(f"推送: 正在将 {plan.describe()} 并行推送到 {len(targets)} 个目标...")
+        for name, section in targets:
+            with self._lock:
+                generation = self._generations.get(name, 0) + 1
+                self._generations[name] = generation
+                job = (name, section, best_ip, ips, ips_v6, plan, generation)
+                running = name in self._inflight
+                # 该目标正在推送时只记录最新的参数（替换尚未执行的旧参数），由当前的工作线程随后执行
+                self._inflight[name] = job if running else None
+            self._set_status(name, section, state='pending', ip=best_ip, attempts=0, error='', latency_ms=None)
+            if not running:
+                self._executor.submit(self._drain_target, job)
+
+    def reconcile_dns(self, ips: list[str], ips_v6: list[str] = None):
+        """定时校准：忽略缓存，重新查询线上记录并在不一致时更新（由 dns_update_cron 触发）"""
+        if not self.config.getboolean(HUAWEI_DNS_SECTION, 'enabled', fallback=False):
+            return
+        try:
+            self._huawei_publisher().publish(ips, force=True)
+            if self._publishes_aaaa():
+                self._publish_aaaa(ips_v6 or [], force=True)
+        except Exception as e:
+            logging.error(f"华为DNS: 定时校准失败: {e}")
+
+    def _huawei_publisher(self, record_type: str = RECORD_A):
+        """返回缓存的华为云 DNS 发布器（配置变化时重建），华为云 SDK 仅在首次使用时导入"""
+        HuaweiDnsPublisher = load_plugin(*HUAWEI_DNS_PLUGIN)
+        publisher = HuaweiDnsPublisher.from_config(self.config[HUAWEI_DNS_SECTION], record_type)
+        with self._lock:
+            cached = self._huawei.get(record_type)
+            if cached is None or cached.config_key() != publisher.config_key():
+                cached = self._huawei[record_type] = publisher
+            return cached
+
+    def _publishes_aaaa(self) -> bool:
+        """双栈优选且 [HuaweiDNS] 未设置 ipv6 = false 时同时维护 AAAA 记录"""
+        return self.config.getboolean('cfst', 'dual_stack', fallback=False) and \
+            self.config.getboolean(HUAWEI_DNS_SECTION, 'ipv6', fallback=True)
+
+    def _publish_aaaa(self, ips_v6: list[str], force: bool = False) -> bool:
+        """发布 AAAA 记录；本次不发布 IPv6 时删除已有的 AAAA 记录，避免客户端继续使用旧的 IPv6 地址"""
+        publisher = self._huawei_publisher(RECORD_AAAA)
+        return publisher.publish(ips_v6, force=force) if ips_v6 else publisher.clear()
+
+    def _run_target(self, name, section, best_ip, ips, ips_v6, plan) -> bool:
+        if name == HUAWEI_DNS_SECTION:
+            started = time.perf_counter()
+            success = False
+            try:
+                success = self._huawei_publisher().publish(ips)
+                if success and self._publishes_aaaa():
+                    success = self._publish_aaaa(ips_v6)
+                return success
+            finally:
+                metrics.DNS_PUBLISH_SECONDS.observe(time.perf_counter() - started, 'ok' if success else 'failed',
+                                                    self.state.name)
+        return load_plugin(*self._plugin_for(name, section))(section, best_ip, plan)
+
+    def _is_superseded(self, name: str, generation: int) -> bool:
+        with self._lock:
+            return self._generations.get(name) != generation
+
+    def _set_status(self, name, section, **fields):
+        if name == HUAWEI_DNS_SECTION:
+            target, host = 'huawei_dns', section.get('domain', fallback='')
+        else:
+            target, host = section.get('target', fallback='openwrt'), section.get('host')
+        with self._lock:
+            status = dict(self.state.push_status.get(name, {}))
+            status.update(fields, target=target, host=host, updated_at=time.time())
+            # 整体替换字典，API 读取时无需加锁
+            self.state.push_status = {**self.state.push_status, name: status}
+        publish(EVENT_PUSH, {"name": name, **status}, self.state.name)
+
+    def _drain_target(self, job):
+        """依次执行该目标的推送，直到没有等待中的推送"""
+        while job is not None:
+            try:
+                self._push_target(*job)
+            except Exception as e:
+                logging.error(f"推送 [{job[0]}]: 出错: {e}")
+            with self._lock:
+                job = self._inflight.pop(job[0], None)
+                if job is not None:
+                    self._inflight[job[0]] = None
+
+    def _push_target(self, name, section, best_ip, ips, ips_v6, plan, generation):
+        started = time.time()
+        delay = self.backoff
+        for attempt in range(1, self.retries + 2):
+            if self._is_superseded(name, generation):
+                logging.info(f"推送 [{name}]: 已有更新的 IP 需要推送，放弃推送 {best_ip}。")
+                self._set_status(name, section, state='superseded')
+                return
+
+            self._set_status(name, section, state='running', attempts=attempt)
+            attempt_started = time.time()
+            try:
+                success = self._run_target(name, section, best_ip, ips, ips_v6, plan)
+                error = '' if success else '更新失败，详见日志'
+            except Exception as e:
+                success, error = False, str(e)
+
+            latency_ms = round((time.time() - attempt_started) * 1000, 1)
+            metrics.PUSH_SECONDS.observe(latency_ms / 1000, name, 'ok' if success else 'failed', self.state.name)
+            if success:
+                logging.info(f"推送 [{name}]: 成功，耗时 {latency_ms} ms (第 {attempt} 次尝试)。")
+                self._set_status(name, section, state='ok', latency_ms=latency_ms, error='')
+                return
+
+            elapsed = time.time() - started
+            if attempt > self.retries:
+                self._set_status(name, section, state='failed', latency_ms=latency_ms, error=error)
+                break
+            if elapsed + delay > self.timeout:
+                self._set_status(name, section, state='timeout', latency_ms=latency_ms,
+                                 error=f"超过单目标超时 {self.timeout} 秒: {error}")
+                break
+
+            logging.warning(f"推送 [{name}]: 第 {attempt} 次尝试失败 ({error})，{delay:g} 秒后重试...")
+            self._set_status(name, section, state='retrying', latency_ms=latency_ms, error=error)
+            time.sleep(delay)
+            delay *= 2
+
+        logging.error(f"推送 [{name}]: 推送 {best_ip} 失败: {self.state.push_status[name].get('error')}")
@@ -0,0 +1,52 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\results.py
+import csv
+import ipaddress
+import os
+
+# cfst 输出的 result.csv 表头，内置测速引擎写出的文件与之保持一致
+COL_IP = 'IP 地址'
+COL_SENT = '已发送'
+COL_RECEIVED = '已接收'
+COL_LOSS = '丢包率'
+COL_LATENCY = '平均延迟'
+COL_SPEED = '下载速度 (MB/s)'
+COL_COLO = '地区码'
+
+RESULT_HEADERS = [COL_IP, COL_SENT, COL_RECEIVED, COL_LOSS, COL_LATENCY, COL_SPEED, COL_COLO]
+
+
+def row_float(row: dict, key: str, default: float = 0.0) -> float:
+    """安全地从结果行中读取浮点数字段"""
+    try:
+        return float(row.get(key) or default)
+    except (TypeError, ValueError):
+        return default
+
+
+def ip_family(ip: str) -> int:
+    """IP 的地址族: 4 或 6，无法识别时返回 0"""
+    try:
+        return ipaddress.ip_address(ip).version
+    except ValueError:
+        return 0
+
+
+def row_speed(row: dict) -> float:
+    """读取下载速度，兼容不同 cfst 版本的表头写法（'下载速度 (MB/s)' / '下载速度(MB/s)'）"""
+    for key, value in row.items():
+        if key and key.startswith('下载速度'):
+            try:
+                return float(value or 0)
+            except (TypeError, ValueError):
+                return 0.0
+    return 0.0
+
+
+def write_results_csv(path: str, rows: list[dict]) -> None:
+    """以 cfst 相同的格式写出结果文件（先写临时文件再替换，避免读到半个文件）"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_HEADERS, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, path)
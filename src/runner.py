@@ -0,0 +1,256 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\runner.py
+import codecs
+import logging
+import os
+import re
+import signal
+import subprocess
+import threading
+import time
+from collections import deque
+from .state import app_state
+from .events import publish, EVENT_RUN_STARTED, EVENT_RUN_PROGRESS, EVENT_RUN_FINISHED
+from . import metrics
+from .results import COL_IP, COL_SENT, COL_RECEIVED, COL_LOSS, COL_LATENCY, COL_SPEED, COL_COLO
+
+# cfst 进度条形如 "1234 / 5956 [------>    ] 可用: 321"
+PROGRESS_RE = re.compile(r'(\d+)\s*/\s*(\d+)')
+AVAILABLE_RE = re.compile(r'可用[:：]\s*(\d+)')
+# cfst 在 -p > 0 时打印的结果表格行: IP 已发送 已接收 丢包率 平均延迟 下载速度 [地区码]
+RESULT_LINE_RE = re.compile(
+    r'^\s*([0-9a-fA-F:.]+)\s+(\d+)\s+(\d+)\s+([\d.]+)\s+([\d.]+)\s+([\d.]+)(?:\s+(\S+))?\s*$')
+
+# 保留在状态中的部分结果数量 / 出错时输出的末尾日志行数
+MAX_PARTIAL_RESULTS = 20
+TAIL_LINES = 50
+# run_progress 事件的最短发布间隔（秒），阶段变化时立即发布
+PROGRESS_EVENT_INTERVAL = 1.0
+
+_status_lock = threading.Lock()
+
+
+def get_run_status(state=app_state) -> dict:
+    """返回当前（或最近一次）优选任务状态的副本，state 为对应 profile 的状态"""
+    with _status_lock:
+        status = dict(state.run_status)
+        status['partial_results'] = list(status.get('partial_results', []))
+        return status
+
+
+class CancelToken(threading.Event):
+    """
+    取消一次优选任务（由任务队列的取消接口或超时触发）。
+    cfst 进程树会在 1 秒内被终止，内置引擎在当前这批握手结束后停止，其余阶段在开始前检查。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.reason = ''
+
+    def cancel(self, reason: str = '已取消'):
+        if not self.is_set():
+            self.reason = reason
+            self.set()
+
+
+class RunTracker:
+    """
+    记录一次优选任务的进度，并发布到 state.run_status（默认为 app_state），供 /api/run_status 查询。
+    cfst 引擎与内置引擎共用。cancel 为该任务的 CancelToken，未传入时新建一个（不会被取消）。
+    """
+
+    def __init__(self, engine: str, state=app_state, cancel: CancelToken = None):
+        now = time.time()
+        self.engine = engine
+        self.state = state
+        self.cancel = cancel or CancelToken()
+        # 延迟测速阶段每次进度更新时调用 observer(done, valid)，供并发自动调节观测（见 autotune.RunSample）
+        self.observer = None
+        self._progress_published = 0.0
+        self.started = now
+        # 延迟测速阶段已测的 IP 数量，任务结束时计入指标
+        self.probed = 0
+        self.last_activity = now
+        self._phase_started = now
+        with _status_lock:
+            self.state.run_status = {
+                'running': True,
+                'engine': engine,
+                'phase': 'starting',
+                'done': 0,
+                'total': 0,
+                'valid': 0,
+                'ips_per_sec': 0.0,
+                'eta_seconds': None,
+                'started_at': now,
+                'updated_at': now,
+                'finished_at': None,
+                'success': None,
+                'message': '',
+                'partial_results': [],
+            }
+        publish(EVENT_RUN_STARTED, {"engine": engine, "started_at": now}, state.name)
+
+    def _publish_progress(self, force: bool = False):
+        """发布 run_progress 事件，非 force 时按 PROGRESS_EVENT_INTERVAL 限流"""
+        now = time.time()
+        if not force and now - self._progress_published < PROGRESS_EVENT_INTERVAL:
+            return
+        self._progress_published = now
+        with _status_lock:
+            status = self.state.run_status
+            data = {key: status.get(key) for key in ('phase', 'done', 'total', 'valid', 'ips_per_sec', 'eta_seconds')}
+        publish(EVENT_RUN_PROGRESS, data, self.state.name)
+
+    def set_phase(self, phase: str):
+        with _status_lock:
+            if self.state.run_status.get('phase') == phase:
+                return
+            self.state.run_status.update(phase=phase, done=0, total=0, eta_seconds=None, ips_per_sec=0.0)
+        self._phase_started = self.last_activity = time.time()
+        self._publish_progress(force=True)
+
+    def update(self, done: int, total: int, valid: int = None):
+        now = time.time()
+        with _status_lock:
+            status = self.state.run_status
+            if done == status.get('done') and total == status.get('total'):
+                return
+            elapsed = max(now - self._phase_started, 1e-6)
+            rate = done / elapsed
+            status.update(
+                done=done,
+                total=total,
+                ips_per_sec=round(rate, 2),
+                eta_seconds=round((total - done) / rate, 1) if rate > 0 else None,
+                updated_at=now,
+            )
+            if valid is not None:
+                status['valid'] = valid
+            latency_phase = status.get('phase') == 'latency'
+            if latency_phase:
+                self.probed = done
+        self.last_activity = now
+        if latency_phase and self.observer:
+            self.observer(done, valid)
+        self._publish_progress()
+
+    def add_partial_result(self, row: dict):
+        with _status_lock:
+            partial = self.state.run_status['partial_results']
+            partial.append(row)
+            partial.sort(key=lambda r: (float(r[COL_LOSS]), float(r[COL_LATENCY])))
+            del partial[MAX_PARTIAL_RESULTS:]
+        self.last_activity = time.time()
+
+    def finish(self, success: bool, message: str = ''):
+        now = time.time()
+        with _status_lock:
+            if not self.state.run_status.get('running'):
+                return  # 已由更具体的失败原因结束
+            self.state.run_status.update(
+                running=False, success=success, message=message, finished_at=now, updated_at=now,
+                eta_seconds=None)
+        publish(EVENT_RUN_FINISHED, {"success": success, "message": message, "duration": round(now - self.started, 1)},
+                self.state.name)
+        metrics.SPEED_TEST_SECONDS.observe(now - self.started, self.engine, 'ok' if success else 'failed',
+                                           self.state.name)
+        metrics.IPS_PROBED.inc(self.engine, self.state.name, amount=self.probed)
+
+    def handle_line(self, line: str):
+        """解析 cfst 输出的一行（进度条以 \\r 刷新，也按行传入）"""
+        if '开始延迟测速' in line:
+            self.set_phase('latency')
+        elif '开始下载测速' in line:
+            self.set_phase('download')
+
+        match = RESULT_LINE_RE.match(line)
+        if match:
+            ip, sent, received, loss, latency, speed, colo = match.groups()
+            self.add_partial_result({
+                COL_IP: ip, COL_SENT: sent, COL_RECEIVED: received, COL_LOSS: loss,
+                COL_LATENCY: latency, COL_SPEED: speed, COL_COLO: colo or '',
+            })
+            return
+
+        progress = PROGRESS_RE.search(line)
+        if progress:
+            available = AVAILABLE_RE.search(line)
+            self.update(int(progress.group(1)), int(progress.group(2)),
+                        int(available.group(1)) if available else None)
+
+
+def kill_process_tree(process: subprocess.Popen):
+    """终止进程及其创建的所有子进程（进程以独立的会话/进程组启动，见 run_streaming）"""
+    try:
+        if os.name == 'nt':
+            subprocess.run(['taskkill', '/F', '/T', '/PID', str(process.pid)], capture_output=True, check=False)
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    if process.poll() is None:
+        process.kill()
+    process.wait()
+
+
+def run_streaming(command: list[str], cwd: str, tracker: RunTracker, stall_timeout: float = 0) -> bool:
+    """
+    以流式方式运行 cfst：逐行读取输出并更新进度，不在内存中保留全部输出。
+    当 stall_timeout > 0 且进度在该时间内没有任何变化，或任务被取消（含超时）时，终止整个进程树并返回 False。
+    """
+    # 以新的会话 (POSIX) / 进程组 (Windows) 启动，终止时可以连同 cfst 派生的子进程一起结束
+    if os.name == 'nt':
+        group_kwargs = {'creationflags': subprocess.CREATE_NEW_PROCESS_GROUP}
+    else:
+        group_kwargs = {'start_new_session': True}
+    process = subprocess.Popen(
+        command, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=0, **group_kwargs)
+    tail = deque(maxlen=TAIL_LINES)
+
+    def reader():
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        buffer = ''
+        while True:
+            chunk = process.stdout.read1(4096) if hasattr(process.stdout, 'read1') else process.stdout.read(4096)
+            if not chunk:
+                break
+            buffer += decoder.decode(chunk)
+            # 进度条使用 \r 原地刷新，因此 \r 与 \n 都视为行结束
+            *lines, buffer = re.split(r'[\r\n]', buffer)
+            for line in lines:
+                if line.strip():
+                    tail.append(line)
+                    tracker.handle_line(line)
+        if buffer.strip():
+            tail.append(buffer)
+            tracker.handle_line(buffer)
+
+    reader_thread = threading.Thread(target=reader, name="CfstOutputReader", daemon=True)
+    reader_thread.start()
+
+    while True:
+        try:
+            returncode = process.wait(timeout=1)
+            break
+        except subprocess.TimeoutExpired:
+            if tracker.cancel.is_set():
+                logging.warning(f"优选任务{tracker.cancel.reason}，正在终止 cfst 进程...")
+                message = tracker.cancel.reason
+            elif stall_timeout and time.time() - tracker.last_activity > stall_timeout:
+                logging.error(f"cfst 已超过 {stall_timeout} 秒没有任何进度，判定为卡死，正在终止进程...")
+                message = f"进度停滞超过 {stall_timeout} 秒，已终止"
+            else:
+                continue
+            kill_process_tree(process)
+            reader_thread.join(timeout=5)
+            tracker.finish(False, message)
+            return False
+
+    reader_thread.join(timeout=5)
+    if returncode != 0:
+        output_tail = '\n'.join(tail)
+        logging.error(f"cfst 执行失败 (退出码 {returncode})，最后的输出:\n{output_tail}")
+        tracker.finish(False, f"cfst 退出码 {returncode}")
+        return False
+    return True
@@ -0,0 +1,80 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\snapshot.py
+import json
+import logging
+import os
+import time
+from .state import app_state
+from .payloads import rebuild_payloads
+
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """
+    将 state（默认为 app_state）中的优选结果（最优IP、排序后的结果、健康状态及时间戳）保存为紧凑的 JSON 快照。
+    结果每次变化后立即保存（先写临时文件再替换），服务启动时最先加载，API 无需等待重新解析或测速。
+    """
+
+    def __init__(self, path: str, max_rows: int = 500, state=app_state):
+        self.path = path
+        self.max_rows = max_rows
+        self.state = state
+
+    def save(self):
+        results = self._limit(self.state.last_results)
+        results_v6 = self._limit(self.state.last_results_v6)
+        # 按列存储，避免每一行都重复表头
+        columns = list(results[0].keys()) if results else []
+        columns_v6 = list(results_v6[0].keys()) if results_v6 else []
+        snapshot = {
+            'version': SNAPSHOT_VERSION,
+            'saved_at': time.time(),
+            'last_scan_at': self.state.last_scan_at,
+            'best_ip': self.state.best_ip,
+            'columns': columns,
+            'rows': [[row.get(column, '') for column in columns] for row in results],
+            'best_ip_v6': self.state.best_ip_v6,
+            'columns_v6': columns_v6,
+            'rows_v6': [[row.get(column, '') for column in columns_v6] for row in results_v6],
+            'ipv6_active': self.state.ipv6_active,
+            'health_status': self.state.health_status,
+        }
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logging.error(f"保存状态快照 {self.path} 失败: {e}")
+
+    def _limit(self, results: list) -> list:
+        return results[:self.max_rows] if self.max_rows > 0 else results
+
+    def load(self) -> bool:
+        """加载快照到 state 并重建 API 响应，成功返回 True"""
+        if not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+            if snapshot.get('version') != SNAPSHOT_VERSION:
+                logging.warning(f"状态快照版本 {snapshot.get('version')} 不受支持，忽略。")
+                return False
+            columns = snapshot['columns']
+            results = [dict(zip(columns, row)) for row in snapshot['rows']]
+            # 旧快照没有 IPv6 的结果
+            columns_v6 = snapshot.get('columns_v6') or []
+            results_v6 = [dict(zip(columns_v6, row)) for row in snapshot.get('rows_v6') or []]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            logging.error(f"读取状态快照 {self.path} 失败: {e}")
+            return False
+
+        self.state.best_ip = snapshot.get('best_ip')
+        self.state.last_results = results
+        self.state.best_ip_v6 = snapshot.get('best_ip_v6')
+        self.state.last_results_v6 = results_v6
+        self.state.ipv6_active = bool(snapshot.get('ipv6_active'))
+        self.state.last_scan_at = snapshot.get('last_scan_at')
+        self.state.health_status = snapshot.get('health_status') or {}
+        rebuild_payloads(self.state)
+        return bool(self.state.best_ip)
@@ -0,0 +1,370 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\speedtest.py
+"""
+内置的下载测速：对延迟排名靠前的 IP 测量下载速度，代替 cfst 逐个 IP 串行进行的下载测速 (-dn / -dt)。
+
+- 连接固定到被测 IP，TLS 的 SNI 与 Host 头取自测速地址 (-url)，跟随重定向时仍连接同一个 IP；
+- 每个 IP 同时使用 connections 个 keep-alive 连接下载，一次响应读完后在同一连接上继续请求，不再重复握手；
+- 同时测速 parallel 个 IP，所有 IP（及所有 profile）的下载共用 [Profiles] download_budget 的带宽预算；
+- 预热 WARMUP 秒（越过 TCP 慢启动）后每 SAMPLE_INTERVAL 秒采样一次速度，最近 STABLE_SAMPLES 次采样的
+  极差不超过均值的 stable_tolerance 时提前结束，否则最长测速 duration (-dt) 秒；
+- 与 cfst 相同，按延迟排名依次测速，直到 count (-dn) 个 IP 的速度不低于 min_speed (-sl)。
+"""
+import asyncio
+import logging
+import ssl
+import threading
+import time
+from urllib.parse import urlsplit, urljoin
+from .results import COL_IP, COL_SPEED, COL_COLO
+from .state import DEFAULT_PROFILE
+from . import metrics
+
+# cfst 的默认测速地址
+DEFAULT_URL = 'https://cf.xiu2.xyz/url'
+MB = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# 建立连接、等待响应头及每次读取的超时时间（秒）
+IO_TIMEOUT = 5.0
+WARMUP = 1.0
+SAMPLE_INTERVAL = 0.5
+STABLE_SAMPLES = 4
+MAX_REDIRECTS = 5
+# 等待带宽预算的时间超过测速时间的该比例时，认为测得的速度受预算限制
+THROTTLED_RATIO = 0.2
+USER_AGENT = 'Mozilla/5.0 cloudflare-optimizer'
+_ERRORS = (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError)
+
+
+class BandwidthBudget:
+    """
+    全局的下载带宽预算（令牌桶，单位 MB/s），rate 为 0 表示不限制。每读取一块数据后扣除对应的字节数，
+    超出预算时等待，读取变慢后 TCP 流控随之限制实际带宽。各 profile 的事件循环运行在不同线程中，因此使用线程锁。
+    """
+
+    def __init__(self, rate: float = 0):
+        self._lock = threading.Lock()
+        self.configure(rate)
+
+    def configure(self, rate: float):
+        with self._lock:
+            self.rate = max(0.0, rate) * MB
+            # 最多积累 0.1 秒的令牌，避免空闲后瞬间突发
+            self._burst = max(CHUNK_SIZE, self.rate * 0.1)
+            self._tokens = self._burst
+            self._updated = time.monotonic()
+
+    def delay(self, amount: int) -> float:
+        """扣除 amount 字节，返回需要等待的秒数"""
+        with self._lock:
+            if not self.rate:
+                return 0.0
+            now = time.monotonic()
+            self._tokens = min(self._burst, self._tokens + (now - self._updated) * self.rate) - amount
+            self._updated = now
+            return -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+    def status(self) -> dict:
+        return {"mb_per_sec": round(self.rate / MB, 2)}
+
+
+bandwidth_budget = BandwidthBudget()
+
+
+class _HTTPError(Exception):
+    pass
+
+
+class _Target:
+    """一个测速地址：scheme / SNI 主机名 / Host 头 / 请求路径 / 端口"""
+
+    def __init__(self, url: str, default_port: int):
+        parts = urlsplit(url)
+        if parts.scheme not in ('http', 'https') or not parts.hostname:
+            raise ValueError(f"无效的测速地址 '{url}'")
+        self.url = url
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        # 与 cfst 相同，连接端口为 -tp；测速地址中显式写明端口时以地址为准
+        self.port = parts.port or default_port
+        self.host_header = parts.netloc.rsplit('@', 1)[-1]
+        self.path = (parts.path or '/') + (f"?{parts.query}" if parts.query else '')
+
+    def same_origin(self, other: '_Target') -> bool:
+        return (self.scheme, self.host, self.port) == (other.scheme, other.host, other.port)
+
+
+async def _open(ip: str, target: _Target):
+    context = ssl.create_default_context() if target.scheme == 'https' else None
+    return await asyncio.wait_for(
+        asyncio.open_connection(ip, target.port, ssl=context, server_hostname=target.host if context else None,
+                                limit=4 * CHUNK_SIZE),
+        IO_TIMEOUT)
+
+
+def _close(connection):
+    if connection is not None:
+        connection[1].close()
+
+
+async def _request(connection, target: _Target):
+    """发送一次 GET 请求，返回 (状态码, 响应头)；响应体留在连接中由 _read_body 读取"""
+    reader, writer = connection
+    writer.write((f"GET {target.path} HTTP/1.1\r\nHost: {target.host_header}\r\nUser-Agent: {USER_AGENT}\r\n"
+                  f"Accept: */*\r\nAccept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n").encode('latin-1'))
+    await writer.drain()
+    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IO_TIMEOUT)
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            key, value = line.split(':', 1)
+            headers[key.strip().lower()] = value.strip()
+    return status, headers
+
+
+async def _read_body(reader, headers: dict, sink) -> bool:
+    """
+    读取响应体，每读到一块数据调用 await sink(字节数)，sink 返回 False 时停止读取。
+    完整读完且连接可以复用时返回 True。
+    """
+    async def read_exact(size):
+        while size > 0:
+            data = await asyncio.wait_for(reader.read(min(CHUNK_SIZE, size)), IO_TIMEOUT)
+            if not data:
+                raise asyncio.IncompleteReadError(b'', size)
+            size -= len(data)
+            if not await sink(len(data)):
+                return False
+        return True
+
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            size_line = await asyncio.wait_for(reader.readline(), IO_TIMEOUT)
+            size = int(size_line.split(b';')[0].strip() or b'0', 16)
+            if size == 0:
+                # 跳过 trailer，直到空行
+                while (await asyncio.wait_for(reader.readline(), IO_TIMEOUT)).strip():
+                    pass
+                break
+            if not await read_exact(size):
+                return False
+            await asyncio.wait_for(reader.readexactly(2), IO_TIMEOUT)
+    elif 'content-length' in headers:
+        if not await read_exact(int(headers['content-length'])):
+            return False
+    else:
+        # 没有长度信息，读到连接关闭为止
+        while data := await asyncio.wait_for(reader.read(CHUNK_SIZE), IO_TIMEOUT):
+            if not await sink(len(data)):
+                break
+        return False
+    return headers.get('connection', '').lower() != 'close'
+
+
+async def _discard(_size):
+    return True
+
+
+async def _resolve(ip: str, target: _Target):
+    """
+    请求测速地址并跟随重定向（始终连接同一个 IP），返回 (连接, 最终地址, 响应头)，
+    最终响应的响应体尚未读取，由第一个下载连接直接使用。
+    """
+    connection = None
+    try:
+        for _ in range(MAX_REDIRECTS + 1):
+            if connection is None:
+                connection = await _open(ip, target)
+            status, headers = await _request(connection, target)
+            if status == 200:
+                return connection, target, headers
+            if status not in (301, 302, 303, 307, 308) or not headers.get('location'):
+                raise _HTTPError(f"HTTP {status}")
+            reusable = await _read_body(connection[0], headers, _discard)
+            location = _Target(urljoin(target.url, headers['location']), target.port)
+            if not reusable or not location.same_origin(target):
+                _close(connection)
+                connection = None
+            target = location
+        raise _HTTPError("重定向次数过多")
+    except BaseException:
+        _close(connection)
+        raise
+
+
+def _colo(headers: dict) -> str:
+    """从响应头中取出地区码：Cloudflare 的 cf-ray 末尾，或 CloudFront 的 x-amz-cf-pop 前三位"""
+    if headers.get('cf-ray'):
+        return headers['cf-ray'].rsplit('-', 1)[-1].upper()
+    if headers.get('x-amz-cf-pop'):
+        return headers['x-amz-cf-pop'][:3].upper()
+    return ''
+
+
+def _describe(error: BaseException) -> str:
+    return str(error) or type(error).__name__
+
+
+async def measure_ip(ip: str, url: str = DEFAULT_URL, port: int = 443, connections: int = 4, duration: float = 10,
+                     stable_tolerance: float = 0.05, budget: BandwidthBudget = bandwidth_budget, cancel=None) -> dict:
+    """
+    测量单个 IP 的下载速度，返回 {speed (MB/s), colo, bytes, seconds, stable, throttled, error}。
+    stable 表示速度稳定而提前结束；throttled 表示测得的速度受带宽预算限制，实际可能更快。
+    """
+    result = {"speed": 0.0, "colo": '', "bytes": 0, "seconds": 0.0, "stable": False, "throttled": False, "error": ''}
+    started = time.monotonic()
+    try:
+        first, target, headers = await _resolve(ip, _Target(url, port))
+    except _ERRORS + (_HTTPError,) as e:
+        result.update(error=_describe(e), seconds=round(time.monotonic() - started, 2))
+        return result
+    result['colo'] = _colo(headers)
+
+    stop = asyncio.Event()
+    waited = [0.0]
+    errors = []
+
+    async def sink(size):
+        result['bytes'] += size
+        delay = budget.delay(size)
+        if delay:
+            waited[0] += delay
+            await asyncio.sleep(delay)
+        return not stop.is_set()
+
+    async def worker(connection, response_headers):
+        try:
+            while not stop.is_set():
+                if connection is None:
+                    connection = await _open(ip, target)
+                if response_headers is None:
+                    status, response_headers = await _request(connection, target)
+                    if status != 200:
+                        raise _HTTPError(f"HTTP {status}")
+                if not await _read_body(connection[0], response_headers, sink):
+                    _close(connection)
+                    connection = None
+                response_headers = None
+        except _ERRORS + (_HTTPError,) as e:
+            errors.append(_describe(e))
+        finally:
+            _close(connection)
+
+    tasks = [asyncio.create_task(worker(first, headers))]
+    tasks += [asyncio.create_task(worker(None, None)) for _ in range(max(1, connections) - 1)]
+    # 预热结束时的 (时间, 字节数)，速度只按之后的数据计算
+    base = None
+    samples = []
+    last_at, last_bytes = started, 0
+    try:
+        while True:
+            _, pending = await asyncio.wait(tasks, timeout=SAMPLE_INTERVAL)
+            now = time.monotonic()
+            if not pending or now - started >= duration or (cancel is not None and cancel.is_set()):
+                break
+            if now - started >= WARMUP:
+                if base is None:
+                    base = (now, result['bytes'])
+                else:
+                    samples.append((result['bytes'] - last_bytes) / (now - last_at))
+                    recent = samples[-STABLE_SAMPLES:]
+                    mean = sum(recent) / len(recent)
+                    if len(recent) == STABLE_SAMPLES and mean > 0 and (max(recent) - min(recent)) / mean <= stable_tolerance:
+                        result['stable'] = True
+                        break
+            last_at, last_bytes = now, result['bytes']
+    finally:
+        stop.set()
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    now = time.monotonic()
+    elapsed = now - started
+    if base is not None and now > base[0]:
+        speed = (result['bytes'] - base[1]) / (now - base[0])
+    else:
+        speed = result['bytes'] / elapsed if elapsed > 0 else 0.0
+    result.update(
+        speed=round(speed / MB, 2),
+        seconds=round(elapsed, 2),
+        throttled=waited[0] > elapsed * max(1, connections) * THROTTLED_RATIO,
+        error='' if result['bytes'] else (errors[0] if errors else '没有收到数据'),
+    )
+    return result
+
+
+async def _measure_all(rows, url, port, count, duration, min_speed, connections, parallel, stable_tolerance,
+                       budget, progress_callback, cancel, profile):
+    # 与 tcping 相同，固定数量的 worker 按延迟排名依次从同一个迭代器取 IP
+    pending = iter(rows)
+    measured = {}
+    passed = running = 0
+    target = min(count, len(rows))
+
+    async def worker():
+        nonlocal passed, running
+        # 已达标与正在测速的 IP 足够时不再开始新的测速；正在测速的 IP 未达标时，由它的 worker 继续测下一个
+        while passed + running < count and not (cancel is not None and cancel.is_set()):
+            row = next(pending, None)
+            if row is None:
+                break
+            ip = row[COL_IP]
+            running += 1
+            try:
+                result = await measure_ip(ip, url, port, connections, duration, stable_tolerance, budget, cancel)
+            finally:
+                running -= 1
+            measured[ip] = result
+            ok = result['speed'] > 0 and result['speed'] >= min_speed
+            passed += ok
+            outcome = 'failed' if result['error'] else ('stable' if result['stable'] else 'full')
+            metrics.DOWNLOAD_BYTES.inc(profile, amount=result['bytes'])
+            metrics.DOWNLOAD_TEST_SECONDS.observe(result['seconds'], outcome, profile)
+            if result['error']:
+                logging.info(f"下载测速: {ip} 失败: {result['error']}")
+            else:
+                logging.info(f"下载测速: {ip} {result['speed']:.2f} MB/s {result['colo']} "
+                             f"({result['seconds']:.1f}s{'，速度稳定提前结束' if result['stable'] else ''}"
+                             f"{'，受带宽预算限制' if result['throttled'] else ''})")
+            if progress_callback:
+                progress_callback(len(measured), max(len(measured), target), passed)
+
+    await asyncio.gather(*(worker() for _ in range(min(max(1, parallel), len(rows)))))
+    return measured
+
+
+def run_download_test(rows: list[dict], url: str = DEFAULT_URL, port: int = 443, count: int = 10,
+                      duration: float = 10, min_speed: float = 0.0, connections: int = 4, parallel: int = 4,
+                      stable_tolerance: float = 0.05, budget: BandwidthBudget = bandwidth_budget,
+                      progress_callback=None, cancel=None, profile: str = DEFAULT_PROFILE) -> list[dict]:
+    """
+    对按延迟排序的结果行 rows 进行下载测速，返回新的结果列表（行内写入下载速度与地区码）：
+    速度不低于 min_speed 的已测 IP 按速度降序排在最前，未测的 IP 保持延迟排序排在其后；
+    低于 min_speed 的已测 IP 被移除，但没有任何 IP 达标时与 cfst 相同保留全部已测 IP。
+    cancel 为 threading.Event，被设置后不再开始新的测速，正在测速的 IP 立即结束。
+    profile 仅用于指标的标签。
+    """
+    if not rows or count <= 0:
+        return list(rows)
+    measured = asyncio.run(_measure_all(rows, url, port, count, duration, min_speed, connections, parallel,
+                                        stable_tolerance, budget, progress_callback, cancel, profile))
+    throttled = sum(1 for result in measured.values() if result['throttled'])
+    if throttled:
+        logging.warning(f"下载测速: {throttled} 个 IP 的速度受带宽预算 ({budget.status()['mb_per_sec']} MB/s) 限制，"
+                        f"排名可能不准确，可提高 [Profiles] download_budget 或减少 download_parallel。")
+
+    tested, rest = [], []
+    for row in rows:
+        result = measured.get(row[COL_IP])
+        if result is None:
+            rest.append(row)
+            continue
+        row = dict(row)
+        row[COL_SPEED] = f"{result['speed']:.2f}"
+        row[COL_COLO] = row.get(COL_COLO) or result['colo']
+        tested.append((result['speed'], row))
+    tested.sort(key=lambda item: item[0], reverse=True)
+    passed = [row for speed, row in tested if speed > 0 and speed >= min_speed]
+    return (passed or [row for _, row in tested]) + rest
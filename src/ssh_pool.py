@@ -0,0 +1,145 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\ssh_pool.py
+import logging
+import threading
+import time
+import paramiko
+from . import metrics
+
+# 等待远程命令结束时检查退出状态的间隔（秒）
+EXIT_POLL_INTERVAL = 0.05
+
+
+class CommandTimeout(Exception):
+    """远程命令在 command_timeout 秒内没有结束（通道已关闭，命令可能仍在设备上运行）"""
+
+
+class SSHSession:
+    """
+    一个长期保持的 SSH 会话：复用已认证的 transport 和 SFTP 通道，
+    通过 keepalive 保活，连接失效时在下次使用时自动重连。
+    """
+
+    def __init__(self, host: str, port: int, username: str, password: str,
+                 timeout: float = 10, keepalive: int = 30, command_timeout: float = 60):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.keepalive = keepalive
+        self.command_timeout = command_timeout
+        self._client = None
+        self._sftp = None
+        self._lock = threading.RLock()
+
+    def _is_active(self) -> bool:
+        transport = self._client.get_transport() if self._client else None
+        return bool(transport and transport.is_active())
+
+    def _connect(self):
+        self.close()
+        logging.info(f"SSH 连接池: 正在连接 {self.username}@{self.host}:{self.port}")
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        with metrics.SSH_CONNECT_SECONDS.time(f"{self.host}:{self.port}"):
+            client.connect(hostname=self.host, port=self.port, username=self.username, password=self.password,
+                           timeout=self.timeout, banner_timeout=self.timeout, auth_timeout=self.timeout)
+        if self.keepalive > 0:
+            client.get_transport().set_keepalive(self.keepalive)
+        self._client = client
+
+    def _ensure_connected(self):
+        if not self._is_active():
+            self._connect()
+
+    def sftp(self) -> paramiko.SFTPClient:
+        """返回可复用的 SFTP 通道，必要时重新连接或重新打开"""
+        self._ensure_connected()
+        if self._sftp is None or self._sftp.get_channel().closed:
+            self._sftp = self._client.open_sftp()
+            self._sftp.get_channel().settimeout(self.timeout)
+        return self._sftp
+
+    def exec(self, command: str) -> tuple[int, str, str]:
+        """
+        执行远程命令，返回 (退出码, stdout, stderr)。
+        命令超过 command_timeout 秒未结束时关闭通道并抛出 CommandTimeout，不会无限期占用会话锁。
+        """
+        self._ensure_connected()
+        stdin, stdout, stderr = self._client.exec_command(command, timeout=self.timeout)
+        channel = stdout.channel
+        deadline = time.monotonic() + self.command_timeout
+        # recv_exit_status() 没有超时，改为按截止时间轮询
+        while not channel.exit_status_ready():
+            if time.monotonic() >= deadline:
+                channel.close()
+                raise CommandTimeout(f"命令 '{command}' 在 {self.command_timeout:g} 秒内没有结束")
+            time.sleep(EXIT_POLL_INTERVAL)
+        exit_status = channel.recv_exit_status()
+        return exit_status, stdout.read().decode('utf-8', errors='replace'), stderr.read().decode('utf-8', errors='replace')
+
+    def run(self, func):
+        """
+        在会话锁内执行 func(session)。同一台设备上的更新串行执行；
+        连接在复用过程中断开时（例如设备重启），重新连接后重试一次。认证失败及命令超时不重试。
+        """
+        with self._lock:
+            try:
+                return func(self)
+            except paramiko.AuthenticationException:
+                self.close()
+                raise
+            except (paramiko.SSHException, OSError, EOFError) as e:
+                logging.warning(f"SSH 连接池: 与 {self.host}:{self.port} 的连接异常 ({e})，正在重连后重试...")
+                self.close()
+                return func(self)
+
+    def close(self):
+        if self._sftp is not None:
+            try:
+                self._sftp.close()
+            except Exception:
+                pass
+            self._sftp = None
+        if self._client is not None:
+            try:
+                self._client.close()
+            except Exception:
+                pass
+            self._client = None
+
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_session(config) -> SSHSession:
+    """按 (host, port, username) 从连接池获取会话；密码或超时配置变化时重建会话"""
+    host = config.get('host')
+    port = config.getint('port', fallback=22)
+    username = config.get('username')
+    password = config.get('password')
+    timeout = config.getint('ssh_timeout', fallback=10)
+    keepalive = config.getint('ssh_keepalive', fallback=30)
+    command_timeout = config.getint('ssh_command_timeout', fallback=60)
+
+    key = (host, port, username)
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session and (session.password, session.timeout, session.keepalive, session.command_timeout) != \
+                (password, timeout, keepalive, command_timeout):
+            session.close()
+            session = None
+        if session is None:
+            session = SSHSession(host, port, username, password, timeout=timeout, keepalive=keepalive,
+                                 command_timeout=command_timeout)
+            _sessions[key] = session
+        return session
+
+
+def close_all():
+    """关闭连接池中的所有会话"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,78 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\startup_report.py
+"""
+启动耗时与内存占用报告。main.py 最先导入本模块，以本模块的导入时间作为启动起点；
+记录各启动阶段的耗时、首个请求到达的时间 (time-to-first-request) 以及进程的峰值内存 (RSS)。
+"""
+import logging
+import os
+import sys
+import threading
+import time
+
+_started = time.perf_counter()
+_started_at = time.time()
+_milestones = {}
+_first_request_ms = None
+_lock = threading.Lock()
+
+# 关注的较重依赖，报告中列出其中已被导入的模块
+HEAVY_MODULES = ('paramiko', 'yaml', 'cryptography', 'huaweicloudsdkcore', 'huaweicloudsdkdns', 'numpy', 'requests')
+
+
+def mark(name: str):
+    """记录一个启动阶段完成的时间（距启动起点的毫秒数）"""
+    _milestones[name] = round((time.perf_counter() - _started) * 1000, 1)
+
+
+def peak_rss_bytes():
+    """进程的峰值常驻内存（字节），平台不支持时返回 None"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def current_rss_bytes():
+    """进程当前的常驻内存（字节），仅 Linux 支持"""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+def first_request():
+    """在每个请求开始时调用；只有第一次调用会记录 time-to-first-request 并输出报告"""
+    global _first_request_ms
+    if _first_request_ms is not None:
+        return
+    with _lock:
+        if _first_request_ms is not None:
+            return
+        _first_request_ms = round((time.perf_counter() - _started) * 1000, 1)
+    mark('first_request')
+    log_report()
+
+
+def report() -> dict:
+    peak = peak_rss_bytes()
+    current = current_rss_bytes()
+    return {
+        'started_at': _started_at,
+        'uptime_seconds': round(time.perf_counter() - _started, 1),
+        'time_to_first_request_ms': _first_request_ms,
+        'milestones_ms': dict(_milestones),
+        'peak_rss_mb': round(peak / 1024 / 1024, 1) if peak else None,
+        'current_rss_mb': round(current / 1024 / 1024, 1) if current else None,
+        'heavy_modules_loaded': [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+
+def log_report():
+    data = report()
+    milestones = ', '.join(f"{name} {ms:g} ms" for name, ms in data['milestones_ms'].items())
+    logging.info(f"启动报告: {milestones}; 峰值内存 {data['peak_rss_mb']} MB; "
+                 f"已加载的重量级依赖: {', '.join(data['heavy_modules_loaded']) or '无'}")
@@ -1,9 +1,46 @@
 # d:\桌面\cloudflare-ip-optimizer-main\src\state.py
 import threading
 
-class AppState:
+# 未使用 [profile:名称] 时唯一的优选配置，即原有的 [cfst] 配置
+DEFAULT_PROFILE = 'default'
+
+
+class ProfileState:
+    """
+    一个优选配置（profile）的运行状态。每个 profile 有独立的结果、最优IP、推送状态和任务锁。
+    """
+
+    def __init__(self, name: str = DEFAULT_PROFILE):
+        self.name = name
+        self.best_ip = None
+        self.last_results = []
+        # 双栈优选 ([cfst] dual_stack) 时 IPv6 的最优IP与结果，与 IPv4 分别排名
+        self.best_ip_v6 = None
+        self.last_results_v6 = []
+        # 两个地址族比较后，当前是否发布 IPv6 地址（见 assignment.publish_ipv6）
+        self.ipv6_active = False
+        # 最近一次完成测速（扫描）的时间戳，用于判断启动时结果是否过旧
+        self.last_scan_at = None
+        # 当前（或最近一次）优选任务的实时进度，由 runner.RunTracker 维护
+        self.run_status = {}
+        # 预先序列化的 API 响应 (payloads.CachedPayload)，在结果变化时由 payloads.rebuild_payloads 重建
+        self.payloads = {}
+        self.results_version = 0
+        # 最近一次心跳检测的结果 {ip: {failures, attempts, healthy, checked_at}}
+        self.health_status = {}
+        # 各推送目标最近一次推送的状态 {名称: {state, ip, attempts, latency_ms, error, ...}}
+        self.push_status = {}
+        # 使用锁来确保同一 profile 的优选任务不会并发执行
+        self.optimizer_lock = threading.Lock()
+        # 结果字段 (best_ip / last_results 等) 与结果文件的更新锁：解析结果与故障切换互斥。
+        # 优选任务在整个扫描期间持有 optimizer_lock，故障切换不能等待它，只在更新结果时短暂持有该锁
+        self.results_lock = threading.Lock()
+
+
+class AppState(ProfileState):
     """
     用于在不同模块间共享应用程序状态的单例类。
+    单例本身即默认 profile 的状态；[profile:名称] 的状态保存在 profiles 中。
     """
     _instance = None
     
@@ -11,11 +48,18 @@ class AppState:
         if cls._instance is None:
             cls._instance = super(AppState, cls).__new__(cls)
             # 初始化状态变量
-            cls._instance.best_ip = None
-            cls._instance.last_results = []
-            # 使用锁来确保优选任务不会并发执行
-            cls._instance.optimizer_lock = threading.Lock()
+            ProfileState.__init__(cls._instance)
+            # coordinator 模式下最近一次分布式优选的全局排名及各站点视图 (cluster.ClusterCoordinator)
+            cls._instance.cluster_results = {}
+            # worker 模式下 coordinator 下发的探测任务 {任务ID: {state, site, rows, error, ...}}
+            cls._instance.cluster_jobs = {}
+            # 所有 profile 的状态 {名称: ProfileState}，默认 profile 即单例本身
+            cls._instance.profiles = {DEFAULT_PROFILE: cls._instance}
         return cls._instance
 
+    def __init__(self):
+        # 状态只在 __new__ 中初始化一次，避免再次实例化时被重置
+        pass
+
 # 创建一个全局唯一的实例
 app_state = AppState()
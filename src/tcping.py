@@ -0,0 +1,186 @@
+# d:\桌面\cloudflare-ip-optimizer-main\src\tcping.py
+import asyncio
+import ipaddress
+import logging
+import os
+import random
+import time
+from .results import (
+    COL_IP, COL_SENT, COL_RECEIVED, COL_LOSS, COL_LATENCY, COL_SPEED, COL_COLO
+)
+
+# Cloudflare 官方公布的 IPv4 段 (https://www.cloudflare.com/ips-v4)，在找不到 ip.txt 时使用
+CLOUDFLARE_IPV4_RANGES = [
+    "173.245.48.0/20", "103.21.244.0/22", "103.22.200.0/22", "103.31.4.0/22",
+    "141.101.64.0/18", "108.162.192.0/18", "190.93.240.0/20", "188.114.96.0/20",
+    "197.234.240.0/22", "198.41.128.0/17", "162.158.0.0/15", "104.16.0.0/13",
+    "104.24.0.0/14", "172.64.0.0/13", "131.0.72.0/22",
+]
+# Cloudflare 官方公布的 IPv6 段 (https://www.cloudflare.com/ips-v6)，双栈优选找不到 ipv6.txt 时使用
+CLOUDFLARE_IPV6_RANGES = [
+    "2400:cb00::/32", "2606:4700::/32", "2803:f800::/32", "2405:b500::/32",
+    "2405:8100::/32", "2a06:98c0::/29", "2c0f:f248::/32",
+]
+# IPv6 段中的 /120 块数量极大（一个 /32 有 2^88 个），无法逐块展开；
+# 所有 IPv6 段的块总数超过该值时，按各段的块数比例分配，共随机抽取约该数量的块（每段至少一个）
+IPV6_MAX_BLOCKS = 1024
+
+
+def load_ranges(ip_arg: str = '', ip_file: str = '', family: int = 4) -> list[str]:
+    """
+    读取待测 IP 段，优先级与 cfst 相同：-ip 参数 > -f 文件 > 内置 Cloudflare IP 段（family 为 6 时使用 IPv6 段）。
+    """
+    if ip_arg:
+        return [item.strip() for item in ip_arg.split(',') if item.strip()]
+
+    if ip_file and os.path.exists(ip_file):
+        with open(ip_file, 'r', encoding='utf-8') as f:
+            ranges = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+        if ranges:
+            return ranges
+        logging.warning(f"内置测速: IP 段文件 {ip_file} 为空，改用内置 Cloudflare IP 段。")
+    elif ip_file:
+        logging.warning(f"内置测速: IP 段文件 {ip_file} 不存在，改用内置 Cloudflare IP 段。")
+
+    return list(CLOUDFLARE_IPV6_RANGES if family == 6 else CLOUDFLARE_IPV4_RANGES)
+
+
+def _block_count(network, block_prefix: int) -> int:
+    return 1 << (block_prefix - network.prefixlen) if network.prefixlen < block_prefix else 1
+
+
+def _sample_blocks(network, block_prefix: int, count: int) -> list:
+    """从 network 中不重复地随机抽取 count 个 /block_prefix 块，块总数不多于 count 时全部返回"""
+    total = _block_count(network, block_prefix)
+    if total <= count:
+        return list(network.subnets(new_prefix=block_prefix)) if network.prefixlen < block_prefix else [network]
+    base = int(network.network_address)
+    shift = network.max_prefixlen - block_prefix
+    # 块数可达 2^88，random.sample 无法处理这么大的 range，逐个抽取并去重
+    indexes = set()
+    while len(indexes) < count:
+        indexes.add(random.randrange(total))
+    return [ipaddress.ip_network((base + (index << shift), block_prefix)) for index in indexes]
+
+
+def expand_ranges(ranges: list[str], all_ip: bool = False) -> list[str]:
+    """
+    将 IP 段展开为待测 IP 列表。
+    默认与 cfst 一致：每个 /24 段（IPv6 为 /120）随机取一个 IP；all_ip=True 时展开全部 IPv4 地址。
+    所有 IPv6 段的 /120 块总数超过 IPV6_MAX_BLOCKS 时，按比例随机抽取共约 IPV6_MAX_BLOCKS 个块。
+    """
+    networks = []
+    for item in ranges:
+        try:
+            networks.append(ipaddress.ip_network(item, strict=False))
+        except ValueError:
+            logging.warning(f"内置测速: 跳过无法识别的 IP 段 '{item}'")
+
+    v6_blocks = sum(_block_count(network, 120) for network in networks if network.version == 6)
+
+    ips = []
+    seen = set()
+    for network in networks:
+        if network.num_addresses == 1:
+            candidates = [str(network.network_address)]
+        elif all_ip and network.version == 4:
+            candidates = [str(ip) for ip in network.hosts()]
+        else:
+            if network.version == 4:
+                blocks = network.subnets(new_prefix=24) if network.prefixlen < 24 else [network]
+            else:
+                quota = _block_count(network, 120)
+                if v6_blocks > IPV6_MAX_BLOCKS:
+                    quota = max(1, quota * IPV6_MAX_BLOCKS // v6_blocks)
+                blocks = _sample_blocks(network, 120, quota)
+            candidates = []
+            for block in blocks:
+                base = int(block.network_address)
+                offset = random.randint(1, block.num_addresses - 2) if block.num_addresses > 2 else 0
+                candidates.append(str(ipaddress.ip_address(base + offset)))
+
+        for ip in candidates:
+            if ip not in seen:
+                seen.add(ip)
+                ips.append(ip)
+    return ips
+
+
+async def probe_ip(ip: str, port: int, count: int, timeout: float) -> dict:
+    """对单个 IP 进行 count 次 TCP 握手，返回统计数据"""
+    delays = []
+    for _ in range(count):
+        start = time.perf_counter()
+        try:
+            _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout=timeout)
+        except (OSError, asyncio.TimeoutError):
+            continue
+        delays.append((time.perf_counter() - start) * 1000)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+    received = len(delays)
+    return {
+        COL_IP: ip,
+        COL_SENT: str(count),
+        COL_RECEIVED: str(received),
+        COL_LOSS: f"{(count - received) / count:.2f}",
+        COL_LATENCY: f"{sum(delays) / received:.2f}" if received else "",
+        COL_SPEED: "0.00",
+        COL_COLO: "",
+    }
+
+
+async def _probe_all(ips, port, count, timeout, concurrency, progress_callback, cancel=None, concurrency_limit=None):
+    # 固定数量的 worker 从同一个迭代器取 IP，避免 -allip 时一次性创建上百万个协程
+    pending = iter(ips)
+    results = []
+    done = 0
+    valid = 0
+
+    async def worker(index):
+        nonlocal done, valid
+        for ip in pending:
+            if cancel is not None and cancel.is_set():
+                break
+            result = await probe_ip(ip, port, count, timeout)
+            done += 1
+            if result[COL_LATENCY]:
+                valid += 1
+            results.append(result)
+            if progress_callback:
+                progress_callback(done, len(ips), valid)
+            # 并发上限在扫描中被降低时，编号超出上限的 worker 在完成当前 IP 后退出
+            if concurrency_limit is not None and index >= concurrency_limit():
+                break
+
+    await asyncio.gather(*(worker(index) for index in range(min(concurrency, len(ips)))))
+    return results
+
+
+def run_tcping(ips: list[str], port: int = 443, count: int = 4, timeout: float = 1.0,
+               concurrency: int = 200, max_latency: float = 9999, min_latency: float = 0,
+               max_loss: float = 1.0, progress_callback=None, cancel=None, concurrency_limit=None) -> list[dict]:
+    """
+    使用 asyncio 并发地对 IP 列表进行 TCPing，并按 cfst 的规则过滤和排序：
+    丢包率升序，其次平均延迟升序。返回的每一行与 result.csv 的格式一致。
+    cancel 为 threading.Event，被设置后不再开始新的探测，只返回已完成部分的结果。
+    concurrency_limit 为返回当前并发上限的函数，扫描中降低上限时多余的 worker 在完成手头的 IP 后退出。
+    """
+    results = asyncio.run(_probe_all(ips, port, count, timeout, max(1, concurrency), progress_callback, cancel,
+                                     concurrency_limit))
+
+    filtered = []
+    for row in results:
+        if not row[COL_LATENCY]:
+            continue  # 全部丢包的 IP 不输出
+        latency = float(row[COL_LATENCY])
+        loss = float(row[COL_LOSS])
+        if min_latency <= latency <= max_latency and loss <= max_loss:
+            filtered.append(row)
+
+    filtered.sort(key=lambda r: (float(r[COL_LOSS]), float(r[COL_LATENCY])))
+    return filtered
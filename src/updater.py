@@ -1,19 +1,77 @@
 # d:\桌面\cloudflare-ip-optimizer-main\src\updater.py
+import hashlib
+import ipaddress
 import logging
 import os
+import re
+import shlex
+import tempfile
+import threading
 import paramiko
-from io import StringIO
-import yaml
+from .assignment import PublishPlan
+from .ssh_pool import get_session
+from . import metrics
 
 START_MARKER = "##自动CF优选开始##"
 END_MARKER = "##自动CF优选结束##"
+# sync_mode = checksum 时，超过该大小的改写结果暂存到本地临时文件而不是内存
+SPOOL_MAX_SIZE = 4 * 1024 * 1024
 
-def _process_hosts_content(content: str, new_ip: str) -> tuple[str, bool]:
+# sync_mode = checksum: (配置节, 主机, 端口, 路径) -> {'algorithm', 'hash', 'block'}，
+# 记录上次推送后远程文件的摘要以及标记块内的行
+_sync_state = {}
+_sync_lock = threading.Lock()
+
+# rewrites 列表中的 answer / domain 行，例如 "      answer: 1.2.3.4" 或 "    - domain: 'example.com'"
+_ANSWER_LINE = re.compile(r"^(?P<prefix>\s*(?:-\s+)?answer:\s*)(?P<value>[^#\r\n]*?)(?P<eol>\s*(?:#.*)?\r?\n?)$")
+_DOMAIN_LINE = re.compile(r"^\s*(?:-\s+)?domain:\s*(?P<value>[^#\r\n]*?)\s*(?:#.*)?\r?\n?$")
+
+
+def _as_plan(plan) -> PublishPlan:
+    """兼容直接传入单个 IP 的调用"""
+    return plan if isinstance(plan, PublishPlan) else PublishPlan(plan)
+
+
+def _block_domain(line: str):
+    """返回标记块内一行对应的域名；空行和注释行返回 None"""
+    stripped = line.strip()
+    if not stripped or stripped.startswith('#'):
+        return None
+    parts = stripped.split()
+    if len(parts) > 1:
+        try:
+            # 已是 "IP 域名" 格式时取第二个词作为域名
+            ipaddress.ip_address(parts[0])
+            return parts[1]
+        except ValueError:
+            pass
+    return parts[0]
+
+
+def _rewrite_block(lines: list[str], plan: PublishPlan) -> list[str]:
+    """
+    按分配方案改写标记块内的行：每个域名输出 "IP 域名" 各一行（多条记录时为多行），
+    同一域名的重复行合并，空行和注释行原样保留。
+    """
+    new_lines = []
+    seen = set()
+    for line in lines:
+        domain = _block_domain(line)
+        if domain is None:
+            new_lines.append(line)
+        elif domain not in seen:
+            seen.add(domain)
+            new_lines.extend(f"{ip} {domain}" for ip in plan.ips_for(domain))
+    return new_lines
+
+
+def _process_hosts_content(content: str, plan) -> tuple[str, bool]:
     """
-    处理 hosts 文件内容，替换指定块内的 IP 地址。
+    处理 hosts 文件内容，按分配方案 plan（或单个 IP）替换指定块内的 IP 地址。
     如果标记不存在，则在文件末尾添加。
     返回 (更新后的内容, 是否有变化)
     """
+    plan = _as_plan(plan)
     lines = content.splitlines()
     
     has_start = any(line.strip() == START_MARKER for line in lines)
@@ -33,188 +91,369 @@ def _process_hosts_content(content: str, new_ip: str) -> tuple[str, bool]:
         return "\n".join(new_content_list), True
 
     new_lines = []
-    in_section = False
+    block = None
     
     for line in lines:
-        if line.strip() == START_MARKER:
-            in_section = True
+        if line.strip() == START_MARKER and block is None:
+            block = []
             new_lines.append(line)
             continue
         
-        if line.strip() == END_MARKER:
-            in_section = False
+        if line.strip() == END_MARKER and block is not None:
+            new_lines.extend(_rewrite_block(block, plan))
+            block = None
             new_lines.append(line)
             continue
             
-        if in_section:
-            # 跳过空行和注释行
-            if not line.strip() or line.strip().startswith('#'):
-                new_lines.append(line)
-                continue
-            
-            parts = line.split()
-            if len(parts) >= 1:
-                domain = parts[0] # 只取第一个词作为域名
-                new_lines.append(f"{new_ip} {domain}") # 修正为正确的 hosts 格式：IP 域名
-            else:
-                new_lines.append(line) # 保留无法处理的行
+        if block is not None:
+            block.append(line)
         else:
             new_lines.append(line)
+    if block is not None:
+        new_lines.extend(block)
             
     updated_content_str = "\n".join(new_lines)
     return updated_content_str, updated_content_str != content
 
-def update_openwrt_hosts(config, best_ip: str):
+def _stream_patch_hosts(src, dst, plan: PublishPlan, digest) -> tuple[bool, list[str]]:
+    """
+    单次流式处理：逐行读取 src，只改写标记块内的行并写入 dst，同时计算写入内容的摘要。
+    只有标记块会暂存在内存中，其余行（包括换行符）原样写出。
+    返回 (是否有变化, 改写后标记块内的行)
+    """
+    changed = found_start = found_end = False
+    block = pending = None
+    eol = "\n"
+    last_line = b''
+
+    def write(text: str):
+        nonlocal last_line
+        last_line = text.encode('utf-8')
+        dst.write(last_line)
+        digest.update(last_line)
+
+    for raw in src:
+        line = raw.decode('utf-8')
+        body = line.rstrip('\r\n')
+        stripped = body.strip()
+        if stripped == START_MARKER and pending is None:
+            found_start = True
+            pending = []
+            eol = line[len(body):] or eol
+        elif stripped == END_MARKER and pending is not None:
+            block = _rewrite_block(pending, plan)
+            changed = changed or block != pending
+            for block_line in block:
+                write(block_line + eol)
+            pending = None
+            found_end = True
+        elif pending is not None:
+            pending.append(body)
+            continue
+        write(line)
+    if pending is not None:
+        # 只有开始标记：原样写回暂存的行
+        for block_line in pending:
+            write(block_line + eol)
+
+    if not (found_start and found_end):
+        logging.info("OpenWRT 更新: 未找到标记，将在文件末尾添加。")
+        tail = "\n".join([
+            "",
+            START_MARKER,
+            "# 请在此标记之间添加需要自动更新的域名",
+            "# 示例：example.com",
+            END_MARKER,
+        ]) + "\n"
+        if last_line and not last_line.endswith(b"\n"):
+            tail = "\n" + tail
+        write(tail)
+        return True, []
+    return changed, block
+
+
+def _remote_checksum(session, config, remote_path: str, algorithm: str):
+    """在远程执行 sha256sum/md5sum，返回文件摘要；命令不可用时返回 None"""
+    with metrics.SSH_OP_SECONDS.time(config.name, 'checksum'):
+        exit_status, output, _ = session.exec(f"{algorithm}sum {shlex.quote(remote_path)}")
+    if exit_status != 0 or not output.strip():
+        return None
+    return output.split()[0].lower()
+
+
+def _install_file(session, config, remote_tmp_path: str, remote_path: str, plan: PublishPlan, post_command: str) -> bool:
+    """用临时文件覆盖目标文件，成功后执行更新后命令"""
+    logging.info(f"OpenWRT 更新: 正在移动临时文件以覆盖原文件")
+    with metrics.SSH_OP_SECONDS.time(config.name, 'exec'):
+        exit_status, _, error = session.exec(f"mv {shlex.quote(remote_tmp_path)} {shlex.quote(remote_path)}")
+    if exit_status != 0:
+        logging.error(f"OpenWRT 更新: 移动文件失败: {error.strip()}")
+        return False
+    logging.info(f"OpenWRT 更新: 成功更新 hosts 文件，IP 为 {plan.describe()}")
+    if post_command:
+        logging.info(f"OpenWRT 更新: 正在执行更新后命令: '{post_command}'")
+        with metrics.SSH_OP_SECONDS.time(config.name, 'post_command'):
+            exit_status, _, error = session.exec(post_command)
+        if exit_status != 0:
+            logging.error(f"OpenWRT 更新: 更新后命令执行失败: {error.strip()}")
+            return False
+    return True
+
+
+def _checksum_sync(session, config, remote_path: str, plan: PublishPlan, post_command: str) -> bool:
+    """
+    sync_mode = checksum：先在远程计算文件摘要，与上次推送后的摘要一致且标记块无需改变时，
+    只需一次执行命令的往返即可结束；否则流式读取并改写标记块，只有内容变化时才上传。
+    """
+    algorithm = config.get('checksum_algorithm', fallback='sha256').strip().lower()
+    key = (config.name, config.get('host'), config.getint('port', fallback=22), remote_path)
+    with _sync_lock:
+        state = _sync_state.get(key)
+
+    if state and state['algorithm'] == algorithm:
+        remote_hash = _remote_checksum(session, config, remote_path, algorithm)
+        if remote_hash == state['hash'] and state['block'] == _rewrite_block(state['block'], plan):
+            logging.info("OpenWRT 更新: 远程文件摘要未变化且标记块已是最新，跳过传输。")
+            return True
+        if remote_hash != state['hash']:
+            logging.info("OpenWRT 更新: 远程文件已在其他地方被修改，重新读取。")
+
+    sftp = session.sftp()
+    digest = hashlib.new(algorithm)
+    logging.info(f"OpenWRT 更新: 正在流式读取并改写远程文件 {remote_path}")
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as patched:
+        with metrics.SSH_OP_SECONDS.time(config.name, 'read'), sftp.open(remote_path, 'rb') as remote_file:
+            remote_file.prefetch()
+            has_changed, block = _stream_patch_hosts(remote_file, patched, plan, digest)
+
+        if has_changed:
+            remote_tmp_path = f"/tmp/hosts_update_{plan.best_ip}"
+            logging.info(f"OpenWRT 更新: 正在写入临时文件 {remote_tmp_path}")
+            patched.seek(0)
+            with metrics.SSH_OP_SECONDS.time(config.name, 'write'):
+                sftp.putfo(patched, remote_tmp_path)
+            if not _install_file(session, config, remote_tmp_path, remote_path, plan, post_command):
+                with _sync_lock:
+                    _sync_state.pop(key, None)
+                return False
+        else:
+            logging.info("OpenWRT 更新: 文件内容无需更改，跳过写入。")
+
+    with _sync_lock:
+        _sync_state[key] = {'algorithm': algorithm, 'hash': digest.hexdigest(), 'block': block}
+    return True
+
+
+def update_openwrt_hosts(config, best_ip: str, plan: PublishPlan = None):
     """
-    通过 SSH 连接到 OpenWRT 并更新 hosts 文件。
+    通过 SSH 连接到 OpenWRT 并更新 hosts 文件；plan 为各域名的 IP 分配方案，缺省时所有域名都指向 best_ip。
+    成功（包括内容无需更改）返回 True，失败返回 False。
     """
     if not config.getboolean('enabled', fallback=False):
-        return
+        return False
 
     host = config.get('host')
     port = config.getint('port', fallback=22)
-    username = config.get('username')
-    password = config.get('password')
     target = config.get('target', fallback='openwrt')
     post_command = config.get('post_update_command', fallback='').strip()
 
     remote_path = config.get(f"{target}_hosts_path")
+    plan = (plan or PublishPlan(best_ip)).for_target(config)
+    sync_mode = config.get('sync_mode', fallback='full').strip().lower()
 
     logging.info(f"OpenWRT 更新: 准备连接到 {host}:{port} 更新 {remote_path}")
 
+    def do_update(session):
+        if sync_mode == 'checksum':
+            return _checksum_sync(session, config, remote_path, plan, post_command)
+
+        sftp = session.sftp()
+        logging.info(f"OpenWRT 更新: 正在读取远程文件 {remote_path}")
+        with metrics.SSH_OP_SECONDS.time(config.name, 'read'), sftp.open(remote_path, 'r') as remote_file:
+            content = remote_file.read().decode('utf-8')
+
+        updated_content, has_changed = _process_hosts_content(content, plan)
+
+        if not has_changed:
+            logging.info("OpenWRT 更新: 文件内容无需更改，跳过写入。")
+            return True
+
+        remote_tmp_path = f"/tmp/hosts_update_{best_ip}"
+        logging.info(f"OpenWRT 更新: 正在写入临时文件 {remote_tmp_path}")
+        with metrics.SSH_OP_SECONDS.time(config.name, 'write'), sftp.open(remote_tmp_path, 'w') as remote_file:
+            remote_file.write(updated_content)
+
+        return _install_file(session, config, remote_tmp_path, remote_path, plan, post_command)
+
     try:
-        with paramiko.SSHClient() as ssh_client:
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh_client.connect(hostname=host, port=port, username=username, password=password, timeout=10)
-
-            with ssh_client.open_sftp() as sftp:
-                logging.info(f"OpenWRT 更新: 正在读取远程文件 {remote_path}")
-                with sftp.open(remote_path, 'r') as remote_file:
-                    content = remote_file.read().decode('utf-8')
-                
-                updated_content, has_changed = _process_hosts_content(content, best_ip)
-                
-                if not has_changed:
-                    logging.info("OpenWRT 更新: 文件内容无需更改，跳过写入。")
-                    return
-
-                remote_tmp_path = f"/tmp/hosts_update_{best_ip}"
-                logging.info(f"OpenWRT 更新: 正在写入临时文件 {remote_tmp_path}")
-                with sftp.open(remote_tmp_path, 'w') as remote_file:
-                    remote_file.write(updated_content)
-            
-            logging.info(f"OpenWRT 更新: 正在移动临时文件以覆盖原文件")
-            stdin, stdout, stderr = ssh_client.exec_command(f"mv {remote_tmp_path} {remote_path}")
-            if stdout.channel.recv_exit_status() == 0:
-                logging.info(f"OpenWRT 更新: 成功更新 hosts 文件，IP 为 {best_ip}")
-                if post_command:
-                    logging.info(f"OpenWRT 更新: 正在执行更新后命令: '{post_command}'")
-                    stdin, stdout, stderr = ssh_client.exec_command(post_command)
-                    if stdout.channel.recv_exit_status() != 0:
-                        logging.error(f"OpenWRT 更新: 更新后命令执行失败: {stderr.read().decode('utf-8').strip()}")
-            else:
-                logging.error(f"OpenWRT 更新: 移动文件失败: {stderr.read().decode('utf-8').strip()}")
+        # 复用连接池中已认证的 SSH 会话，避免每次更新都重新握手
+        return get_session(config).run(do_update)
 
     except paramiko.AuthenticationException:
         logging.error(f"OpenWRT 更新: SSH 认证失败，请检查用户名和密码。")
     except Exception as e:
         logging.error(f"OpenWRT 更新: 发生错误: {e}")
+    return False
 
-def _process_adguard_content(content: str, new_ip: str) -> tuple[str, bool]:
+def _indent(line: str) -> int:
+    return len(line) - len(line.lstrip(' '))
+
+
+def _find_rewrites_block(lines: list[str]):
+    """
+    在 AdGuard Home 配置文件的各行中定位 filtering.rewrites 列表。
+    返回 (rewrites 键所在行号, 列表结束行号)，找不到时返回 None。
+    只按缩进识别层级，不解析整个 YAML 文档。
     """
-    处理 AdGuard Home 配置文件内容，替换 rewrites 列表中的 IP 地址。
+    filtering_indent = None
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('#'):
+            continue
+        indent = _indent(line)
+        if filtering_indent is not None and indent <= filtering_indent:
+            # 已离开 filtering 节
+            filtering_indent = None
+        if filtering_indent is None:
+            if stripped.startswith('filtering:'):
+                filtering_indent = indent
+            continue
+        if not stripped.startswith('rewrites:'):
+            continue
+
+        # 列表项可以与 rewrites 键同级缩进（"- " 开头），也可以更深
+        end = len(lines)
+        for item_index in range(index + 1, len(lines)):
+            item = lines[item_index].strip()
+            if not item or item.startswith('#'):
+                continue
+            item_indent = _indent(lines[item_index])
+            if item_indent < indent or (item_indent == indent and not item.startswith('-')):
+                end = item_index
+                break
+        return index, end
+    return None
+
+
+def _process_adguard_content(content: str, plan) -> tuple[str, bool]:
+    """
+    处理 AdGuard Home 配置文件内容，按分配方案 plan（或单个 IP）替换 filtering.rewrites 列表中的 IP 地址。
+    只逐行改写 rewrites 块中 answer 的值，文件其余部分（过滤规则、客户端、注释和格式）原样保留；
+    同一域名有多条规则时依次使用分配给该域名的各个 IP（文件模式不增删规则）。
     返回 (更新后的内容, 是否有变化)
     """
-    try:
-        data = yaml.safe_load(content)
-        if not isinstance(data, dict):
-            logging.error("AdGuard Home 更新: 配置文件不是一个有效的YAML字典。")
-            return content, False
-        
-        # 使用 setdefault 安全地获取或创建嵌套的键
-        filtering = data.setdefault('filtering', {})
-        rewrites = filtering.setdefault('rewrites', [])
-
-        if not isinstance(rewrites, list):
-            logging.error(f"AdGuard Home 更新: 'filtering.rewrites' 应该是一个列表，但它是 {type(rewrites)}。")
-            return content, False
-
-        if not rewrites:
-            logging.info("AdGuard Home 更新: 'rewrites' 列表为空，没有域名可以更新。请在 AdGuard Home 界面添加 DNS 重写规则。")
-            return content, False
-
-        changed = False
-        for entry in rewrites:
-            if isinstance(entry, dict) and 'domain' in entry:
-                if entry.get('answer') != new_ip:
-                    entry['answer'] = new_ip
-                    changed = True
-        
-        if changed:
-            logging.info(f"AdGuard Home 更新: 已将 {len(rewrites)} 条重写规则的 IP 地址更新为 {new_ip}")
-            return yaml.dump(data, sort_keys=False, allow_unicode=True), True
+    plan = _as_plan(plan)
+    lines = content.splitlines(keepends=True)
+    block = _find_rewrites_block(lines)
+    if block is None:
+        logging.error("AdGuard Home 更新: 配置文件中未找到 'filtering.rewrites'。")
+        return content, False
+
+    key_index, end = block
+    inline = lines[key_index].split(':', 1)[1].split('#', 1)[0].strip()
+    if inline not in ('', '[]'):
+        logging.error(f"AdGuard Home 更新: 不支持内联格式的 'filtering.rewrites': {inline}")
+        return content, False
+
+    # [域名, answer 所在行号]，每个列表项一条
+    entries = []
+    for index in range(key_index + 1, end):
+        line = lines[index]
+        if line.lstrip().startswith('-'):
+            entries.append([None, None])
+        if not entries:
+            continue
+        if _ANSWER_LINE.match(line):
+            entries[-1][1] = index
         else:
-            logging.info("AdGuard Home 更新: 所有重写规则的 IP 地址已是最新，无需更新。")
-            return content, False
+            match = _DOMAIN_LINE.match(line)
+            if match:
+                entries[-1][0] = match.group('value').strip('\'"')
 
-    except yaml.YAMLError as e:
-        logging.error(f"AdGuard Home 更新: 解析 YAML 配置文件时出错: {e}")
+    total = changed = 0
+    domain_counts = {}
+    for domain, index in entries:
+        if index is None:
+            continue
+        total += 1
+        ips = plan.ips_for(domain or '')
+        position = domain_counts.get(domain, 0)
+        domain_counts[domain] = position + 1
+        new_ip = ips[position % len(ips)]
+        match = _ANSWER_LINE.match(lines[index])
+        if match.group('value').strip('\'"') != new_ip:
+            lines[index] = f"{match.group('prefix')}{new_ip}{match.group('eol')}"
+            changed += 1
+
+    if not total:
+        logging.info("AdGuard Home 更新: 'rewrites' 列表为空，没有域名可以更新。请在 AdGuard Home 界面添加 DNS 重写规则。")
+        return content, False
+    if not changed:
+        logging.info("AdGuard Home 更新: 所有重写规则的 IP 地址已是最新，无需更新。")
         return content, False
 
-def update_adguard_hosts(config, best_ip: str):
+    logging.info(f"AdGuard Home 更新: 已更新 {changed}/{total} 条重写规则的 IP 地址，IP 为 {plan.describe()}")
+    return ''.join(lines), True
+
+def update_adguard_hosts(config, best_ip: str, plan: PublishPlan = None):
     """
-    通过 SSH 连接到 OpenWRT 并更新 AdGuard Home 配置文件。
+    通过 SSH 连接到 OpenWRT 并更新 AdGuard Home 配置文件；plan 为各域名的 IP 分配方案，缺省时所有域名都指向 best_ip。
+    成功（包括内容无需更改）返回 True，失败返回 False。
     """
     if not config.getboolean('enabled', fallback=False):
-        return
+        return False
 
     host = config.get('host')
     port = config.getint('port', fallback=22)
-    username = config.get('username')
-    password = config.get('password')
     remote_path = config.get('adguardhome_config_path')
     post_command = config.get('post_update_command', fallback='').strip()
+    plan = (plan or PublishPlan(best_ip)).for_target(config)
 
     if not remote_path:
         logging.error("AdGuard Home 更新: 未在配置文件中找到 'adguardhome_config_path'。")
-        return
+        return False
 
     logging.info(f"AdGuard Home 更新: 准备连接到 {host}:{port} 更新 {remote_path}")
 
+    def do_update(session):
+        sftp = session.sftp()
+        logging.info(f"AdGuard Home 更新: 正在读取远程文件 {remote_path}")
+        with metrics.SSH_OP_SECONDS.time(config.name, 'read'), sftp.open(remote_path, 'r') as remote_file:
+            content = remote_file.read().decode('utf-8')
+
+        updated_content, has_changed = _process_adguard_content(content, plan)
+
+        if not has_changed:
+            logging.info("AdGuard Home 更新: 文件内容无需更改，跳过写入。")
+            return True
+
+        remote_tmp_path = f"/tmp/adguard_update_{os.path.basename(remote_path)}"
+        logging.info(f"AdGuard Home 更新: 正在写入临时文件 {remote_tmp_path}")
+        with metrics.SSH_OP_SECONDS.time(config.name, 'write'), sftp.open(remote_tmp_path, 'w') as remote_file:
+            remote_file.write(updated_content)
+
+        logging.info(f"AdGuard Home 更新: 正在移动临时文件以覆盖原文件")
+        with metrics.SSH_OP_SECONDS.time(config.name, 'exec'):
+            exit_status, _, error = session.exec(f"mv -f {shlex.quote(remote_tmp_path)} {shlex.quote(remote_path)}")
+        if exit_status == 0:
+            logging.info(f"AdGuard Home 更新: 成功更新配置文件，IP 为 {plan.describe()}")
+            if post_command:
+                logging.info(f"AdGuard Home 更新: 正在执行更新后命令: '{post_command}'")
+                with metrics.SSH_OP_SECONDS.time(config.name, 'post_command'):
+                    exit_status, _, error = session.exec(post_command)
+                if exit_status != 0:
+                    logging.error(f"AdGuard Home 更新: 更新后命令执行失败: {error.strip()}")
+                    return False
+            return True
+        logging.error(f"AdGuard Home 更新: 移动文件失败: {error.strip()}")
+        return False
+
     try:
-        with paramiko.SSHClient() as ssh_client:
-            ssh_client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-            ssh_client.connect(hostname=host, port=port, username=username, password=password, timeout=10)
-
-            with ssh_client.open_sftp() as sftp:
-                logging.info(f"AdGuard Home 更新: 正在读取远程文件 {remote_path}")
-                with sftp.open(remote_path, 'r') as remote_file:
-                    content = remote_file.read().decode('utf-8')
-                
-                updated_content, has_changed = _process_adguard_content(content, best_ip)
-                
-                if not has_changed:
-                    logging.info("AdGuard Home 更新: 文件内容无需更改，跳过写入。")
-                    return
-
-                remote_tmp_path = f"/tmp/adguard_update_{os.path.basename(remote_path)}"
-                logging.info(f"AdGuard Home 更新: 正在写入临时文件 {remote_tmp_path}")
-                with sftp.open(remote_tmp_path, 'w') as remote_file:
-                    remote_file.write(updated_content)
-            
-            logging.info(f"AdGuard Home 更新: 正在移动临时文件以覆盖原文件")
-            stdin, stdout, stderr = ssh_client.exec_command(f"mv -f {remote_tmp_path} {remote_path}")
-            if stdout.channel.recv_exit_status() == 0:
-                logging.info(f"AdGuard Home 更新: 成功更新配置文件，IP 为 {best_ip}")
-                if post_command:
-                    logging.info(f"AdGuard Home 更新: 正在执行更新后命令: '{post_command}'")
-                    stdin, stdout, stderr = ssh_client.exec_command(post_command)
-                    if stdout.channel.recv_exit_status() != 0:
-                        logging.error(f"AdGuard Home 更新: 更新后命令执行失败: {stderr.read().decode('utf-8').strip()}")
-            else:
-                logging.error(f"AdGuard Home 更新: 移动文件失败: {stderr.read().decode('utf-8').strip()}")
+        # 复用连接池中已认证的 SSH 会话，避免每次更新都重新握手
+        return get_session(config).run(do_update)
 
     except paramiko.AuthenticationException:
         logging.error(f"AdGuard Home 更新: SSH 认证失败，请检查用户名和密码。")
     except Exception as e:
         logging.error(f"AdGuard Home 更新: 发生错误: {e}")
+    return False
@@ -12,6 +12,7 @@ document.addEventListener('DOMContentLoaded', () => {
         logs: '/api/logs',
         config: '/api/config',
         run_test: '/api/run_test',
+        events: '/api/events?profile=default',
     };
 
     async function fetchData(url, options = {}) {
@@ -32,11 +33,21 @@ document.addEventListener('DOMContentLoaded', () => {
         element.innerHTML = `<p class="error-message">${message}</p>`;
     }
 
+    // 双栈优选时同时显示 IPv6 最优IP
+    let bestIp = null;
+    let bestIpV6 = null;
+
+    function renderBestIP() {
+        bestIpElem.textContent = bestIp ? (bestIpV6 ? `${bestIp} / ${bestIpV6}` : bestIp) : "暂未确定";
+        bestIpElem.classList.remove('error-message');
+    }
+
     async function updateBestIP() {
         try {
             const data = await fetchData(API_ENDPOINTS.best_ip);
-            bestIpElem.textContent = data.best_ip || "暂未确定";
-            bestIpElem.classList.remove('error-message');
+            bestIp = data.best_ip || null;
+            bestIpV6 = data.best_ip_v6 || null;
+            renderBestIP();
         } catch (error) {
             bestIpElem.textContent = "加载失败";
             bestIpElem.classList.add('error-message');
@@ -85,18 +96,61 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    // 日志增量获取：只请求游标之后的新日志，并在前端保留最近 MAX_LOG_LINES 行
+    const MAX_LOG_LINES = 2000;
+    let logCursor = 0;
+    let logLines = [];
+
     async function updateLogs() {
         try {
-            const data = await fetchData(API_ENDPOINTS.logs);
-            logContentElem.textContent = Array.isArray(data) ? data.join('') : data.error || '日志为空。';
-            // Auto-scroll to bottom
-            logContentElem.scrollTop = logContentElem.scrollHeight;
+            const data = await fetchData(`${API_ENDPOINTS.logs}?since=${logCursor}`);
+            if (data.cursor < logCursor) {
+                // 服务已重启，游标失效，从头重新获取
+                logCursor = 0;
+                logLines = [];
+                return updateLogs();
+            }
+            if (data.truncated) {
+                // 有日志已被挤出服务端缓冲区，丢弃本地缓存，避免日志出现断层
+                logLines = [];
+            }
+            logCursor = data.cursor;
+            if (data.lines.length === 0 && logLines.length > 0) {
+                return;
+            }
+            appendLogLines(data.lines);
         } catch (error) {
             logContentElem.textContent = `加载日志失败: ${error.message}`;
             logContentElem.classList.add('error-message');
         }
     }
 
+    // 同一时间只进行一次增量获取；获取期间收到的日志事件在结束后再补一次，避免重复追加
+    let logFetch = null;
+    let logResync = false;
+
+    function syncLogs() {
+        if (logFetch) {
+            logResync = true;
+            return;
+        }
+        logFetch = updateLogs().finally(() => {
+            logFetch = null;
+            if (logResync) {
+                logResync = false;
+                syncLogs();
+            }
+        });
+    }
+
+    function appendLogLines(lines) {
+        logLines = logLines.concat(lines).slice(-MAX_LOG_LINES);
+        logContentElem.textContent = logLines.length > 0 ? logLines.join('') : '日志为空。';
+        logContentElem.classList.remove('error-message');
+        // Auto-scroll to bottom
+        logContentElem.scrollTop = logContentElem.scrollHeight;
+    }
+
     async function updateConfig() {
         try {
             // 直接获取配置文件的原始文本，以保留顺序和注释
@@ -134,19 +188,37 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // 优选任务是否正在运行（由事件流更新），运行期间按钮显示进度
+    let runActive = false;
+    const PHASE_NAMES = { starting: '准备中', latency: '延迟测速', download: '下载测速', parsing: '解析结果' };
+
+    function showRunProgress(data) {
+        const phase = PHASE_NAMES[data.phase] || '正在优选';
+        runTestBtn.textContent = data.total ? `${phase} ${data.done}/${data.total}` : `${phase}...`;
+    }
+
+    function finishRun() {
+        runActive = false;
+        runTestBtn.textContent = '立即优选';
+    }
+
     runTestBtn.addEventListener('click', async () => {
         runTestBtn.disabled = true;
         runTestBtn.textContent = '正在优选...';
         try {
             const result = await fetchData(API_ENDPOINTS.run_test, { method: 'POST' });
             console.log(result.message); // 在控制台输出提示，避免弹窗打扰
-            // Give some time for the backend to process before refreshing
-            setTimeout(updateDynamicData, 3000);
+            if (pollTimer) {
+                // Give some time for the backend to process before refreshing
+                setTimeout(updateDynamicData, 3000);
+            }
         } catch (error) {
             alert(`启动优选任务失败: ${error.message}`);
         } finally {
             runTestBtn.disabled = false;
-            runTestBtn.textContent = '立即优选';
+            if (!runActive) {
+                runTestBtn.textContent = '立即优选';
+            }
         }
     });
     
@@ -154,13 +226,82 @@ document.addEventListener('DOMContentLoaded', () => {
     function updateDynamicData() {
         updateBestIP();
         updateResults();
-        updateLogs();
+        syncLogs();
+    }
+
+    // 无法使用事件流时回退为每 10 秒轮询
+    let pollTimer = null;
+    function startPolling() {
+        if (pollTimer) {
+            return;
+        }
+        updateDynamicData();
+        pollTimer = setInterval(updateDynamicData, 10000);
+    }
+
+    // 通过 /api/events (Server-Sent Events) 接收服务端推送，数据变化时立即更新，空闲时不产生请求
+    function connectEvents() {
+        const source = new EventSource(API_ENDPOINTS.events);
+        let loaded = false;
+
+        source.addEventListener('open', () => {
+            // 首次连接后再加载数据，避免错过连接建立前发生的变化；重连时浏览器会带上 Last-Event-ID 续传
+            if (!loaded) {
+                loaded = true;
+                updateDynamicData();
+            }
+        });
+        source.addEventListener('error', () => {
+            // 网络中断时浏览器会自动重连（readyState 为 CONNECTING）；
+            // 被服务端拒绝（如订阅者已达上限返回 503）时连接关闭且不再重连，改为轮询
+            if (source.readyState === EventSource.CLOSED) {
+                console.warn('事件流连接已关闭，改为每 10 秒轮询');
+                startPolling();
+            }
+        });
+        source.addEventListener('reset', () => {
+            // 断线太久或服务已重启，缺失的事件无法补发，重新获取完整数据
+            updateDynamicData();
+        });
+        source.addEventListener('best_ip', (event) => {
+            const data = JSON.parse(event.data);
+            if (data.family === 6) {
+                bestIpV6 = data.best_ip || null;
+            } else {
+                bestIp = data.best_ip || null;
+            }
+            renderBestIP();
+        });
+        source.addEventListener('results', () => {
+            updateResults();
+        });
+        source.addEventListener('log', (event) => {
+            const data = JSON.parse(event.data);
+            if (logFetch || data.cursor !== logCursor) {
+                // 日志有断层（或正在补齐），按游标增量获取
+                syncLogs();
+                return;
+            }
+            logCursor = data.cursor + 1;
+            appendLogLines([data.line]);
+        });
+        source.addEventListener('run_started', () => {
+            runActive = true;
+            runTestBtn.textContent = '正在优选...';
+        });
+        source.addEventListener('run_progress', (event) => {
+            runActive = true;
+            showRunProgress(JSON.parse(event.data));
+        });
+        source.addEventListener('run_finished', finishRun);
     }
 
-    // Initial load
-    updateDynamicData(); // 首次加载动态数据
     updateConfig();      // 首次加载配置，之后不再定时刷新
 
-    // Periodically refresh data every 10 seconds
-    setInterval(updateDynamicData, 10000);
+    if (window.EventSource) {
+        connectEvents();
+    } else {
+        // 不支持 EventSource 的浏览器回退为轮询
+        startPolling();
+    }
 });
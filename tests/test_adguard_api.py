@@ -0,0 +1,38 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_adguard_api.py
+from src.adguard_api import diff_rewrites
+
+
+def _rule(domain, answer):
+    return {'domain': domain, 'answer': answer}
+
+
+def test_no_changes_when_up_to_date():
+    current = [_rule('a.com', '1.1.1.1'), _rule('a.com', '1.1.1.2')]
+    assert diff_rewrites(current, {'a.com': ['1.1.1.2', '1.1.1.1']}) == ([], [], [])
+
+
+def test_changed_answer_is_updated_in_place():
+    updates, adds, deletes = diff_rewrites([_rule('a.com', '1.1.1.1')], {'a.com': ['2.2.2.2']})
+    assert updates == [(_rule('a.com', '1.1.1.1'), _rule('a.com', '2.2.2.2'))]
+    assert adds == [] and deletes == []
+
+
+def test_extra_answers_are_added():
+    updates, adds, deletes = diff_rewrites([_rule('a.com', '1.1.1.1')], {'a.com': ['1.1.1.1', '2.2.2.2', '::1']})
+    assert updates == [] and deletes == []
+    assert adds == [_rule('a.com', '2.2.2.2'), _rule('a.com', '::1')]
+
+
+def test_surplus_answers_are_deleted():
+    current = [_rule('a.com', '1.1.1.1'), _rule('a.com', '1.1.1.2'), _rule('a.com', '1.1.1.3')]
+    updates, adds, deletes = diff_rewrites(current, {'a.com': ['1.1.1.3', '9.9.9.9']})
+    assert updates == [(_rule('a.com', '1.1.1.1'), _rule('a.com', '9.9.9.9'))]
+    assert deletes == [_rule('a.com', '1.1.1.2')]
+    assert adds == []
+
+
+def test_new_domain_is_added_and_unmanaged_domains_untouched():
+    current = [_rule('other.com', '1.1.1.1')]
+    updates, adds, deletes = diff_rewrites(current, {'a.com': ['2.2.2.2']})
+    assert updates == [] and deletes == []
+    assert adds == [_rule('a.com', '2.2.2.2')]
@@ -0,0 +1,76 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_assignment.py
+import configparser
+
+from src.assignment import PublishPlan, build_plan, select_pool
+from src.results import COL_IP, COL_LATENCY, COL_LOSS
+
+DOMAINS = [f"host{i}.example.com" for i in range(200)]
+
+
+def _row(ip, latency, loss='0.00'):
+    return {COL_IP: ip, COL_LATENCY: str(latency), COL_LOSS: loss}
+
+
+def _config(**publish):
+    config = configparser.ConfigParser()
+    config['Publish'] = {'policy': 'spread', **publish}
+    return config
+
+
+def test_select_pool_filters_by_loss_and_latency():
+    rows = [_row('1.1.1.1', 100), _row('1.1.1.2', 115), _row('1.1.1.3', 130), _row('1.1.1.4', 105, '0.10')]
+    assert select_pool(rows, top_k=10, score_tolerance=0.2) == ['1.1.1.1', '1.1.1.2']
+
+
+def test_assignment_is_deterministic():
+    pool = ['1.1.1.1', '1.1.1.2', '1.1.1.3']
+    first = PublishPlan('1.1.1.1', pool, records_per_domain=2)
+    second = PublishPlan('1.1.1.1', list(reversed(pool)), records_per_domain=2)
+    for domain in DOMAINS:
+        ips = first.ips_for(domain)
+        assert len(ips) == 2 and set(ips) <= set(pool)
+        assert ips == second.ips_for(domain)
+
+
+def test_removing_an_ip_only_moves_its_domains():
+    pool = ['1.1.1.1', '1.1.1.2', '1.1.1.3', '1.1.1.4']
+    before = PublishPlan('1.1.1.1', pool)
+    after = PublishPlan('1.1.1.1', [ip for ip in pool if ip != '1.1.1.3'])
+    moved = 0
+    for domain in DOMAINS:
+        old, new = before.ips_for(domain), after.ips_for(domain)
+        if old == ['1.1.1.3']:
+            moved += 1
+        else:
+            assert new == old
+    assert moved > 0
+
+
+def test_adding_an_ip_only_moves_domains_to_it():
+    pool = ['1.1.1.1', '1.1.1.2', '1.1.1.3']
+    before = PublishPlan('1.1.1.1', pool)
+    after = PublishPlan('1.1.1.1', pool + ['1.1.1.9'])
+    for domain in DOMAINS:
+        new = after.ips_for(domain)
+        assert new == before.ips_for(domain) or new == ['1.1.1.9']
+
+
+def test_domains_spread_across_pool():
+    plan = PublishPlan('1.1.1.1', ['1.1.1.1', '1.1.1.2', '1.1.1.3'])
+    counts = {}
+    for domain in DOMAINS:
+        ip = plan.ips_for(domain)[0]
+        counts[ip] = counts.get(ip, 0) + 1
+    assert len(counts) == 3 and min(counts.values()) > 30
+
+
+def test_build_plan_single_policy_uses_best_ip():
+    config = _config(policy='single')
+    plan = build_plan(config, '1.1.1.1', [_row('1.1.1.1', 100), _row('1.1.1.2', 101)])
+    assert plan.ips_for('a.example.com') == ['1.1.1.1']
+
+
+def test_build_plan_spread_keeps_best_ip_in_pool():
+    rows = [_row('1.1.1.2', 100), _row('1.1.1.3', 101)]
+    plan = build_plan(_config(top_k='2'), '1.1.1.1', rows)
+    assert plan.pool[0] == '1.1.1.1' and len(plan.pool) == 2
@@ -0,0 +1,82 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_autotune.py
+import configparser
+
+import pytest
+
+from src import autotune
+from src.autotune import WINDOW_IPS, ConcurrencyTuner
+
+
+@pytest.fixture(autouse=True)
+def idle_host(monkeypatch):
+    monkeypatch.setattr(autotune, 'host_load', lambda: 0.1)
+
+
+@pytest.fixture
+def tuner(tmp_path):
+    tuner = ConcurrencyTuner(str(tmp_path / 'autotune.json'), 200)
+    config = configparser.ConfigParser()
+    config['cfst'] = {'autotune_min': '50', 'autotune_max': '400', 'autotune_step': '50'}
+    tuner.configure(config['cfst'])
+    return tuner
+
+
+def _scan(tuner, concurrency, yields):
+    """模拟一次扫描：yields 为每个窗口（WINDOW_IPS 个 IP）的可用率"""
+    sample = tuner.start(concurrency)
+    done = valid = 0
+    for value in yields:
+        done += WINDOW_IPS
+        valid += round(WINDOW_IPS * value)
+        sample.on_progress(done, valid)
+    tuner.record(sample)
+    return tuner.history[-1] if tuner.history else None
+
+
+def test_small_scans_are_ignored(tuner):
+    _scan(tuner, 200, [0.5])
+    assert tuner.concurrency == 200 and not tuner.history
+
+
+def test_healthy_scans_step_up_to_maximum(tuner):
+    for expected in (250, 300, 350, 400, 400):
+        entry = _scan(tuner, tuner.concurrency, [0.5] * 9)
+        assert entry['reason'] == ''
+        assert tuner.concurrency == expected
+
+
+def test_late_yield_drop_backs_off_and_sets_ceiling(tuner):
+    _scan(tuner, 200, [0.5] * 9)
+    entry = _scan(tuner, 250, [0.5] * 6 + [0.2] * 3)
+    assert entry['reason']
+    assert tuner.concurrency == 187 and tuner.ceiling == 250
+    # 之后的扫描不超过上限 - step
+    _scan(tuner, tuner.concurrency, [0.5] * 9)
+    _scan(tuner, tuner.concurrency, [0.5] * 9)
+    assert tuner.concurrency == 200
+
+
+def test_yield_below_lower_concurrency_backs_off(tuner):
+    _scan(tuner, 200, [0.5] * 9)
+    entry = _scan(tuner, 250, [0.3] * 9)
+    assert entry['reason'] and tuner.concurrency == 187
+
+
+def test_high_host_load_backs_off(tuner, monkeypatch):
+    monkeypatch.setattr(autotune, 'host_load', lambda: 5.0)
+    entry = _scan(tuner, 200, [0.5] * 9)
+    assert entry['peak_load'] == 5.0 and entry['reason']
+    assert tuner.concurrency == 150
+
+
+def test_budget_reduced_scan_does_not_step_up(tuner):
+    _scan(tuner, 100, [0.5] * 9)
+    assert tuner.concurrency == 200
+
+
+def test_state_survives_restart(tuner):
+    _scan(tuner, 200, [0.5] * 9)
+    restored = ConcurrencyTuner(tuner.path, 100)
+    assert restored.concurrency == 250
+    assert restored.reference == pytest.approx([0.5] * 9)
+    assert len(restored.history) == 1
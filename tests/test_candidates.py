@@ -0,0 +1,71 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_candidates.py
+import ipaddress
+
+import numpy as np
+
+from src.candidates import generate_candidates, ints_to_ips, merge_ranges, parse_cidrs, sample_per_block
+
+
+def _blocks(ips):
+    return {ip.rsplit('.', 1)[0] for ip in ips}
+
+
+def test_ints_to_ips_matches_ipaddress():
+    values = np.array([0, 1, 255, 256, 0x01020304, 0xC0A80001, 0xFFFFFFFF], dtype=np.uint32)
+    assert ints_to_ips(values) == [str(ipaddress.IPv4Address(int(value))) for value in values]
+
+
+def test_merge_ranges_joins_overlapping_and_adjacent():
+    starts, ends, _ = parse_cidrs(['10.0.1.0/24', '10.0.0.0/24', '10.0.0.128/25', '10.0.3.0/24'])
+    merged_starts, merged_ends = merge_ranges(starts, ends)
+    assert ints_to_ips(merged_starts) == ['10.0.0.0', '10.0.3.0']
+    assert ints_to_ips(merged_ends) == ['10.0.1.255', '10.0.3.255']
+
+
+def test_one_ip_per_block_skips_network_and_broadcast():
+    ips = generate_candidates(['104.16.0.0/22'], rng=np.random.default_rng(1))
+    assert len(ips) == 4
+    assert _blocks(ips) == {'104.16.0', '104.16.1', '104.16.2', '104.16.3'}
+    assert all(ip.rsplit('.', 1)[1] not in ('0', '255') for ip in ips)
+
+
+def test_per_block_and_blocklist():
+    ips = generate_candidates(['104.16.0.0/22'], per_block=3, blocklist=['104.16.1.0/24'],
+                              rng=np.random.default_rng(2))
+    assert len(ips) == 9
+    assert '104.16.1' not in _blocks(ips)
+
+
+def test_ipv6_ranges_are_passed_through():
+    ips = generate_candidates(['104.16.0.0/24', '2606:4700::/32', 'bogus'], rng=np.random.default_rng(3))
+    assert ips[-1] == '2606:4700::/32'
+    assert len(ips) == 2
+
+
+def test_integer_weights_scale_per_block():
+    ips = generate_candidates(['104.16.0.0/24', '172.64.0.0/24'], weights={'172.64.0.0/24': 3},
+                              rng=np.random.default_rng(4))
+    assert sum(ip.startswith('104.') for ip in ips) == 1
+    assert sum(ip.startswith('172.') for ip in ips) == 3
+
+
+def test_zero_weight_excludes_range():
+    ips = generate_candidates(['104.16.0.0/24', '172.64.0.0/24'], weights={'172.64.0.0/24': 0},
+                              rng=np.random.default_rng(5))
+    assert ips and all(ip.startswith('104.') for ip in ips)
+
+
+def test_fractional_weight_is_sampled_probabilistically():
+    # 权重 0.5：每个 /24 段以 50% 的概率抽取一个 IP，1024 个段的期望为 512
+    starts, ends, _ = parse_cidrs(['10.0.0.0/14'])
+    ips = sample_per_block(starts, ends, 1, weights=np.array([0.5]), rng=np.random.default_rng(6))
+    assert 400 < ips.size < 624
+    assert np.unique(ips >> 8).size == ips.size
+
+
+def test_fractional_weight_keeps_whole_part():
+    starts, ends, _ = parse_cidrs(['10.0.0.0/16'])
+    ips = sample_per_block(starts, ends, 1, weights=np.array([1.5]), rng=np.random.default_rng(7))
+    per_block = np.bincount((ips >> 8) & 0xFF, minlength=256)
+    assert per_block.min() >= 1 and per_block.max() <= 2
+    assert 256 < ips.size < 512
@@ -0,0 +1,52 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_cluster.py
+import configparser
+import time
+
+import requests
+
+from src.jobqueue import TRIGGER_CRON, RunQueue
+from src.optimizer import CloudflareOptimizer
+from src.state import ProfileState
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+def test_coordinator_job_times_out_while_worker_pending(tmp_path, monkeypatch):
+    polls = []
+    monkeypatch.setattr(requests, 'post', lambda *args, **kwargs: FakeResponse({'job_id': 'job1'}))
+
+    def get(url, **kwargs):
+        polls.append(url)
+        return FakeResponse({'state': 'running'})
+
+    monkeypatch.setattr(requests, 'get', get)
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'cfst': {'mode': 'native', 'params': '-n 10 -ip 104.16.0.0/24 -o result.csv', 'run_timeout': '1'},
+        'History': {'enabled': 'false'},
+        'Cluster': {'role': 'coordinator', 'token': 'secret', 'workers': 'http://worker.invalid:5000',
+                    'include_local': 'false', 'poll_interval': '0.2', 'timeout': '900'},
+    })
+    optimizer = CloudflareOptimizer(config, config_dir=str(tmp_path), state=ProfileState('coordinator'))
+
+    started = time.monotonic()
+    job, _ = RunQueue().submit(optimizer, TRIGGER_CRON)
+    assert job.wait(5)
+    assert job.state == 'timeout'
+    assert time.monotonic() - started < 3
+    assert not optimizer.state.optimizer_lock.locked()
+
+    # 任务结束后不再轮询 worker
+    count = len(polls)
+    assert count >= 1
+    time.sleep(0.5)
+    assert len(polls) == count
@@ -0,0 +1,66 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_events.py
+import pytest
+
+from src.events import EVENT_LOG, EVENT_RESET, EventBus
+
+
+def _bus(count: int, capacity: int = 10) -> EventBus:
+    bus = EventBus(capacity)
+    for index in range(count):
+        bus.publish(EVENT_LOG, {"index": index})
+    return bus
+
+
+def test_read_resumes_after_id():
+    bus = _bus(5)
+    events, reset = bus.read(2, 0)
+    assert not reset
+    assert [event.id for event in events] == [3, 4, 5]
+
+
+def test_read_waits_when_up_to_date():
+    bus = _bus(3)
+    assert bus.read(3, 0.01) == ([], False)
+
+
+def test_read_resets_when_evicted():
+    bus = _bus(15, capacity=10)
+    assert bus.read(4, 0) == ([], True)
+    events, reset = bus.read(5, 0)
+    assert not reset and [event.id for event in events] == list(range(6, 16))
+
+
+def test_read_resets_when_ahead_of_bus():
+    assert _bus(3).read(7, 0) == ([], True)
+
+
+def test_parse_id_checks_epoch():
+    bus = _bus(3)
+    assert bus.parse_id(bus.format_id(2)) == 2
+    # 其他进程（重启前）的 id 与旧的纯数字 id
+    assert bus.parse_id('0-2') == -1
+    assert bus.parse_id('2') == -1
+    assert bus.read(-1, 0) == ([], True)
+    with pytest.raises(ValueError):
+        bus.parse_id(f"{bus.epoch}-x")
+
+
+def test_stream_sends_reset_for_previous_process():
+    bus = _bus(3)
+    stream = bus.stream(bus.parse_id('0-2'), keepalive=0.01)
+    assert next(stream).startswith('retry:')
+    chunk = next(stream)
+    assert f"id: {bus.format_id(3)}\n" in chunk and f"event: {EVENT_RESET}\n" in chunk
+
+
+def test_stream_resumes_and_filters():
+    bus = EventBus()
+    bus.publish('results', {}, profile='a')
+    bus.publish('results', {}, profile='b')
+    bus.publish(EVENT_LOG, {"line": "x"}, profile='b')
+    stream = bus.stream(0, types={'results', EVENT_LOG}, profile='a', keepalive=0.01)
+    next(stream)
+    chunk = next(stream)
+    assert f"id: {bus.format_id(1)}\n" in chunk
+    assert f"id: {bus.format_id(2)}\n" not in chunk
+    assert f"id: {bus.format_id(3)}\n" in chunk
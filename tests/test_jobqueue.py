@@ -0,0 +1,153 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_jobqueue.py
+import configparser
+import socket
+import threading
+
+import pytest
+
+from src.jobqueue import TRIGGER_CRON, TRIGGER_FAILOVER, TRIGGER_MANUAL, TRIGGER_STARTUP, RunQueue
+from src.optimizer import CloudflareOptimizer
+from src.state import ProfileState
+
+WAIT = 5
+
+
+class FakeOptimizer:
+    """run_speed_test 阻塞到 release() 或任务被取消，记录开始顺序"""
+
+    def __init__(self, profile: str, started: list, run_timeout: int = 0):
+        self.profile = profile
+        self.state = ProfileState(profile)
+        self.run_timeout = run_timeout
+        self.started = started
+        self.running = threading.Event()
+        self._release = threading.Event()
+        self.runs = 0
+
+    def release(self):
+        self._release.set()
+
+    def run_speed_test(self, cancel=None):
+        self.runs += 1
+        self.started.append(self.profile)
+        self.running.set()
+        while not self._release.wait(0.01):
+            if cancel.is_set():
+                return False
+        return True
+
+
+def test_requests_coalesce_into_pending_and_running_jobs():
+    queue = RunQueue()
+    optimizer = FakeOptimizer('a', [])
+    job, merged = queue.submit(optimizer, TRIGGER_CRON)
+    assert not merged
+    assert optimizer.running.wait(WAIT)
+
+    again, merged = queue.submit(optimizer, TRIGGER_FAILOVER)
+    assert merged and again is job
+    assert job.coalesced == 1 and job.triggers == [TRIGGER_CRON, TRIGGER_FAILOVER]
+    assert job.priority == 0
+
+    optimizer.release()
+    assert job.wait(WAIT) and job.state == 'succeeded'
+    assert optimizer.runs == 1
+
+
+def test_pending_jobs_start_in_priority_order():
+    queue = RunQueue(max_concurrent=1)
+    started = []
+    blocker = FakeOptimizer('blocker', started)
+    first, _ = queue.submit(blocker, TRIGGER_MANUAL)
+    assert blocker.running.wait(WAIT)
+
+    optimizers = {trigger: FakeOptimizer(trigger, started)
+                  for trigger in (TRIGGER_CRON, TRIGGER_STARTUP, TRIGGER_MANUAL, TRIGGER_FAILOVER)}
+    jobs = [queue.submit(optimizer, trigger)[0] for trigger, optimizer in optimizers.items()]
+    assert queue.status()['depth'] == 4
+    for optimizer in optimizers.values():
+        optimizer.release()
+    blocker.release()
+    assert all(job.wait(WAIT) for job in [first] + jobs)
+    assert started == ['blocker', TRIGGER_FAILOVER, TRIGGER_MANUAL, TRIGGER_STARTUP, TRIGGER_CRON]
+
+
+def test_merge_raises_priority_of_pending_job():
+    queue = RunQueue(max_concurrent=1)
+    started = []
+    blocker = FakeOptimizer('blocker', started)
+    queue.submit(blocker, TRIGGER_MANUAL)
+    assert blocker.running.wait(WAIT)
+    cron, startup = FakeOptimizer('cron', started), FakeOptimizer('startup', started)
+    queue.submit(startup, TRIGGER_STARTUP)
+    job, merged = queue.submit(cron, TRIGGER_CRON)
+    assert not merged
+    assert queue.submit(cron, TRIGGER_FAILOVER)[1]
+    for optimizer in (blocker, cron, startup):
+        optimizer.release()
+    assert job.wait(WAIT)
+    assert started[:2] == ['blocker', 'cron']
+
+
+def test_cancelled_job_is_not_merged():
+    queue = RunQueue()
+    optimizer = FakeOptimizer('a', [])
+    job, _ = queue.submit(optimizer, TRIGGER_CRON)
+    assert optimizer.running.wait(WAIT)
+    assert [item['id'] for item in queue.cancel('a')] == [job.id]
+    assert job.wait(WAIT) and job.state == 'cancelled'
+
+    optimizer.release()
+    second, merged = queue.submit(optimizer, TRIGGER_MANUAL)
+    assert not merged and second.id != job.id
+    assert second.wait(WAIT) and second.state == 'succeeded'
+
+
+def test_job_times_out():
+    queue = RunQueue()
+    optimizer = FakeOptimizer('a', [], run_timeout=1)
+    job, _ = queue.submit(optimizer, TRIGGER_CRON)
+    assert job.wait(WAIT)
+    assert job.state == 'timeout'
+
+
+@pytest.fixture
+def optimizer(tmp_path):
+    """使用内置引擎测速本机监听端口的真实优选器"""
+    server = socket.socket()
+    server.bind(('127.0.0.1', 0))
+    server.listen(100)
+    threading.Thread(target=lambda: [server.accept()[0].close() for _ in iter(int, 1)], daemon=True).start()
+    config = configparser.ConfigParser()
+    config.read_dict({
+        'cfst': {'mode': 'native', 'params': f"-n 10 -t 1 -tp {server.getsockname()[1]} -ip 127.0.0.1 -dd -o result.csv"},
+        'History': {'enabled': 'false'},
+    })
+    yield CloudflareOptimizer(config, config_dir=str(tmp_path), state=ProfileState('probe'))
+    server.close()
+
+
+def test_job_waits_for_cluster_probe(optimizer):
+    queue = RunQueue()
+    # 模拟集群 worker 正在执行 coordinator 下发的探测任务
+    optimizer.state.optimizer_lock.acquire()
+    job, _ = queue.submit(optimizer, TRIGGER_CRON)
+    assert not job.wait(0.5) and job.state == 'running'
+    assert queue.submit(optimizer, TRIGGER_FAILOVER)[1]
+
+    optimizer.state.optimizer_lock.release()
+    assert job.wait(WAIT) and job.state == 'succeeded'
+    assert optimizer.state.best_ip == '127.0.0.1'
+
+
+def test_job_waiting_for_cluster_probe_can_be_cancelled(optimizer):
+    queue = RunQueue()
+    optimizer.state.optimizer_lock.acquire()
+    try:
+        job, _ = queue.submit(optimizer, TRIGGER_CRON)
+        assert not job.wait(0.2)
+        queue.cancel('probe')
+        assert job.wait(WAIT) and job.state == 'cancelled'
+    finally:
+        optimizer.state.optimizer_lock.release()
+    assert optimizer.state.best_ip is None
@@ -0,0 +1,88 @@
+# d:\桌面\cloudflare-ip-optimizer-main\tests\test_updater.py
+import configparser
+import hashlib
+import io
+import shlex
+
+from src.assignment import PublishPlan
+from src.updater import (END_MARKER, START_MARKER, _install_file, _process_hosts_content, _rewrite_block,
+                         _stream_patch_hosts)
+
+
+def _patch(content: bytes, plan):
+    dst = io.BytesIO()
+    digest = hashlib.sha256()
+    changed, block = _stream_patch_hosts(io.BytesIO(content), dst, plan, digest)
+    output = dst.getvalue()
+    assert digest.hexdigest() == hashlib.sha256(output).hexdigest()
+    return changed, block, output
+
+
+def test_rewrite_block_replaces_ips_and_keeps_comments():
+    lines = ['# 注释', '', 'a.example.com', '1.1.1.1 b.example.com', '9.9.9.9 a.example.com']
+    assert _rewrite_block(lines, PublishPlan('2.2.2.2')) == [
+        '# 注释', '', '2.2.2.2 a.example.com', '2.2.2.2 b.example.com']
+
+
+def test_rewrite_block_writes_one_line_per_record():
+    plan = PublishPlan('1.1.1.1', ['1.1.1.1', '1.1.1.2'], records_per_domain=2, pool_v6=['2606:4700::1'])
+    lines = _rewrite_block(['a.example.com'], plan)
+    assert sorted(lines) == ['1.1.1.1 a.example.com', '1.1.1.2 a.example.com', '2606:4700::1 a.example.com']
+
+
+def test_stream_patch_only_touches_marker_block():
+    content = (f"127.0.0.1 localhost\r\n{START_MARKER}\r\n1.1.1.1 a.example.com\r\n"
+               f"b.example.com\r\n{END_MARKER}\r\n# tail without newline").encode('utf-8')
+    changed, block, output = _patch(content, PublishPlan('2.2.2.2'))
+    assert changed
+    assert block == ['2.2.2.2 a.example.com', '2.2.2.2 b.example.com']
+    assert output == content.replace(b'1.1.1.1 a.example.com\r\nb.example.com',
+                                     b'2.2.2.2 a.example.com\r\n2.2.2.2 b.example.com')
+
+
+def test_stream_patch_unchanged_content_is_identical():
+    content = f"{START_MARKER}\n2.2.2.2 a.example.com\n{END_MARKER}\n".encode('utf-8')
+    changed, block, output = _patch(content, PublishPlan('2.2.2.2'))
+    assert not changed and block == ['2.2.2.2 a.example.com']
+    assert output == content
+
+
+def test_stream_patch_appends_markers_when_missing():
+    changed, block, output = _patch(b"127.0.0.1 localhost", PublishPlan('2.2.2.2'))
+    assert changed and block == []
+    assert output.startswith(b"127.0.0.1 localhost\n\n")
+    assert output.decode('utf-8').rstrip('\n').endswith(END_MARKER)
+
+
+def test_stream_patch_keeps_block_without_end_marker():
+    content = f"{START_MARKER}\n1.1.1.1 a.example.com\n".encode('utf-8')
+    changed, _, output = _patch(content, PublishPlan('2.2.2.2'))
+    assert changed
+    assert output.startswith(content)
+    assert output.count(START_MARKER.encode('utf-8')) == 2
+
+
+def test_stream_patch_matches_in_memory_processing():
+    content = f"# hosts\n{START_MARKER}\nx.example.com\n# keep\n1.1.1.1 y.example.com\n{END_MARKER}\n::1 localhost\n"
+    plan = PublishPlan('3.3.3.3')
+    _, _, output = _patch(content.encode('utf-8'), plan)
+    expected, _ = _process_hosts_content(content, plan)
+    assert output.decode('utf-8') == expected + "\n"
+
+
+class FakeSession:
+    def __init__(self):
+        self.commands = []
+
+    def exec(self, command):
+        self.commands.append(command)
+        return 0, '', ''
+
+
+def test_install_file_quotes_paths():
+    config = configparser.ConfigParser()
+    config['OpenWRT'] = {}
+    session = FakeSession()
+    remote_path = "/etc/my hosts; rm -rf /"
+    assert _install_file(session, config['OpenWRT'], '/tmp/hosts tmp', remote_path, PublishPlan('1.1.1.1'), '')
+    assert shlex.split(session.commands[0]) == ['mv', '/tmp/hosts tmp', remote_path]